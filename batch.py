@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Batch calculation of many portfolios, e.g. of separate clients.
+
+    ./batch.py manifest.json --output-dir results [--workers 4] [--format csv]
+
+Manifest is a JSON list of portfolios, paths relative to the manifest:
+
+    [{"name": "client-1", "files": ["client-1/ib.xml"], "year": 2023},
+     {"name": "client-2", "files": ["client-2/trades.csv"], "years": "2021-2023",
+      "tax": "PL_NBP_FIFO", "fifo_engine": "lots", "storage": "objects",
+      "snapshot_in": "client-2/snapshot.json"}]
+
+Exchange rates are loaded once, before worker processes are started, and
+shared read-only by all of them. Each portfolio is written to its own
+`<name>.json` (`Calculator.results`) or `<name>.csv` (summary row per tax
+year) as soon as it's done. Failures, including invalid manifest entries,
+are recorded in `batch.json` along with results of the other portfolios,
+which are calculated anyway.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+from calc_trades import parse_years
+from calculation import Calculator
+from corporate_actions import DEFAULT_FILE
+from ingest import ParseCache
+from taxations import SUPPORTED_TAXATIONS
+from tradelog import TradeLog
+from utils import logger
+
+OUTPUT_FORMATS = ("json", "csv")
+
+# Worker process calculator, set by `init_worker`
+calculator: Optional[Calculator] = None
+
+
+class Portfolio(NamedTuple):
+    name: str
+    files: List[str]
+    # None for every year trades were done in
+    tax_years: Optional[List[int]]
+    tax: str = "PL_NBP_FIFO"
+    fifo_engine: str = "lots"
+    storage: str = "objects"
+    snapshot_in: Optional[str] = None
+    # Invalid manifest entry, reported as portfolio status without calculating
+    error: Optional[str] = None
+
+
+def manifest_portfolio(name: str, entry: dict, directory: Path) -> Portfolio:
+    if "years" in entry:
+        tax_years = parse_years(str(entry["years"]))
+    else:
+        tax_years = [int(entry["year"])]
+    files = entry["files"]
+    if not isinstance(files, list):
+        raise TypeError("files must be a list")
+    return Portfolio(
+        name=name,
+        files=[str(directory / file) for file in files],
+        tax_years=tax_years,
+        tax=entry.get("tax", "PL_NBP_FIFO"),
+        fifo_engine=entry.get("fifo_engine", "lots"),
+        storage=entry.get("storage", "objects"),
+        snapshot_in=(
+            str(directory / entry["snapshot_in"]) if entry.get("snapshot_in") else None
+        ),
+    )
+
+
+def load_manifest(filename) -> List[Portfolio]:
+    """
+    Portfolios of JSON manifest, see module docstring. Invalid entries are
+    kept with their `error`, the manifest is rejected only if portfolios
+    can't be told apart.
+    """
+    directory = Path(filename).parent
+    with open(filename) as f:
+        entries = json.load(f)
+
+    portfolios = []
+    for entry in entries:
+        name = entry["name"]
+        # Name of result files
+        assert name and Path(name).name == name, f"Invalid portfolio name {name!r}"
+        try:
+            portfolio = manifest_portfolio(name, entry, directory)
+        except (KeyError, TypeError, ValueError) as e:
+            portfolio = Portfolio(name, [], None, error=f"{type(e).__name__}: {e}")
+        portfolios.append(portfolio)
+
+    names = [portfolio.name for portfolio in portfolios]
+    duplicates = {name for name in names if names.count(name) > 1}
+    assert not duplicates, f"Duplicate portfolio names {sorted(duplicates)}"
+    return portfolios
+
+
+def portfolio_error(portfolio: Portfolio) -> Optional[str]:
+    """Why portfolio can't be calculated, None if it's valid."""
+    if portfolio.error is not None:
+        return portfolio.error
+    if portfolio.tax_years is not None and not portfolio.tax_years:
+        return "No tax years"
+    if portfolio.tax not in SUPPORTED_TAXATIONS:
+        return f"Unknown taxation {portfolio.tax}"
+    if portfolio.fifo_engine not in TradeLog.FIFO_ENGINES:
+        return f"Unknown FIFO engine {portfolio.fifo_engine}"
+    if portfolio.storage not in TradeLog.STORAGES:
+        return f"Unknown storage {portfolio.storage}"
+    return None
+
+
+def summary_rows(results: dict) -> Iterator[Dict]:
+    """Summary of each tax year as flat CSV row, countries as `US.income` etc."""
+    for year, year_results in results["years"].items():
+        row = {"year": year}
+        for field, value in year_results["summary"].items():
+            if field == "countries":
+                for country, breakdown in value.items():
+                    row.update(
+                        (f"{country}.{name}", amount)
+                        for name, amount in breakdown.items()
+                    )
+            else:
+                row[field] = value
+        yield row
+
+
+def write_results(results: dict, filename: Path, output_format: str) -> None:
+    temporary = filename.with_name(f"{filename.name}.{os.getpid()}.tmp")
+    if output_format == "csv":
+        rows = list(summary_rows(results))
+        with open(temporary, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else ["year"])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(temporary, "w") as f:
+            json.dump(results, f, indent=1, default=str)
+    # Complete result or none at all, e.g. if batch is interrupted
+    os.replace(temporary, filename)
+
+
+def init_worker(shared_calculator: Calculator) -> None:
+    global calculator
+    calculator = shared_calculator
+
+
+def calculate_portfolio(args) -> dict:
+    """
+    Process pool worker, writes portfolio results and returns its status:
+    name, output file or error, and time taken.
+    """
+    portfolio, output_dir, output_format = args
+    started = time.perf_counter()
+    status = {"name": portfolio.name}
+    error = portfolio_error(portfolio)
+    if error is not None:
+        logger.error(f"Portfolio {portfolio.name} is invalid: {error}")
+        status.update(status="error", error=error, seconds=0)
+        return status
+    try:
+        results = calculator.calculate(
+            portfolio.files,
+            portfolio.tax,
+            portfolio.tax_years,
+            portfolio.fifo_engine,
+            portfolio.storage,
+            portfolio.snapshot_in,
+        )
+        output = Path(output_dir) / f"{portfolio.name}.{output_format}"
+        write_results(results, output, output_format)
+        status.update(status="ok", output=str(output))
+    except Exception as e:
+        logger.exception(f"Portfolio {portfolio.name} failed")
+        status.update(status="error", error=f"{type(e).__name__}: {e}")
+    status["seconds"] = round(time.perf_counter() - started, 3)
+    return status
+
+
+def run_batch(
+    portfolios: List[Portfolio],
+    output_dir,
+    workers: int = 1,
+    output_format: str = "json",
+    calculator: Optional[Calculator] = None,
+) -> List[dict]:
+    """
+    Calculate portfolios, in a pool of workers if more than one, returns
+    statuses of `calculate_portfolio` in portfolios order, also saved to
+    `batch.json` in output directory.
+    """
+    assert output_format in OUTPUT_FORMATS, f"Unknown output format {output_format}"
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if calculator is None:
+        calculator = Calculator()
+
+    # Rates until the last year of each taxation, loaded before workers fork
+    last_years = {}
+    for portfolio in portfolios:
+        if portfolio.tax_years and portfolio_error(portfolio) is None:
+            last_years[portfolio.tax] = max(
+                last_years.get(portfolio.tax, 0), *portfolio.tax_years
+            )
+    for tax, year in last_years.items():
+        calculator.taxation_template(tax, year, shared=True)
+
+    arguments = [(portfolio, output_dir, output_format) for portfolio in portfolios]
+    statuses = []
+    with (
+        ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker, initargs=(calculator,)
+        )
+        if workers > 1
+        else nullcontext(None)
+    ) as pool:
+        if pool is None:
+            init_worker(calculator)
+            results = map(calculate_portfolio, arguments)
+        else:
+            futures = [pool.submit(calculate_portfolio, args) for args in arguments]
+            results = (future.result() for future in futures)
+        for portfolio in portfolios:
+            try:
+                status = next(results)
+            # Worker process died, e.g. killed for memory, the pool is broken
+            except Exception as e:
+                status = {"name": portfolio.name, "status": "error", "error": repr(e)}
+            logger.info(f"Portfolio {status['name']}: {status['status']}")
+            statuses.append(status)
+
+    with open(output_dir / "batch.json", "w") as f:
+        json.dump(statuses, f, indent=1)
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calculate taxes of many portfolios listed in a manifest."
+    )
+    parser.add_argument("manifest", help="JSON list of portfolios, see batch.py")
+    parser.add_argument("--output-dir", help="results directory", required=True)
+    parser.add_argument(
+        "--format",
+        help="result of each portfolio, JSON with positions or CSV summary rows",
+        choices=OUTPUT_FORMATS,
+        default="json",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of processes calculating portfolios",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--corporate-actions",
+        help="CSV file with splits not included in reports, see the default one",
+        default=DEFAULT_FILE,
+    )
+    parser.add_argument(
+        "--parse-cache",
+        help="reuse events of reports parsed before, see README",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        help="log level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log))
+    statuses = run_batch(
+        load_manifest(args.manifest),
+        args.output_dir,
+        args.workers,
+        args.format,
+        Calculator(args.corporate_actions, ParseCache() if args.parse_cache else None),
+    )
+    failed = [status["name"] for status in statuses if status["status"] != "ok"]
+    logger.info(
+        f"Calculated {len(statuses) - len(failed)} of {len(statuses)} portfolios"
+    )
+    if failed:
+        logger.error(f"Failed portfolios: {', '.join(failed)}")
+        raise SystemExit(1)
@@ -0,0 +1,172 @@
+"""
+Check `PolishNbpRatesFixedPointFIFO` gives results identical to Decimal
+`PolishNbpRatesFIFO` over generated trades, and compare their speed.
+Equivalence is tested at a small size in `tests/test_fixed_point.py`.
+
+    python -m benchmarks.fixed_point [--matches 100000] [--seed 0]
+"""
+
+import argparse
+import datetime
+import random
+import tempfile
+import time
+from decimal import Decimal as D
+from pathlib import Path
+
+from taxations.nbp_rates import NbpRatesStore
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from taxations.polish_nbp_rates_fixed_point_fifo import PolishNbpRatesFixedPointFIFO
+from tradelog import InstrumentType, ScaledColumn, TradeBatch, TradeRecord
+
+YEAR = 2023
+# NBP table column -> rate decimal places
+RATE_COLUMNS = {"1USD": 4, "1EUR": 4, "1CHF": 4, "100JPY": 4, "10000IDR": 4}
+CURRENCIES = ["USD", "EUR", "CHF", "JPY", "IDR", "PLN"]
+EXCHANGES = ["NYSE", "XETRA", "SIX", "WSE"]
+
+
+def random_decimal(max_value: int, max_decimals: int) -> D:
+    decimals = random.randint(0, max_decimals)
+    return D(random.randint(1, max_value * 10**decimals)).scaleb(-decimals)
+
+
+def write_rates_file(filename: Path) -> None:
+    lines = ["data;" + ";".join(RATE_COLUMNS)]
+    day = datetime.date(YEAR - 1, 12, 1)
+    while day.year <= YEAR:
+        if day.weekday() < 5:
+            rates = [
+                str(random_decimal(10, decimals)).replace(".", ",")
+                for decimals in RATE_COLUMNS.values()
+            ]
+            lines.append(day.strftime("%Y%m%d;") + ";".join(rates))
+        day += datetime.timedelta(days=1)
+    filename.write_text("\n".join(lines), encoding="cp1250")
+
+
+def random_trade(side: int) -> TradeRecord:
+    instrument = random.choice([InstrumentType.STOCK, InstrumentType.OPTION])
+    price = random_decimal(5000, 6)
+    # Split adjusted prices keep whole Decimal context precision
+    if random.random() < 0.01:
+        price = price * 2 / 3
+    return TradeRecord(
+        symbol=random.choice(["AAPL", "SAP", "NESN", "PKN"]),
+        exchange=random.choice(EXCHANGES),
+        account="TEST",
+        quantity=random.choice([random.randint(1, 1000), random_decimal(100, 4)]),
+        price=price,
+        currency=random.choice(CURRENCIES),
+        timestamp=datetime.datetime(YEAR, 1, 2)
+        + datetime.timedelta(minutes=random.randint(0, 362 * 24 * 60)),
+        side=side,
+        instrument=instrument,
+        commission=random_decimal(20, 2),
+    )
+
+
+def generate_matches(count: int):
+    matches = []
+    for _ in range(count):
+        side = random.choice([TradeRecord.BUY, TradeRecord.SELL])
+        open_trade, close_trade = random_trade(side), random_trade(-side)
+        quantity = min(open_trade.quantity, close_trade.quantity)
+        matches.append((open_trade, close_trade, quantity))
+    return matches
+
+
+def state(taxation):
+    return (
+        [getattr(taxation, total) for total in taxation.TOTALS],
+        taxation.per_position_profit,
+        taxation.per_country_trades_breakdown,
+    )
+
+
+def batch_matches(matches):
+    """Matches as TradeBatch rows, the way columnar TradeLog passes them."""
+    batch = TradeBatch()
+    quantities = ScaledColumn(batch.quantities.decimals)
+    rows_matches = []
+    for open_trade, close_trade, quantity in matches:
+        quantities.append(quantity)
+        rows_matches.append(
+            (
+                batch.append_record(open_trade),
+                batch.append_record(close_trade),
+                quantities.values[-1],
+                quantities.exponents[-1],
+            )
+        )
+    return batch, rows_matches
+
+
+def add_trades(taxation, match):
+    taxation.add_closed_transaction(*match)
+
+
+def add_rows(taxation, match):
+    taxation.add_closed_rows(*match)
+
+
+def measure(taxation, add, matches):
+    started = time.perf_counter()
+    for match in matches:
+        add(taxation, match)
+    return time.perf_counter() - started
+
+
+def compare(store, name, add, matches):
+    taxations = []
+    for taxation_class in (PolishNbpRatesFIFO, PolishNbpRatesFixedPointFIFO):
+        taxation = taxation_class(YEAR)
+        taxation.rates_store = store
+        taxation.rates = store.table()
+        taxations.append(taxation)
+    decimal_taxation, fixed_point_taxation = taxations
+
+    # Match by match first, so the first difference is reported
+    for match in matches[:1000]:
+        for taxation in taxations:
+            add(taxation, match)
+        fixed_point_taxation.flush_grosze()
+        assert state(decimal_taxation) == state(
+            fixed_point_taxation
+        ), f"{name} results differ for {match}"
+
+    decimal_time = measure(decimal_taxation, add, matches)
+    fixed_point_time = measure(fixed_point_taxation, add, matches)
+    fixed_point_taxation.flush_grosze()
+    assert str(state(decimal_taxation)) == str(
+        state(fixed_point_taxation)
+    ), f"{name} results differ"
+    print(
+        f"{len(matches)} matches from {name}: Decimal {decimal_time:.3f}s, "
+        f"fixed-point {fixed_point_time:.3f}s "
+        f"({decimal_time / fixed_point_time:.1f}x), results identical"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matches", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        rates_file = Path(directory) / f"nbp_rates_{YEAR}.csv"
+        write_rates_file(rates_file)
+        store = NbpRatesStore(Path(directory) / "rates.sqlite3")
+        store.import_file(rates_file)
+
+        matches = generate_matches(args.matches)
+        batch, rows_matches = batch_matches(matches)
+        compare(store, "TradeRecords", add_trades, matches)
+        compare(
+            store,
+            "TradeBatch rows",
+            add_rows,
+            [(batch, *match) for match in rows_matches],
+        )
@@ -0,0 +1,478 @@
+"""
+Synthetic broker reports and NBP rates fixture for benchmarks, written as
+streams so they scale from a thousand to tens of millions of trades.
+
+Trades follow a position per instrument: positions are opened long or
+short, added to and closed partially or fully, orders are split into partial
+fills, options are traded next to stocks. Dividends are accrued for long and
+short positions, with IB's duplicated and reversed accruals.
+
+    python -m benchmarks.generators OUTPUT_DIR [--trades 10000] [--symbols 200]
+"""
+
+import argparse
+import datetime
+import itertools
+import math
+import random
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Exchange -> currency, every one of them has NBP rates
+EXCHANGES = {
+    "NASDAQ": "USD",
+    "NYSE": "USD",
+    "ARCA": "USD",
+    "XETRA": "EUR",
+    "IBIS": "EUR",
+    "SBF": "EUR",
+    "LSE": "GBP",
+    "SIX": "CHF",
+    "TMX": "CAD",
+    "WSE": "PLN",
+}
+# NBP table column -> starting rate
+NBP_COLUMNS = {
+    "1USD": 4.0,
+    "1EUR": 4.5,
+    "1CHF": 4.3,
+    "1GBP": 5.1,
+    "1CAD": 3.0,
+    "100JPY": 3.4,
+}
+OPTION_SHARE = 0.1
+SHORT_SHARE = 0.2
+PARTIAL_FILL_SHARE = 0.15
+
+
+class Instrument(NamedTuple):
+    symbol: str
+    exchange: str
+    currency: str
+    option: bool
+
+
+class Fill(NamedTuple):
+    instrument: Instrument
+    timestamp: datetime.datetime
+    # Signed, negative for sells
+    quantity: int
+    price: float
+    commission: float
+
+
+class Dividend(NamedTuple):
+    instrument: Instrument
+    pay_date: datetime.date
+    # Negative for short positions
+    gross_amount: float
+    tax: float
+
+
+def make_instruments(count: int, rnd: random.Random) -> List[Instrument]:
+    instruments = []
+    exchanges = list(EXCHANGES)
+    for number in range(count):
+        exchange = rnd.choice(exchanges)
+        symbol = f"S{number:05d}"
+        if rnd.random() < OPTION_SHARE:
+            strike = rnd.randint(10, 500)
+            expiry = datetime.date(2020, 1, 17) + datetime.timedelta(
+                weeks=4 * rnd.randint(0, 60)
+            )
+            right = rnd.choice("CP")
+            symbol = f"{symbol} {expiry:%y%m%d}{right}{strike * 1000:08d}"
+            instruments.append(Instrument(symbol, "CBOE", "USD", True))
+        else:
+            instruments.append(Instrument(symbol, exchange, EXCHANGES[exchange], False))
+    return instruments
+
+
+def generate_activity(
+    trades: int,
+    symbols: int,
+    first_year: int,
+    last_year: int,
+    seed: int = 0,
+) -> Iterator[Tuple[Optional[Fill], Optional[Dividend]]]:
+    """
+    Fills and dividends in time order, about `trades` fills of `symbols`
+    instruments between first and last year.
+    """
+    rnd = random.Random(seed)
+    instruments = make_instruments(symbols, rnd)
+    # Few instruments are traded much more than the others
+    cum_weights = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(len(instruments)))
+    )
+    positions: Dict[Instrument, int] = {}
+    prices = {
+        i: rnd.uniform(1, 20) if i.option else rnd.uniform(5, 500) for i in instruments
+    }
+
+    start = datetime.datetime(first_year, 1, 2, 9, 30)
+    end = datetime.datetime(last_year, 12, 30, 22)
+    mean_step = (end - start).total_seconds() / max(trades, 1)
+    timestamp = start
+    next_dividends = start + datetime.timedelta(days=91)
+
+    generated = 0
+    while generated < trades:
+        # Spread evenly over years, after fills of the previous order
+        timestamp = max(
+            timestamp + datetime.timedelta(seconds=4),
+            start + datetime.timedelta(seconds=(generated + rnd.random()) * mean_step),
+        )
+        # Quarterly dividends of stock positions held
+        if timestamp >= next_dividends:
+            for instrument, position in positions.items():
+                if position and not instrument.option:
+                    gross = math.copysign(
+                        max(
+                            1.0,
+                            abs(position)
+                            * prices[instrument]
+                            * rnd.uniform(0.002, 0.01),
+                        ),
+                        position,
+                    )
+                    yield None, Dividend(
+                        instrument,
+                        next_dividends.date(),
+                        gross,
+                        -abs(gross) * 0.15,
+                    )
+            next_dividends += datetime.timedelta(days=91)
+
+        instrument = rnd.choices(instruments, cum_weights=cum_weights)[0]
+        position = positions.get(instrument, 0)
+        lot = (
+            rnd.choice([1, 2, 5, 10, 25, 100])
+            if not instrument.option
+            else rnd.randint(1, 5)
+        )
+        if position == 0:
+            quantity = -lot if rnd.random() < SHORT_SHARE else lot
+        elif rnd.random() < 0.55:
+            # Close partially or fully
+            quantity = -int(math.copysign(min(lot, abs(position)), position))
+            if rnd.random() < 0.3:
+                quantity = -position
+        else:
+            quantity = int(math.copysign(lot, position))
+        positions[instrument] = position + quantity
+
+        price = prices[instrument] = max(0.01, prices[instrument] * rnd.gauss(1, 0.02))
+        fills = 1
+        if abs(quantity) > 1 and rnd.random() < PARTIAL_FILL_SHARE:
+            fills = rnd.randint(2, min(4, abs(quantity)))
+        left = quantity
+        for fill in range(fills):
+            fill_quantity = left if fill == fills - 1 else int(quantity / fills)
+            left -= fill_quantity
+            yield Fill(
+                instrument,
+                timestamp + datetime.timedelta(seconds=fill),
+                fill_quantity,
+                price * rnd.uniform(0.999, 1.001),
+                rnd.uniform(0.3, 2.0),
+            ), None
+            generated += 1
+
+
+def write_ib_flex_query(
+    filename: Path,
+    trades: int,
+    symbols: int = 200,
+    first_year: int = 2020,
+    last_year: int = 2023,
+    seed: int = 0,
+    account: str = "U1234567",
+) -> None:
+    """IB Flex Query XML with trades, commissions, interests and dividends."""
+    rnd = random.Random(seed)
+    dividends = []
+    # Spooled to disk, there's one for every tenth trade
+    with open(
+        filename, "w", encoding="utf-8", buffering=1 << 20
+    ) as f, tempfile.TemporaryFile("w+", encoding="utf-8") as commission_details:
+        f.write(
+            '<FlexQueryResponse queryName="tax" type="AF">\n<FlexStatements count="1">\n'
+            f'<FlexStatement accountId="{account}" fromDate="{first_year}0101" toDate="{last_year}1231">\n'
+            "<Trades>\n"
+        )
+        for fill, dividend in generate_activity(
+            trades, symbols, first_year, last_year, seed
+        ):
+            if dividend:
+                dividends.append(dividend)
+                continue
+
+            instrument = fill.instrument
+            side = "BUY" if fill.quantity > 0 else "SELL"
+            f.write(
+                f'<Trade accountId="{account}" currency="{instrument.currency}"'
+                f' assetCategory="{"OPT" if instrument.option else "STK"}"'
+                f' symbol="{instrument.symbol}"'
+                f' listingExchange="{"" if instrument.option else instrument.exchange}"'
+                f' underlyingListingExchange="{instrument.exchange if instrument.option else ""}"'
+                f' dateTime="{fill.timestamp:%Y%m%d;%H%M%S}" quantity="{fill.quantity}"'
+                f' tradePrice="{fill.price:.4f}" ibCommission="-{fill.commission:.2f}"'
+                f' ibCommissionCurrency="{instrument.currency}" buySell="{side}" />\n'
+            )
+            # Lots of closing trades and unsupported trades in between
+            if rnd.random() < 0.05:
+                f.write(
+                    f'<Lot accountId="{account}" symbol="{instrument.symbol}" quantity="{fill.quantity}" />\n'
+                )
+            if rnd.random() < 0.001:
+                f.write(
+                    f'<Trade accountId="{account}" currency="USD" assetCategory="CASH"'
+                    ' symbol="EUR.USD" listingExchange="" underlyingListingExchange=""'
+                    f' dateTime="{fill.timestamp:%Y%m%d;%H%M%S}" quantity="1000"'
+                    ' tradePrice="1.1" ibCommission="-2" ibCommissionCurrency="USD" buySell="BUY" />\n'
+                )
+            if rnd.random() < 0.1:
+                commission_details.write(
+                    f'<UnbundledCommissionDetail currency="{instrument.currency}"'
+                    f' dateTime="{fill.timestamp:%Y%m%d;%H%M%S}"'
+                    f' totalCommission="-{rnd.uniform(0.01, 1):.2f}" />\n'
+                )
+
+        f.write("</Trades>\n<UnbundledCommissionDetails>\n")
+        commission_details.seek(0)
+        shutil.copyfileobj(commission_details, f)
+        f.write("</UnbundledCommissionDetails>\n<InterestAccruals>\n")
+        for year in range(last_year, first_year - 1, -1):
+            f.write(
+                f'<InterestAccrualsCurrency currency="USD" toDate="{year}1231" accrualReversal="{rnd.uniform(0, 5):.2f}" />\n'
+                f'<InterestAccrualsCurrency currency="BASE_SUMMARY" toDate="{year}1231" accrualReversal="-{rnd.uniform(0, 50):.2f}" />\n'
+            )
+        f.write("</InterestAccruals>\n<ChangeInDividendAccruals>\n")
+        for dividend in dividends:
+            # Posted twice and reversed, like in real reports
+            for code in ("Po", "Po", "Re"):
+                f.write(
+                    f'<ChangeInDividendAccrual currency="{dividend.instrument.currency}"'
+                    f' symbol="{dividend.instrument.symbol}" payDate="{dividend.pay_date:%Y%m%d}"'
+                    f' grossAmount="{dividend.gross_amount:.2f}" tax="{dividend.tax:.2f}" code="{code}" />\n'
+                )
+        f.write(
+            "</ChangeInDividendAccruals>\n</FlexStatement>\n</FlexStatements>\n</FlexQueryResponse>\n"
+        )
+
+
+def write_exante_reports(
+    trades_filename: Path,
+    transactions_filename: Path,
+    trades: int,
+    symbols: int = 100,
+    first_year: int = 2020,
+    last_year: int = 2023,
+    seed: int = 0,
+    account: str = "ABC1234.001",
+) -> None:
+    """Exante trades (tab separated) and all transactions CSV reports."""
+    rnd = random.Random(seed)
+    with open(trades_filename, "w", encoding="utf-8", buffering=1 << 20) as f, open(
+        transactions_filename, "w", encoding="utf-8", buffering=1 << 20
+    ) as t:
+        f.write(
+            "Time\tAccount ID\tSide\tSymbol ID\tISIN\tType\tPrice\tCurrency"
+            "\tQuantity\tCommission\tCommission Currency\tP&L\tTraded Volume\n"
+        )
+        t.write(
+            "Transaction ID,Account ID,Symbol ID,ISIN,Operation type,When,Sum,Asset,EUR equivalent,Comment\n"
+        )
+        transaction_id = 0
+
+        def transaction(
+            symbol_id, operation, timestamp, value, currency, comment="None"
+        ):
+            nonlocal transaction_id
+            transaction_id += 1
+            t.write(
+                f"{transaction_id},{account},{symbol_id},None,{operation},"
+                f"{timestamp:%Y-%m-%d %H:%M:%S},{value:.2f},{currency},0,{comment}\n"
+            )
+
+        for fill, dividend in generate_activity(
+            trades, symbols, first_year, last_year, seed
+        ):
+            if dividend:
+                instrument = dividend.instrument
+                timestamp = datetime.datetime.combine(
+                    dividend.pay_date, datetime.time(8)
+                )
+                symbol_id = f"{instrument.symbol}.{instrument.exchange}"
+                transaction(
+                    symbol_id,
+                    "DIVIDEND",
+                    timestamp,
+                    dividend.gross_amount,
+                    instrument.currency,
+                )
+                transaction(
+                    symbol_id, "US TAX", timestamp, dividend.tax, instrument.currency
+                )
+                if rnd.random() < 0.05:
+                    transaction(
+                        symbol_id,
+                        "US TAX",
+                        timestamp,
+                        0.01,
+                        instrument.currency,
+                        "US TAX recalculation",
+                    )
+                continue
+
+            instrument = fill.instrument
+            if instrument.option:
+                # Exante option symbols carry expiration and strike as well
+                symbol, contract = instrument.symbol.split()
+                symbol_id = (
+                    f"{symbol}.{instrument.exchange}.{contract[:7]}.{contract[7:]}"
+                )
+            else:
+                symbol_id = f"{instrument.symbol}.{instrument.exchange}"
+            value = abs(fill.quantity) * fill.price * (100 if instrument.option else 1)
+            f.write(
+                f"{fill.timestamp:%Y-%m-%d %H:%M:%S}\t{account}"
+                f"\t{'buy' if fill.quantity > 0 else 'sell'}\t{symbol_id}\tX"
+                f"\t{'OPTION' if instrument.option else 'STOCK'}\t{fill.price:.2f}"
+                f"\t{instrument.currency}\t{abs(fill.quantity)}\t-{fill.commission:.2f}"
+                f"\t{instrument.currency}\t0\t{value:.2f}\n"
+            )
+            transaction(
+                symbol_id,
+                "TRADE",
+                fill.timestamp,
+                -value if fill.quantity > 0 else value,
+                instrument.currency,
+            )
+            transaction(
+                symbol_id,
+                "COMMISSION",
+                fill.timestamp,
+                -fill.commission,
+                instrument.currency,
+            )
+            if rnd.random() < 0.01:
+                transaction(
+                    "None",
+                    "INTEREST",
+                    fill.timestamp,
+                    -rnd.uniform(0, 10),
+                    instrument.currency,
+                )
+
+
+def write_nbp_rates(
+    directory: Path, first_year: int, last_year: int, seed: int = 0
+) -> List[Path]:
+    """
+    Yearly NBP table A archive CSVs like `nbp_rates_2023.csv`, from the year
+    before first year, as rates of the last table before trade are used.
+    """
+    rnd = random.Random(seed)
+    rates = dict(NBP_COLUMNS)
+    filenames = []
+    table = 0
+    for year in range(first_year - 1, last_year + 1):
+        lines = ["data;" + ";".join(NBP_COLUMNS) + ";nr tabeli;pełny numer tabeli"]
+        day = datetime.date(year, 1, 2)
+        while day.year == year:
+            if day.weekday() < 5:
+                table += 1
+                for column in rates:
+                    rates[column] *= rnd.gauss(1, 0.003)
+                values = ";".join(
+                    f"{rate:.4f}".replace(".", ",") for rate in rates.values()
+                )
+                lines.append(
+                    f"{day:%Y%m%d};{values};{table % 250 + 1};{table % 250 + 1:03d}/A/NBP/{year}"
+                )
+            day += datetime.timedelta(days=1)
+        lines.append(
+            "kod ISO;" + ";".join(column.lstrip("0123456789") for column in NBP_COLUMNS)
+        )
+        filename = directory / f"nbp_rates_{year}.csv"
+        filename.write_text("\n".join(lines) + "\n", encoding="cp1250")
+        filenames.append(filename)
+    return filenames
+
+
+def write_dataset(
+    directory: Path,
+    trades: int,
+    symbols: int = 200,
+    first_year: int = 2020,
+    last_year: int = 2023,
+    exante_share: float = 0.2,
+    ib_files: int = 1,
+    seed: int = 0,
+) -> List[Path]:
+    """
+    Reports with `trades` trades in total and NBP rates for them, returns
+    reports file names.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    write_nbp_rates(directory, first_year, last_year, seed)
+
+    exante_trades = int(trades * exante_share)
+    ib_trades = trades - exante_trades
+    reports = []
+    for number in range(ib_files):
+        filename = directory / f"ib_{number}.xml"
+        write_ib_flex_query(
+            filename,
+            ib_trades // ib_files + (number < ib_trades % ib_files),
+            symbols,
+            first_year,
+            last_year,
+            seed + number,
+            # Separate accounts, as real multi-file setups have
+            account=f"U{1234567 + number}",
+        )
+        reports.append(filename)
+    if exante_trades:
+        trades_filename = directory / "exante_trades.csv"
+        transactions_filename = directory / "exante_transactions.csv"
+        write_exante_reports(
+            trades_filename,
+            transactions_filename,
+            exante_trades,
+            max(1, symbols // 2),
+            first_year,
+            last_year,
+            seed,
+        )
+        reports.extend([trades_filename, transactions_filename])
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--trades", type=int, default=10000)
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--first-year", type=int, default=2020)
+    parser.add_argument("--last-year", type=int, default=2023)
+    parser.add_argument("--exante-share", type=float, default=0.2)
+    parser.add_argument("--ib-files", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for filename in write_dataset(
+        args.output_dir,
+        args.trades,
+        args.symbols,
+        args.first_year,
+        args.last_year,
+        args.exante_share,
+        args.ib_files,
+        args.seed,
+    ):
+        print(filename)
@@ -0,0 +1,241 @@
+"""
+Time calc_trades stages over generated reports: sniffing, parsing, FIFO,
+valuation and summary. Results are appended to a JSON lines file and compared
+with the previous run of the same parameters, e.g. before and after a change.
+
+    python -m benchmarks.run [--trades 100000] [--storage columnar] [--label after]
+
+Generated reports are kept in `--data-dir` and reused by next runs.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import utils
+from benchmarks.generators import write_dataset
+from calc_trades import parse_years
+from reports import SUPPORTED_REPORTS, sniff_report_type
+from taxations import SUPPORTED_TAXATIONS
+from taxations.multi_year_taxation import MultiYearTaxation
+from taxations.nbp_rates import NbpRatesStore
+from tradelog import TradeLog
+
+STAGES = ("sniffing", "parsing", "fifo", "valuation", "summary")
+DATASET_PARAMETERS = (
+    "trades",
+    "symbols",
+    "first_year",
+    "last_year",
+    "exante_share",
+    "ib_files",
+    "seed",
+)
+RUN_PARAMETERS = ("tax", "year", "years", "fifo_engine", "storage", "workers")
+
+
+class ValuationTimer:
+    """
+    Measures time spent in taxation closed transactions methods, calls nested
+    in each other are counted once. Methods are wrapped on the instance only,
+    accumulators spawned for worker processes aren't measured.
+    """
+
+    METHODS = ("add_closed_transaction", "add_closed_rows", "add_closed_matches")
+
+    def __init__(self, taxation) -> None:
+        self.elapsed = 0.0
+        self.depth = 0
+        for name in self.METHODS:
+            setattr(taxation, name, self.wrap(getattr(taxation, name)))
+
+    def wrap(self, method):
+        def timed(*args, **kwargs):
+            self.depth += 1
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.depth -= 1
+                if not self.depth:
+                    self.elapsed += time.perf_counter() - started
+
+        return timed
+
+
+def git_revision() -> str:
+    try:
+        revision = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return revision
+
+
+def prepare_dataset(args) -> List[Path]:
+    """Reports for dataset parameters, generated only if not there yet."""
+    name = "_".join(str(getattr(args, p)) for p in DATASET_PARAMETERS)
+    directory = args.data_dir / name
+    manifest = directory / "reports.json"
+    if manifest.exists():
+        return [Path(f) for f in json.loads(manifest.read_text())]
+
+    print(f"Generating {args.trades} trades into {directory}")
+    reports = write_dataset(
+        directory, **{p: getattr(args, p) for p in DATASET_PARAMETERS}
+    )
+    manifest.write_text(json.dumps([str(f) for f in reports]))
+    return reports
+
+
+def run_once(args, reports: List[Path], rates_store: NbpRatesStore) -> Dict:
+    tax_years = parse_years(args.years) if args.years else args.year
+    taxation = SUPPORTED_TAXATIONS[args.tax](
+        max(tax_years) if args.years else args.year
+    )
+    # Fixture instead of fetched rates, shared by taxations of every year
+    taxation.rates_store = rates_store
+    taxation.rates = rates_store.table()
+    if args.years:
+        taxation = MultiYearTaxation(taxation, tax_years)
+    trade_log = TradeLog(taxation, args.fifo_engine, args.storage)
+    timings = {}
+
+    # Probes are cached, so they wouldn't be measured on next run
+    utils._probe_file.cache_clear()
+    started = time.perf_counter()
+    report_types = [sniff_report_type(filename) for filename in reports]
+    timings["sniffing"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for filename, report_type in zip(reports, report_types):
+        report = SUPPORTED_REPORTS[report_type](trade_log, tax_years)
+        report.process(taxation, filename)
+    timings["parsing"] = time.perf_counter() - started
+
+    valuation = ValuationTimer(taxation)
+    started = time.perf_counter()
+    if args.years:
+        trade_log.calculate_closed_positions(tax_years, args.workers)
+    else:
+        trade_log.calculate_closed_positions(args.year, args.workers)
+    timings["fifo"] = time.perf_counter() - started - valuation.elapsed
+    timings["valuation"] = valuation.elapsed
+
+    started = time.perf_counter()
+    taxation.summary
+    timings["summary"] = time.perf_counter() - started
+
+    trades = (
+        len(trade_log.batch)
+        if trade_log.batch is not None
+        else sum(len(trades) for trades in trade_log.records.values())
+    )
+    return {"timings": timings, "trades": trades}
+
+
+def print_comparison(result: Dict, previous: Dict) -> None:
+    print(
+        f"Compared with {previous['label'] or previous['revision']} of {previous['time']}:"
+    )
+    for stage in STAGES + ("total",):
+        before = previous["timings"][stage]
+        after = result["timings"][stage]
+        change = f"{after / before:.2f}x" if before else "-"
+        print(f"  {stage:<10} {before:9.3f}s -> {after:9.3f}s  {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trades", type=int, default=100000)
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--first-year", type=int, default=2020)
+    parser.add_argument("--last-year", type=int, default=2023)
+    parser.add_argument("--exante-share", type=float, default=0.2)
+    parser.add_argument("--ib-files", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--tax", choices=list(SUPPORTED_TAXATIONS.keys()), default="PL_NBP_FIFO"
+    )
+    years_group = parser.add_mutually_exclusive_group()
+    years_group.add_argument("--year", type=int, default=2023)
+    years_group.add_argument("--years", help="e.g. 2020-2023")
+    parser.add_argument("--fifo-engine", choices=TradeLog.FIFO_ENGINES, default="lots")
+    parser.add_argument("--storage", choices=TradeLog.STORAGES, default="objects")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="with more than 1 valuation is done in workers and counted as FIFO",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="best of given number of runs"
+    )
+    parser.add_argument("--label", default="", help="e.g. before or after")
+    parser.add_argument(
+        "--log", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="ERROR"
+    )
+    parser.add_argument(
+        "--data-dir",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "pit_tool_benchmark",
+    )
+    parser.add_argument(
+        "--results", type=Path, default=Path(__file__).parent / "results.jsonl"
+    )
+    args = parser.parse_args()
+    if args.years is not None:
+        args.year = None
+        try:
+            if parse_years(args.years) is None:
+                parser.error("--years all isn't supported, list the years")
+        except ValueError as e:
+            parser.error(f"--years: {e}")
+    logging.basicConfig(level=getattr(logging, args.log))
+
+    reports = prepare_dataset(args)
+    rates_store = NbpRatesStore(reports[0].parent / "nbp_rates.sqlite3")
+    rates_store.import_directory(reports[0].parent)
+
+    runs = [run_once(args, reports, rates_store) for _ in range(args.repeat)]
+    timings = {stage: min(run["timings"][stage] for run in runs) for stage in STAGES}
+    timings["total"] = sum(timings.values())
+    result = {
+        "label": args.label,
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "parameters": {
+            p: getattr(args, p) for p in DATASET_PARAMETERS + RUN_PARAMETERS
+        },
+        "trades": runs[0]["trades"],
+        "timings": timings,
+    }
+
+    print(f"{result['trades']} trades, best of {args.repeat}:")
+    for stage, elapsed in timings.items():
+        print(f"  {stage:<10} {elapsed:9.3f}s")
+
+    previous = None
+    if args.results.exists():
+        for line in args.results.read_text().splitlines():
+            record = json.loads(line)
+            if record["parameters"] == result["parameters"]:
+                previous = record
+    if previous:
+        print_comparison(result, previous)
+
+    with open(args.results, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    print(f"Recorded in {args.results}")
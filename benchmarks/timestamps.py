@@ -0,0 +1,52 @@
+"""
+Compare `TimestampParser` against per-row dateutil `parse`.
+
+    python -m benchmarks.timestamps [--rows 100000]
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from dateutil.parser import parse
+
+from utils import TimestampParser
+
+FORMATS = {
+    "EXANTE": "%Y-%m-%d %H:%M:%S",
+    "IB_DATETIME": "%Y%m%d;%H%M%S",
+    "IB_DATE": "%Y%m%d",
+}
+
+
+def generate_values(fmt, rows):
+    start = datetime.datetime(2020, 1, 1)
+    return [
+        (
+            start + datetime.timedelta(seconds=random.randint(0, 5 * 365 * 86400))
+        ).strftime(fmt)
+        for _ in range(rows)
+    ]
+
+
+def measure(parse_func, values):
+    started = time.perf_counter()
+    results = [parse_func(value) for value in values]
+    return time.perf_counter() - started, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    for name, fmt in FORMATS.items():
+        values = generate_values(fmt, args.rows)
+        dateutil_time, expected = measure(parse, values)
+        fast_time, results = measure(TimestampParser(), values)
+        assert results == expected, f"{name}: results differ from dateutil"
+        print(
+            f"{name:12} {args.rows} rows: dateutil {dateutil_time:.3f}s, "
+            f"TimestampParser {fast_time:.3f}s ({dateutil_time / fast_time:.1f}x)"
+        )
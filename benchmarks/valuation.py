@@ -0,0 +1,65 @@
+"""
+Check valuing FIFO match table with `PolishNbpRatesVectorizedFIFO` gives
+results identical to valuing matches one by one, and compare their speed.
+
+    python -m benchmarks.valuation [--matches 100000] [--seed 0]
+"""
+
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.fixed_point import (
+    YEAR,
+    batch_matches,
+    generate_matches,
+    state,
+    write_rates_file,
+)
+from taxations.nbp_rates import NbpRatesStore
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from taxations.polish_nbp_rates_fixed_point_fifo import PolishNbpRatesFixedPointFIFO
+from taxations.polish_nbp_rates_vectorized_fifo import PolishNbpRatesVectorizedFIFO
+from tradelog import MatchTable
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--matches", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        rates_file = Path(directory) / f"nbp_rates_{YEAR}.csv"
+        write_rates_file(rates_file)
+        store = NbpRatesStore(Path(directory) / "rates.sqlite3")
+        store.import_file(rates_file)
+
+        batch, rows_matches = batch_matches(generate_matches(args.matches))
+        table = MatchTable(batch)
+        for match in rows_matches:
+            table.append(*match)
+
+        results = {}
+        for taxation_class in (
+            PolishNbpRatesFIFO,
+            PolishNbpRatesFixedPointFIFO,
+            PolishNbpRatesVectorizedFIFO,
+        ):
+            taxation = taxation_class(YEAR)
+            taxation.rates_store = store
+            taxation.rates = store.table()
+            started = time.perf_counter()
+            taxation.add_closed_matches(table)
+            # Totals are complete only for summary
+            taxation.summary
+            elapsed = time.perf_counter() - started
+            results[taxation_class.__name__] = str(state(taxation))
+            print(
+                f"{len(table)} matches with {taxation_class.__name__}: {elapsed:.3f}s"
+            )
+
+        assert len(set(results.values())) == 1, "Results differ"
+        print("Results identical")
@@ -2,29 +2,119 @@
 
 import argparse
 import logging
+import time
 from datetime import datetime
 
+from corporate_actions import DEFAULT_FILE, CorporateActions
+from ingest import ParseCache, ingest_files
+from metrics import metrics
 from reports import SUPPORTED_REPORTS, sniff_report_type
 from taxations import SUPPORTED_TAXATIONS
+from taxations.multi_year_taxation import MultiYearTaxation
 from tradelog import TradeLog
-from utils import logger
+from utils import logger, probe_file
+
+
+def parse_years(value):
+    """Parse `--years` value: `2020-2025`, `2020,2022` or `all` (None)."""
+    if value == "all":
+        return None
+    years = set()
+    for part in value.split(","):
+        first, dash, last = part.strip().partition("-")
+        if not dash:
+            last = first
+        if not first.isdigit() or not last.isdigit():
+            raise ValueError(f"Invalid years {part!r}, expected e.g. 2020-2025")
+        if int(first) > int(last):
+            raise ValueError(f"Reversed years range {part!r}")
+        years.update(range(int(first), int(last) + 1))
+    return sorted(years)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Calculate tax obligations for popular brokers reports.",
-        usage="./calc_trades.py [--tax PL_NBP_FIFO] [--year 2020] [--log DEBUG] file_path1 file_path2 ...",
+        usage="./calc_trades.py [--tax PL_NBP_FIFO] [--year 2020 | --years 2020-2025] [--log DEBUG] file_path1 file_path2 ...",
     )
     parser.add_argument("input_csv_files", nargs="+", help="list of CSV report files")
     parser.add_argument(
         "--tax",
-        help=f"taxation method",
+        help="taxation method, PL_NBP_FIFO_FIXED_POINT and PL_NBP_FIFO_VECTORIZED "
+        "pay off only with --storage columnar",
         choices=list(SUPPORTED_TAXATIONS.keys()),
         default="PL_NBP_FIFO",
     ),
-    parser.add_argument(
+    years_group = parser.add_mutually_exclusive_group()
+    years_group.add_argument(
         "--year", help="tax year", type=int, default=datetime.now().year - 1
     )
+    years_group.add_argument(
+        "--years",
+        help="compute several tax years in one pass, e.g. 2020-2025 or all",
+    )
+    parser.add_argument(
+        "--fifo-engine",
+        help="FIFO matching implementation, legacy is kept for transition period",
+        choices=TradeLog.FIFO_ENGINES,
+        default="lots",
+    )
+    parser.add_argument(
+        "--storage",
+        help="trades storage, columnar takes a fraction of memory for long histories",
+        choices=TradeLog.STORAGES,
+        default="objects",
+    )
+    parser.add_argument(
+        "--workers",
+        help="number of processes running FIFO for separate instruments",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--ingest-workers",
+        help="number of processes parsing input files, results don't depend on it",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--parse-cache",
+        help="reuse events of input files parsed before, see README",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--clear-parse-cache",
+        help="remove all parse cache entries first",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--parse-cache-size",
+        help="parse cache size limit in MB, entries used least recently are evicted",
+        type=int,
+        default=ParseCache.DEFAULT_MAX_SIZE >> 20,
+    )
+    parser.add_argument(
+        "--corporate-actions",
+        help="CSV file with splits not included in reports, see the default one",
+        default=DEFAULT_FILE,
+    )
+    parser.add_argument(
+        "--snapshot-in",
+        help="positions open at the end of previous year, replaces older reports",
+    )
+    parser.add_argument(
+        "--snapshot-out",
+        help="save positions open at the end of (last) tax year to file",
+    )
+    parser.add_argument(
+        "--metrics-out",
+        help="save JSON with time and CPU of each stage, counts and peak memory to file, "
+        "with more than 1 worker valuation is measured as part of FIFO",
+    )
+    parser.add_argument(
+        "--profile",
+        help="save cProfile stats of the whole run to file, e.g. for snakeviz or flameprof",
+    )
     parser.add_argument(
         "--log",
         type=str,
@@ -34,11 +124,36 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    try:
+        tax_years = parse_years(args.years) if args.years else args.year
+    except ValueError as e:
+        parser.error(f"--years: {e}")
 
     logging.basicConfig(level=getattr(logging, args.log))
 
-    taxation = SUPPORTED_TAXATIONS[args.tax](args.year)
-    # TODO - get rid of VIXL split! ratio
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    metrics.enabled = bool(args.metrics_out)
+    started = time.perf_counter(), time.process_time()
+
+    # Created within rates stage, per-year taxations get rates when created
+    with metrics.stage("rates"):
+        if args.years:
+            last_year = max(tax_years) if tax_years else datetime.now().year
+            taxation = MultiYearTaxation(
+                SUPPORTED_TAXATIONS[args.tax](last_year), tax_years
+            )
+        else:
+            taxation = SUPPORTED_TAXATIONS[args.tax](args.year)
+        if metrics.enabled:
+            # Otherwise loaded on first use, measured as part of that stage
+            taxation.prepare()
+    if metrics.enabled and args.workers == 1:
+        taxation.register_metrics(metrics)
+    # TODO - add VIXL split to corporate actions data file
     # DEBUG:root:Calculating profit for following trades:
     # 	<Trade: 2020-10-28T13:30:24 VIXL.LSE@EXLWX0093.001 200000x0.0053>
     # 	<Trade: 2020-11-09T12:34:04 VIXL.LSE@EXLWX0093.001 -3x128.81>
@@ -48,15 +163,91 @@ if __name__ == "__main__":
 
     # Share TradeLog object to support multiple files from the same broker
     # and calculate positions that spread through multiple years
-    trade_log = TradeLog(taxation)
+    trade_log = TradeLog(
+        taxation,
+        args.fifo_engine,
+        args.storage,
+        CorporateActions.load(args.corporate_actions),
+    )
+    if args.snapshot_in:
+        trade_log.load_snapshot(args.snapshot_in)
+
+    if args.clear_parse_cache:
+        ParseCache().clear()
+    parse_cache = (
+        ParseCache(max_size=args.parse_cache_size << 20) if args.parse_cache else None
+    )
+    if args.ingest_workers > 1 or parse_cache is not None:
+        # Parsing or waiting for workers, replay of events is measured separately
+        with metrics.stage("parse"):
+            ingest_files(
+                trade_log,
+                taxation,
+                args.input_csv_files,
+                tax_years,
+                args.ingest_workers,
+                parse_cache,
+            )
+    else:
+        for input_file_path in args.input_csv_files:
+            logger.info("Sniffing file {}".format(input_file_path))
+            with metrics.stage("probe", input_file_path):
+                report_type = sniff_report_type(input_file_path)
+            logger.info(
+                f"Parsing {input_file_path}, identified report type {report_type}"
+            )
+
+            report = SUPPORTED_REPORTS[report_type](trade_log, tax_years)
+            with metrics.stage("parse", input_file_path):
+                report.process(taxation, input_file_path)
+            if metrics.enabled:
+                metrics.files[input_file_path].update(
+                    type=report_type, rows=report.rows
+                )
+                metrics.count("rows", report.rows)
 
-    for input_file_path in args.input_csv_files:
-        logger.info("Sniffing file {}".format(input_file_path))
-        report_type = sniff_report_type(input_file_path)
-        logger.info(f"Parsing {input_file_path}, identified report type {report_type}")
+    with metrics.stage("fifo"):
+        if args.years:
+            # Every year trades were done in, all of them are matched in one pass
+            if tax_years is None:
+                tax_years = sorted(set(taxation.taxations) | trade_log.trade_years())
+            trade_log.calculate_closed_positions(tax_years, args.workers)
+            for year in tax_years:
+                logger.info(trade_log.format_year_end_positions(year))
+            snapshot_year = max(tax_years)
+        elif args.snapshot_out:
+            # Collection of years keeps instruments not traded in tax year,
+            # their open positions belong to the snapshot as well
+            trade_log.calculate_closed_positions([args.year], args.workers)
+            snapshot_year = args.year
+        else:
+            trade_log.calculate_closed_positions(args.year, args.workers)
+    with metrics.stage("summary"):
+        summary = taxation.summary
+    logger.info(summary)
 
-        report = SUPPORTED_REPORTS[report_type](trade_log, args.year)
-        report.process(taxation, input_file_path)
+    if args.snapshot_out:
+        trade_log.save_snapshot(args.snapshot_out, snapshot_year)
 
-    trade_log.calculate_closed_positions(args.year)
-    logger.info(taxation.summary)
+    if args.profile:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        logger.info(f"Saved profile to {args.profile}")
+    if metrics.enabled:
+        metrics.counts.update(trade_log.stats())
+        probe_cache = probe_file.cache_info()
+        metrics.counts.update(
+            {
+                "probe_cache.hits": probe_cache.hits,
+                "probe_cache.misses": probe_cache.misses,
+            }
+        )
+        metrics.dump(
+            args.metrics_out,
+            arguments=vars(args),
+            total={
+                "wall": time.perf_counter() - started[0],
+                "cpu": time.process_time() - started[1],
+            },
+        )
+        logger.info(f"Saved metrics to {args.metrics_out}")
@@ -0,0 +1,110 @@
+"""
+Calculations kept warm between runs, e.g. of the calculation service.
+
+`Calculator` holds what doesn't depend on the reports calculated: taxations
+with exchange rates loaded, corporate actions data and parse cache. Each
+`calculate` call gets its own TradeLog, taxations and corporate actions copy,
+so runs don't see each other's trades, splits or totals.
+"""
+
+from datetime import datetime
+from typing import Collection, Dict, List, Optional, Tuple
+
+from corporate_actions import DEFAULT_FILE, CorporateActions
+from ingest import ParseCache, ingest_files
+from taxations import SUPPORTED_TAXATIONS
+from taxations.base_taxation import BaseTaxation
+from taxations.multi_year_taxation import MultiYearTaxation
+from tradelog import TradeLog
+from utils import logger
+
+
+class Calculator:
+    def __init__(
+        self,
+        corporate_actions_file=DEFAULT_FILE,
+        parse_cache: Optional[ParseCache] = None,
+    ) -> None:
+        self.corporate_actions = CorporateActions.load(corporate_actions_file)
+        self.parse_cache = parse_cache
+        # (tax, last year) -> taxation with rates loaded until that year
+        self.templates: Dict[Tuple[str, int], BaseTaxation] = {}
+
+    def taxation_template(
+        self, tax: str, year: int, shared: bool = False
+    ) -> BaseTaxation:
+        """
+        Taxation to create taxations of year and years before from, sharing
+        data loaded by one created for that year or later. Shared one has all
+        data loaded, see `BaseTaxation.prepare_shared`.
+        """
+        for (template_tax, template_year), template in self.templates.items():
+            if template_tax == tax and template_year >= year:
+                if shared:
+                    template.prepare_shared()
+                return template
+        template = SUPPORTED_TAXATIONS[tax](year)
+        if shared:
+            template.prepare_shared()
+        else:
+            template.prepare()
+        self.templates[tax, year] = template
+        logger.info(f"Prepared {tax} taxation for tax years until {year}")
+        return template
+
+    def calculate(
+        self,
+        filenames: List[str],
+        tax: str = "PL_NBP_FIFO",
+        tax_years: Optional[Collection[int]] = None,
+        fifo_engine: str = "lots",
+        storage: str = "objects",
+        snapshot_in: Optional[str] = None,
+    ) -> dict:
+        """
+        Process reports for tax years, every year trades were done in if
+        None, returns `results`.
+        """
+        last_year = max(tax_years) if tax_years else datetime.now().year
+        template = self.taxation_template(tax, last_year).for_year(last_year)
+        taxation = MultiYearTaxation(template, tax_years)
+        trade_log = TradeLog(
+            taxation, fifo_engine, storage, self.corporate_actions.copy()
+        )
+        if snapshot_in:
+            trade_log.load_snapshot(snapshot_in)
+
+        ingest_files(trade_log, taxation, filenames, tax_years, cache=self.parse_cache)
+        if tax_years is None:
+            tax_years = sorted(set(taxation.taxations) | trade_log.trade_years())
+        trade_log.calculate_closed_positions(tax_years)
+        return self.results(trade_log, taxation, tax_years)
+
+    @staticmethod
+    def results(
+        trade_log: TradeLog, taxation: MultiYearTaxation, tax_years: Collection[int]
+    ) -> dict:
+        """
+        Summary, profit per position and positions open at the end of each
+        tax year, for JSON with Decimals as strings (`default=str`).
+        """
+        years = {}
+        for year in sorted(tax_years):
+            year_taxation = taxation.taxation_for(year)
+            years[year] = {
+                "summary": year_taxation.summary_values,
+                "per_position_profit": [
+                    {"account": account, "symbol": symbol, "profit": profit}
+                    for (account, symbol), profit in sorted(
+                        year_taxation.per_position_profit.items()
+                    )
+                ],
+                "open_positions": [
+                    trade.to_dict()
+                    for trade in trade_log.year_end_positions.get(year, [])
+                ],
+            }
+        return {
+            "years": years,
+            "stats": trade_log.stats(),
+        }
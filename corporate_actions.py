@@ -0,0 +1,117 @@
+"""
+Stock splits and reverse splits, from a local data file and IB Flex reports.
+
+Trades of a symbol are converted to shares of the period between its splits
+with the most shares, so FIFO matches all of them: after forward splits, before
+reverse ones. Quantities are only multiplied then, and stay whole for N-for-1
+and 1-for-N splits whatever the lot size. Ratios like 3-for-2 leave fractions
+of shares, exact unless their denominator is other than 2 or 5 powers; those
+are rounded to Decimal context precision. A split applies to trades done on
+its date or before.
+"""
+
+import datetime
+from bisect import bisect_left
+from fractions import Fraction
+from decimal import Decimal as D
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from utils import logger, read_csv_rows
+
+DEFAULT_FILE = Path(__file__).parent / "data" / "corporate_actions.csv"
+
+
+class Split(NamedTuple):
+    date: datetime.date
+    # Every `old` shares became `new` shares
+    old: int
+    new: int
+
+
+class CorporateActions:
+    """
+    Splits indexed per symbol by date, with (old, new) ratio converting
+    shares of each period between them, so a trade is adjusted with a single
+    bisect.
+    """
+
+    COLUMNS = ("symbol", "date", "old", "new")
+
+    def __init__(self) -> None:
+        self.splits: Dict[str, List[Split]] = {}
+        # Symbol -> split dates and (old, new) ratio of trades until each
+        self.index: Dict[str, Tuple[List[datetime.date], List[Tuple[int, int]]]] = {}
+
+    def __len__(self) -> int:
+        return sum(map(len, self.splits.values()))
+
+    def add_split(self, symbol: str, date: datetime.date, old: int, new: int) -> None:
+        """Add split, reported again e.g. by several reports it's added once."""
+        assert old > 0 and new > 0, f"Invalid {symbol} split ratio {old}:{new}"
+        split = Split(date, old, new)
+        splits = self.splits.setdefault(symbol, [])
+        if split not in splits:
+            splits.append(split)
+            self.index.pop(symbol, None)
+
+    def copy(self) -> "CorporateActions":
+        """Copy to add splits to, e.g. from reports of one of many runs."""
+        actions = CorporateActions()
+        actions.splits = {
+            symbol: list(splits) for symbol, splits in self.splits.items()
+        }
+        # Indexes are rebuilt, not modified, on changes
+        actions.index = dict(self.index)
+        return actions
+
+    @classmethod
+    def load(cls, filename=DEFAULT_FILE) -> "CorporateActions":
+        """Load splits from CSV file with `COLUMNS`, e.g. `DEFAULT_FILE`."""
+        actions = cls()
+        for symbol, date, old, new in read_csv_rows(filename, cls.COLUMNS, ","):
+            actions.add_split(
+                symbol, datetime.date.fromisoformat(date), int(old), int(new)
+            )
+        logger.debug(f"Loaded {len(actions)} corporate actions from {filename}")
+        return actions
+
+    def symbol_index(self, symbol: str):
+        index = self.index.get(symbol)
+        if index is None:
+            splits = sorted(self.splits[symbol])
+            dates = [split.date for split in splits]
+            # Shares of each period per share from before all splits
+            shares = [Fraction(1)]
+            for _, old, new in splits:
+                shares.append(shares[-1] * new / old)
+            # Converted to shares of period with most of them
+            factors = [max(shares) / period for period in shares]
+            ratios = [(factor.denominator, factor.numerator) for factor in factors]
+            index = self.index[symbol] = (dates, ratios)
+        return index
+
+    def ratio(self, symbol: str, date: datetime.date) -> Tuple[int, int]:
+        """
+        (old, new) ratio converting shares of trades done on date, (1, 1) if
+        none.
+        """
+        if symbol not in self.splits:
+            return 1, 1
+        dates, ratios = self.symbol_index(symbol)
+        return ratios[bisect_left(dates, date)]
+
+    @staticmethod
+    def adjust(
+        quantity: Union[int, D], price: D, old: int, new: int
+    ) -> Tuple[Union[int, D], D]:
+        """
+        Quantity and price in shares converted with given ratio, quantity is
+        kept int if it stays whole.
+        """
+        quantity *= new
+        if isinstance(quantity, int) and not quantity % old:
+            quantity //= old
+        elif old != 1:
+            quantity = D(quantity) / old
+        return quantity, price * old / new
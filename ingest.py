@@ -0,0 +1,241 @@
+"""
+Ingestion of report files, in parallel and cached.
+
+Each file is sniffed and processed, e.g. in a worker process, against `EventRecorder`
+standing in for TradeLog and taxation. Recorded trades, costs and dividends are
+replayed into the real ones in input files order, so results are identical to
+processing files one by one, whatever the number of workers or the order they
+finish in. Reports keep their state per file, e.g. IB dividends duplicates are
+skipped within a file, same as when processed one by one.
+
+Recorded events are kept in `ParseCache`, so files processed before aren't
+parsed again, e.g. statements of past years.
+"""
+
+import hashlib
+import os
+import pickle
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Collection, Iterator, List, Optional, Tuple, Union
+
+from metrics import metrics
+from reports import SUPPORTED_REPORTS, sniff_report_type
+from taxations.base_taxation import BaseTaxation
+from tradelog import TradeLog
+from utils import logger
+
+
+class EventRecorder:
+    """
+    Records TradeLog trades and splits and taxation costs and dividends
+    reported by a report, as (method, args, kwargs) events.
+    """
+
+    TRADE_LOG_METHODS = ("add_trade", "add_record", "add_split")
+    TAXATION_METHODS = ("add_cost", "add_dividend")
+
+    def __init__(self) -> None:
+        self.events: List[Tuple[str, tuple, dict]] = []
+
+    def add_trade(self, *args, **kwargs) -> None:
+        self.events.append(("add_trade", args, kwargs))
+
+    def add_record(self, *args, **kwargs) -> None:
+        self.events.append(("add_record", args, kwargs))
+
+    def add_split(self, *args, **kwargs) -> None:
+        self.events.append(("add_split", args, kwargs))
+
+    def add_cost(self, *args, **kwargs) -> None:
+        self.events.append(("add_cost", args, kwargs))
+
+    def add_dividend(self, *args, **kwargs) -> None:
+        self.events.append(("add_dividend", args, kwargs))
+
+    def replay(self, trade_log: TradeLog, taxation: BaseTaxation) -> None:
+        for method, args, kwargs in self.events:
+            target = trade_log if method in self.TRADE_LOG_METHODS else taxation
+            getattr(target, method)(*args, **kwargs)
+
+
+class ParseCache:
+    """
+    Events recorded from report files, as zlib compressed pickles keyed by
+    file content hash, report type and its `parser_version`, and tax years
+    reports filter events by.
+
+    Entries used least recently are evicted once the cache grows past
+    `max_size` bytes. Defaults to `pit-tool/parse` in the user's cache
+    directory, override with `PARSE_CACHE_DIR`. Entries are unpickled, so
+    the directory must be owned by the user and not accessible to others.
+    """
+
+    DEFAULT_MAX_SIZE = 256 << 20
+    # Bump on changes of entries format or EventRecorder events
+    VERSION = 1
+    HASH_CHUNK_SIZE = 1 << 20
+
+    def __init__(self, directory=None, max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.directory = Path(
+            directory or os.environ.get("PARSE_CACHE_DIR") or self.default_directory()
+        )
+        self.max_size = max_size
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self.check_directory()
+
+    @staticmethod
+    def default_directory() -> Path:
+        cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+        return Path(cache_home) / "pit-tool" / "parse"
+
+    def check_directory(self) -> None:
+        """
+        Refuse directory other users could plant entries in, e.g. created in
+        shared temp before us. Permissions of our own one are narrowed.
+        """
+        # No POSIX ownership, e.g. on Windows
+        if not hasattr(os, "getuid"):
+            return
+        stat = self.directory.stat()
+        if stat.st_uid != os.getuid():
+            raise PermissionError(
+                f"Parse cache directory {self.directory} is owned by another user"
+            )
+        if stat.st_mode & 0o077:
+            self.directory.chmod(0o700)
+
+    @classmethod
+    def file_hash(cls, filename) -> str:
+        digest = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(cls.HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(
+        self,
+        filename,
+        report_type: str,
+        tax_years: Union[int, Collection[int], None],
+    ) -> Path:
+        if tax_years is not None:
+            tax_years = (tax_years,) if isinstance(tax_years, int) else tax_years
+            tax_years = tuple(sorted(tax_years))
+        key = (
+            self.VERSION,
+            self.file_hash(filename),
+            report_type,
+            SUPPORTED_REPORTS[report_type].parser_version,
+            tax_years,
+        )
+        return self.directory / f"{hashlib.sha256(repr(key).encode()).hexdigest()}.bin"
+
+    def load(self, path: Path) -> Optional[Tuple[int, EventRecorder]]:
+        """Rows and events of entry, None if there's no valid one."""
+        try:
+            rows, events = pickle.loads(zlib.decompress(path.read_bytes()))
+        except FileNotFoundError:
+            return None
+        except (zlib.error, pickle.UnpicklingError, EOFError, ValueError):
+            logger.warning(f"Ignoring corrupted parse cache entry {path}")
+            return None
+        # Mark as recently used
+        os.utime(path)
+        recorder = EventRecorder()
+        recorder.events = events
+        return rows, recorder
+
+    def store(self, path: Path, rows: int, recorder: EventRecorder) -> None:
+        data = zlib.compress(
+            pickle.dumps((rows, recorder.events), pickle.HIGHEST_PROTOCOL)
+        )
+        # Atomic, entry is complete or not there at all for concurrent workers
+        temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+
+    def evict(self) -> None:
+        """Remove entries used least recently until cache fits `max_size`."""
+        entries = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            path.unlink(missing_ok=True)
+            size -= entry_size
+            logger.debug(f"Evicted parse cache entry {path}")
+
+    def clear(self) -> None:
+        for path in self.directory.glob("*.bin"):
+            path.unlink(missing_ok=True)
+        logger.info(f"Cleared parse cache {self.directory}")
+
+
+def ingest_file(args) -> Tuple[str, int, EventRecorder, bool]:
+    """
+    Process pool worker, returns report type, rows, recorded events and
+    whether they were loaded from cache.
+    """
+    filename, tax_years, cache = args
+    report_type = sniff_report_type(filename)
+    if cache is not None:
+        path = cache.path(filename, report_type, tax_years)
+        cached = cache.load(path)
+        if cached is not None:
+            return (report_type, *cached, True)
+
+    recorder = EventRecorder()
+    report = SUPPORTED_REPORTS[report_type](recorder, tax_years)
+    report.process(recorder, filename)
+    if cache is not None:
+        cache.store(path, report.rows, recorder)
+    return report_type, report.rows, recorder, False
+
+
+def ingest_files(
+    trade_log: TradeLog,
+    taxation: BaseTaxation,
+    filenames: List[str],
+    tax_years: Union[int, Collection[int], None],
+    workers: int = 1,
+    cache: Optional[ParseCache] = None,
+) -> None:
+    """
+    Process report files, in a pool of workers if more than one, replaying
+    their events in files order.
+    """
+    arguments = [(filename, tax_years, cache) for filename in filenames]
+    with (
+        ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext(None)
+    ) as pool:
+        # Results come in files order, each as soon as it and all before are done
+        results: Iterator[Tuple[str, int, EventRecorder, bool]] = (
+            pool.map(ingest_file, arguments)
+            if pool is not None
+            else map(ingest_file, arguments)
+        )
+        for filename, (report_type, rows, recorder, cached) in zip(filenames, results):
+            logger.info(
+                f"Parsed {filename}, identified report type {report_type}"
+                + (", from cache" if cached else "")
+            )
+            with metrics.stage("replay", filename):
+                recorder.replay(trade_log, taxation)
+            if metrics.enabled:
+                metrics.files[filename].update(
+                    type=report_type, rows=rows, cached=cached
+                )
+                metrics.count("rows", rows)
+                metrics.count("parse_cache.hits" if cached else "parse_cache.misses")
+
+    if cache is not None:
+        cache.evict()
@@ -0,0 +1,133 @@
+"""
+Run metrics: wall and CPU time of stages, counts and peak memory, dumped as
+JSON by `calc_trades.py --metrics-out`.
+
+Disabled metrics cost a single check per stage. Methods of hot paths aren't
+instrumented in code, `time_methods`/`count_methods` wrap them on instances
+only once metrics are enabled.
+"""
+
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Metrics:
+    VERSION = 1
+
+    def __init__(self) -> None:
+        self.enabled = False
+        # Stage -> {"wall", "cpu", "calls"}, times exclusive of nested stages
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.files: Dict[str, Dict] = {}
+        self.counts: Dict[str, int] = {}
+        # Called on dump, return counts known only at the end of run
+        self.collectors: List[Callable[[], Dict[str, int]]] = []
+        # Times of nested stages of every running one, [wall, cpu]
+        self.running: List[List[float]] = []
+
+    def enter(self) -> tuple:
+        self.running.append([0.0, 0.0])
+        return time.perf_counter(), time.process_time()
+
+    def exit(self, name: str, started: tuple, file: Optional[str] = None) -> None:
+        wall = time.perf_counter() - started[0]
+        cpu = time.process_time() - started[1]
+        nested_wall, nested_cpu = self.running.pop()
+        if self.running:
+            self.running[-1][0] += wall
+            self.running[-1][1] += cpu
+
+        stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        stage["wall"] += wall - nested_wall
+        stage["cpu"] += cpu - nested_cpu
+        stage["calls"] += 1
+        if file is not None:
+            self.files.setdefault(file, {})[name] = {
+                "wall": wall - nested_wall,
+                "cpu": cpu - nested_cpu,
+            }
+
+    @contextmanager
+    def stage(self, name: str, file: Optional[str] = None):
+        """Measure block as stage, optionally also per file."""
+        if not self.enabled:
+            yield
+            return
+        started = self.enter()
+        try:
+            yield
+        finally:
+            self.exit(name, started, file)
+
+    def count(self, name: str, value: int = 1) -> None:
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def time_methods(self, obj, stage: str, names: Iterable[str]) -> None:
+        """Measure calls of object methods as stage, nested calls once."""
+        for name in names:
+            method = getattr(obj, name)
+
+            def timed(*args, __method=method, **kwargs):
+                started = self.enter()
+                try:
+                    return __method(*args, **kwargs)
+                finally:
+                    self.exit(stage, started)
+
+            setattr(obj, name, timed)
+
+    def count_methods(self, obj, prefix: str, names: Iterable[str]) -> None:
+        """Count calls of object methods as `prefix.method`."""
+        for name in names:
+            method = getattr(obj, name)
+            key = f"{prefix}.{name}"
+            self.counts.setdefault(key, 0)
+
+            def counted(*args, __method=method, __key=key, **kwargs):
+                self.counts[__key] += 1
+                return __method(*args, **kwargs)
+
+            setattr(obj, name, counted)
+
+    @staticmethod
+    def peak_memory() -> Dict[str, Optional[int]]:
+        """Peak RSS in bytes of this process and of finished worker processes."""
+        if resource is None:
+            return {"peak_rss": None, "children_peak_rss": None}
+        # Kilobytes on Linux, bytes on macOS
+        unit = 1 if sys.platform == "darwin" else 1024
+        return {
+            "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            "children_peak_rss": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            * unit,
+        }
+
+    def as_dict(self) -> Dict:
+        counts = dict(self.counts)
+        for collector in self.collectors:
+            counts.update(collector())
+        return {
+            "version": self.VERSION,
+            "stages": self.stages,
+            "files": self.files,
+            "counts": counts,
+            "memory": self.peak_memory(),
+        }
+
+    def dump(self, filename: str, **extra) -> None:
+        with open(filename, "w") as f:
+            # Arguments can be e.g. paths
+            json.dump(dict(self.as_dict(), **extra), f, indent=1, default=str)
+
+
+# Shared by the whole run, enabled by calc_trades.py
+metrics = Metrics()
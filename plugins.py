@@ -0,0 +1,103 @@
+"""
+Registries of report and taxation implementations, imported on first use.
+
+Built-in implementations are listed as `module:Class` paths, so a run
+imports only report types sniffing selected and the taxation `--tax` names,
+along with their dependencies. Third-party packages add their own under
+entry point groups, e.g. in pyproject.toml:
+
+    [project.entry-points."pit_tool.reports"]
+    MY_BROKER = "my_package.report:MyBrokerReport"
+
+or at runtime with `SUPPORTED_REPORTS.register("MY_BROKER", MyBrokerReport)`.
+"""
+
+from functools import lru_cache
+from importlib import import_module
+from typing import Callable, Dict, Iterator, Mapping, Optional, Union
+
+from utils import logger
+
+
+@lru_cache(maxsize=None)
+def installed_entry_points():
+    """Entry points of all installed packages, scanned once for all groups."""
+    from importlib.metadata import entry_points
+
+    return entry_points()
+
+
+def group_entry_points(group: str) -> Dict[str, str]:
+    """Entry points of installed packages in group, name -> `module:Class`."""
+    found = installed_entry_points()
+    # Python < 3.10 returns dict of groups
+    found = (
+        found.select(group=group) if hasattr(found, "select") else found.get(group, ())
+    )
+    return {entry_point.name: entry_point.value for entry_point in found}
+
+
+class PluginRegistry(Mapping):
+    """
+    Name -> class mapping, classes are imported when first looked up.
+    Entry points of the group are read only once a name isn't built-in
+    or all names are listed.
+    """
+
+    def __init__(
+        self,
+        group: str,
+        builtins: Dict[str, str],
+        validate: Optional[Callable[[str, type], None]] = None,
+    ) -> None:
+        self.group = group
+        self.paths: Dict[str, Union[str, type]] = dict(builtins)
+        self.classes: Dict[str, type] = {}
+        self.validate = validate
+        self.entry_points_loaded = False
+
+    def load_entry_points(self) -> None:
+        if self.entry_points_loaded:
+            return
+        self.entry_points_loaded = True
+        for name, path in group_entry_points(self.group).items():
+            if name in self.paths:
+                logger.warning(
+                    f"Ignoring {self.group} entry point {name}, already registered"
+                )
+                continue
+            self.paths[name] = path
+
+    def register(self, name: str, plugin: Union[str, type]) -> None:
+        """Add class, or its `module:Class` path to import when needed."""
+        self.paths[name] = plugin
+        self.classes.pop(name, None)
+
+    def __getitem__(self, name: str) -> type:
+        plugin_class = self.classes.get(name)
+        if plugin_class is not None:
+            return plugin_class
+        if name not in self:
+            raise KeyError(name)
+
+        plugin = self.paths[name]
+        if isinstance(plugin, str):
+            module, _, attribute = plugin.partition(":")
+            plugin = getattr(import_module(module), attribute)
+        if self.validate is not None:
+            self.validate(name, plugin)
+        self.classes[name] = plugin
+        return plugin
+
+    def __contains__(self, name) -> bool:
+        if name not in self.paths:
+            self.load_entry_points()
+        return name in self.paths
+
+    def __iter__(self) -> Iterator[str]:
+        self.load_entry_points()
+        return iter(list(self.paths))
+
+    def __len__(self) -> int:
+        self.load_entry_points()
+        return len(self.paths)
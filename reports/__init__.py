@@ -1,21 +1,105 @@
-from reports.exante_trades_report import ExanteTradesReport
-from reports.exante_all_transactions import ExanteAllTransactions
-from reports.ib_flex_query_report import IBFlexQueryReport
-from utils import read_csv_file
-
-SUPPORTED_REPORTS = {
-    "EXANTE_TRADES": ExanteTradesReport,
-    "EXANTE_TRANSACTIONS": ExanteAllTransactions,
-    "IB_FLEX_QUERY": IBFlexQueryReport,
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from plugins import PluginRegistry
+from utils import probe_file
+
+
+class ReportSignature(NamedTuple):
+    """Sniffing attributes of a report class, see `BaseReport`."""
+
+    columns: Tuple[str, ...] = ()
+    marker: Optional[str] = None
+    marker_range: int = 50
+
+    @classmethod
+    def of(cls, report_class) -> "ReportSignature":
+        return cls(
+            tuple(report_class.sniff_columns),
+            report_class.sniff_marker,
+            report_class.sniff_marker_range,
+        )
+
+
+# Signatures of built-in reports, so files are sniffed without importing them
+BUILTIN_SIGNATURES = {
+    "EXANTE_TRADES": ReportSignature(
+        columns=(
+            "account id",
+            "time",
+            "type",
+            "side",
+            "quantity",
+            "currency",
+            "symbol id",
+            "commission",
+        )
+    ),
+    "EXANTE_TRANSACTIONS": ReportSignature(
+        columns=("account id", "when", "operation type", "sum")
+    ),
+    "IB_FLEX_QUERY": ReportSignature(marker="FlexQueryResponse"),
 }
 
 
+def validate_signature(report_type: str, report_class) -> None:
+    signature = BUILTIN_SIGNATURES.get(report_type)
+    assert signature is None or signature == ReportSignature.of(
+        report_class
+    ), f"{report_type} sniff attributes differ from its built-in signature"
+
+
+SUPPORTED_REPORTS = PluginRegistry(
+    "pit_tool.reports",
+    {
+        "EXANTE_TRADES": "reports.exante_trades_report:ExanteTradesReport",
+        "EXANTE_TRANSACTIONS": "reports.exante_all_transactions:ExanteAllTransactions",
+        "IB_FLEX_QUERY": "reports.ib_flex_query_report:IBFlexQueryReport",
+    },
+    validate_signature,
+)
+
+
+def build_signature_index(signatures: Dict[str, ReportSignature]):
+    """
+    Group report signatures by kind, so file probe is matched against
+    plain sets/strings instead of calling every report class.
+    """
+    header_signatures = []
+    marker_signatures = []
+    for report_type, signature in signatures.items():
+        if signature.marker is not None:
+            marker_signatures.append(
+                (signature.marker, signature.marker_range, report_type)
+            )
+        elif signature.columns:
+            header_signatures.append((frozenset(signature.columns), report_type))
+    return header_signatures, marker_signatures
+
+
+def report_signatures() -> Dict[str, ReportSignature]:
+    """Signatures of all reports, third-party report classes are imported."""
+    return {
+        report_type: BUILTIN_SIGNATURES.get(report_type)
+        or ReportSignature.of(SUPPORTED_REPORTS[report_type])
+        for report_type in SUPPORTED_REPORTS
+    }
+
+
 def sniff_report_type(filename):
-    possible_reports = []
+    probe = probe_file(filename)
+    header_signatures, marker_signatures = build_signature_index(report_signatures())
 
-    for report_type, report_class in SUPPORTED_REPORTS.items():
-        if report_class.sniff(filename):
-            possible_reports.append(report_type)
+    possible_reports = [
+        report_type
+        for marker, marker_range, report_type in marker_signatures
+        if marker in probe.text[:marker_range]
+    ]
+    if probe.header:
+        possible_reports.extend(
+            report_type
+            for columns, report_type in header_signatures
+            if columns <= probe.header
+        )
 
     assert (
         len(possible_reports) == 1
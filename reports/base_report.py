@@ -1,6 +1,7 @@
-from typing import TYPE_CHECKING
+from typing import Collection, Optional, TYPE_CHECKING, Union
 
 from taxations.base_taxation import BaseTaxation
+from utils import FileProbe, probe_file
 
 if TYPE_CHECKING:
     from tradelog import TradeLog
@@ -10,16 +11,68 @@ class BaseReport:
     """
     Report class parse and recognize tax incurring events and calls relevant
     taxation event handler
+
+    Reports are recognized by a signature matched against file probe:
+    `sniff_columns` required in CSV header or `sniff_marker` text found
+    at the very beginning of the file.
     """
 
-    def __init__(self, trade_log: "TradeLog", tax_year: int) -> None:
+    sniff_columns = ()
+    sniff_marker = None
+    sniff_marker_range = 50
+    # Bump on changes of events reported, invalidates parse cache entries
+    parser_version = 1
+
+    def __init__(
+        self,
+        trade_log: "TradeLog",
+        tax_year: Union[int, Collection[int], None],
+    ) -> None:
+        """
+        :param tax_year: single tax year, collection of years or None
+            to process events from all years
+        """
         self.trade_log = trade_log
         self.tax_year = tax_year
+        # Rows or elements handled by `process`, for run metrics
+        self.rows = 0
+        if tax_year is None:
+            self.tax_years: Optional[set] = None
+        elif isinstance(tax_year, int):
+            self.tax_years = {tax_year}
+        else:
+            self.tax_years = set(tax_year)
+        # Years as raw dates prefixes, to reject rows before parsing them
+        if self.tax_years is None:
+            self.tax_year_prefixes: Optional[frozenset] = None
+        else:
+            self.tax_year_prefixes = frozenset(map(str, self.tax_years))
+
+    def is_tax_year(self, year: int) -> bool:
+        return self.tax_years is None or year in self.tax_years
+
+    def outside_tax_years(self, raw_date: str) -> bool:
+        """
+        Whether raw date starting with year, e.g. `2020-04-06 14:10:00` or
+        `20200406;141000`, is surely outside tax years, checked before parsing.
+        """
+        year = raw_date[:4]
+        return (
+            self.tax_year_prefixes is not None
+            and year not in self.tax_year_prefixes
+            and year.isdigit()
+        )
 
     @classmethod
     def sniff(cls, filename) -> bool:
         """Rule out if file is an instance of this report."""
-        raise NotImplementedError()
+        return cls.sniff_probe(probe_file(filename))
+
+    @classmethod
+    def sniff_probe(cls, probe: FileProbe) -> bool:
+        if cls.sniff_marker is not None:
+            return cls.sniff_marker in probe.text[: cls.sniff_marker_range]
+        return bool(cls.sniff_columns) and probe.header.issuperset(cls.sniff_columns)
 
     def process(self, taxation: BaseTaxation, filename: str) -> None:
         """Start report processing."""
@@ -1,11 +1,8 @@
-import csv
 import logging
 from decimal import Decimal as D
 
-from dateutil.parser import parse
-
 from reports.base_report import BaseReport
-from utils import read_csv_file
+from utils import TimestampParser, read_csv_rows
 
 logger = logging.getLogger("exante_all_transactions")
 
@@ -40,45 +37,54 @@ class ExanteAllTransactions(BaseReport):
     type_commission = "COMMISSION"
     type_interest = "INTEREST"
 
-    @classmethod
-    def sniff(cls, filename):
-        try:
-            sample_row = next(read_csv_file(filename))
-        except csv.Error:
-            return False
-
-        logger.debug("Sample header row: {}".format(sample_row))
-
-        return all(
-            column.lower() in sample_row
-            for column in (
-                cls.column_account,
-                cls.column_timestamp,
-                cls.column_type,
-                cls.column_value,
-            )
-        )
+    # Columns of rows read by `process`
+    columns = (
+        column_type,
+        column_value,
+        column_timestamp,
+        column_comment,
+        column_symbol,
+        column_account,
+        column_asset,
+    )
+
+    sniff_columns = (
+        column_account,
+        column_timestamp,
+        column_type,
+        column_value,
+    )
+    parser_version = 2
 
     def process(self, taxation, filename):
         dividends_details = {}
-        for row in read_csv_file(filename):
-            operation_type = row[self.column_type]
-            value = D(row[self.column_value])
-            timestamp = parse(row[self.column_timestamp])
-            comment = row[self.column_comment]
-            key = f"{row[self.column_symbol]}@{row[self.column_account]}:{timestamp.date().isoformat()}"
+        parse_timestamp = TimestampParser()
+        for (
+            operation_type,
+            value,
+            timestamp,
+            comment,
+            symbol,
+            account,
+            asset,
+        ) in read_csv_rows(filename, self.columns):
+            self.rows += 1
+            if self.outside_tax_years(timestamp):
+                continue
+            value = D(value)
+            timestamp = parse_timestamp(timestamp)
+            key = f"{symbol}@{account}:{timestamp.date().isoformat()}"
 
             # Minor tax corrections for previous year are possible, skip if below $0.1
             if self.comment_tax_recalc in comment and abs(value) < D("0.1"):
                 continue
 
-            if timestamp.year != self.tax_year:
+            if not self.is_tax_year(timestamp.year):
                 continue
 
             # Calculate total costs
             elif operation_type in {self.type_commission, self.type_interest}:
-                currency = row[self.column_asset]
-                taxation.add_cost(currency, value, timestamp.date())
+                taxation.add_cost(asset, value, timestamp.date())
 
             # Collect dividends and taxes
             elif operation_type == self.type_dividend:
@@ -88,7 +94,7 @@ class ExanteAllTransactions(BaseReport):
                         "symbol": key,
                         "value": value,
                         "date": timestamp.date(),
-                        "currency": row[self.column_asset],
+                        "currency": asset,
                     }
                 )
 
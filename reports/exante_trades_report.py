@@ -1,12 +1,9 @@
-import csv
 from decimal import Decimal as D
 from typing import Optional
 
-from dateutil.parser import parse
-
 from reports.base_report import BaseReport
 from tradelog import TradeRecord, InstrumentType
-from utils import logger, read_csv_file, support_stock_split
+from utils import TimestampParser, logger, read_csv_rows
 
 
 class ExanteTradesReport(BaseReport):
@@ -16,9 +13,8 @@ class ExanteTradesReport(BaseReport):
     Known limitations:
 
     1) Only STOCK and OPTION trades are currently supported
-    2) Stock splits/merge must be handled manually in report file by adjusting position size
-      to match split/merge size and price has to be adjusted according to real price
-      dividing Traded Volume by adjusted position size.
+    2) Stock splits/merge must be added to corporate actions data file
+      (`data/corporate_actions.csv`), Exante reports don't include them.
 
     """
 
@@ -41,73 +37,91 @@ class ExanteTradesReport(BaseReport):
         "FOREX": InstrumentType.CASH,
     }
 
-    @classmethod
-    def sniff(cls, filename):
-        try:
-            sample_row = next(read_csv_file(filename))
-        except csv.Error:
-            return False
-
-        return all(
-            column in sample_row
-            for column in (
-                cls.column_account,
-                cls.column_timestamp,
-                cls.column_type,
-                cls.column_side,
-                cls.column_quantity,
-                cls.column_currency,
-                cls.column_instrument,
-                cls.column_commission,
-            )
-        )
+    sniff_columns = (
+        column_account,
+        column_timestamp,
+        column_type,
+        column_side,
+        column_quantity,
+        column_currency,
+        column_instrument,
+        column_commission,
+    )
+    parser_version = 2
+
+    # Columns of rows read by `process`, in order of `parse_trade_fields` fields
+    trade_columns = (
+        column_type,
+        column_side,
+        column_instrument,
+        column_quantity,
+        column_price,
+        column_currency,
+        column_commission,
+        column_commission_currency,
+        column_timestamp,
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(ExanteTradesReport, self).__init__(*args, **kwargs)
+        self.timestamp_parser = TimestampParser()
 
     def process(self, taxation, filename):
 
-        for row in read_csv_file(filename):
-            print(row)
-
-            trade_record = self.parse_trade_log_record(row)
-            if trade_record:
-                self.trade_log.add_record(trade_record)
-
-    @classmethod
-    def parse_trade_log_record(cls, row) -> Optional[TradeRecord]:
+        for row in read_csv_rows(filename, self.trade_columns):
+            self.rows += 1
+            trade = self.parse_trade_fields(row)
+            if trade:
+                self.trade_log.add_trade(**trade)
+
+    def parse_trade_log_record(self, row) -> Optional[TradeRecord]:
+        trade = self.parse_trade_fields(row)
+        return TradeRecord(**trade) if trade else None
+
+    def parse_trade_fields(self, row) -> Optional[dict]:
+        """
+        TradeRecord fields of trade row, to be added with TradeLog.add_trade.
+        Row is a tuple of `trade_columns` values.
+        """
+        (
+            type_,
+            side,
+            instrument,
+            quantity,
+            price,
+            currency,
+            commission,
+            commission_currency,
+            timestamp,
+        ) = row
         # Skip pure asset rows and different transaction types
-        instrument_type = cls.instrument_map.get(row[cls.column_type])
+        instrument_type = self.instrument_map.get(type_)
         if instrument_type not in {InstrumentType.STOCK, InstrumentType.OPTION}:
-            logger.warning(
-                f"Unsupported instrument type: {row[cls.column_type]}, skipping."
-            )
+            logger.warning(f"Unsupported instrument type: {type_}, skipping.")
             return
 
-        assert row[cls.column_commission_currency] == row[cls.column_currency]
-        side_modifier = (
-            TradeRecord.BUY
-            if row[cls.column_side] == cls.side_buy
-            else TradeRecord.SELL
-        )
+        assert commission_currency == currency
+        side_modifier = TradeRecord.BUY if side == self.side_buy else TradeRecord.SELL
 
         try:
-            symbol, exchange = row[cls.column_instrument].split(".")
+            symbol, exchange = instrument.split(".")
         except ValueError:
             # Option case
-            symbol, exchange, opt1, opt2 = row[cls.column_instrument].split(".")
+            symbol, exchange, opt1, opt2 = instrument.split(".")
 
-        quantity = int(row[cls.column_quantity])
-        price = D(row[cls.column_price])
-        timestamp = parse(row[cls.column_timestamp])
-        quantity, price = support_stock_split(symbol, quantity, price, timestamp)
+        quantity = int(quantity)
+        price = D(price)
+        timestamp = self.timestamp_parser(timestamp)
 
-        return TradeRecord(
+        return dict(
             symbol=symbol,
             exchange=exchange,
-            account=cls.column_account,
+            account=self.column_account,
             quantity=quantity,
             price=price,
-            currency=row[cls.column_currency],
+            currency=currency,
             timestamp=timestamp,
             side=side_modifier,
             instrument=instrument_type,
-            commission=abs(D(row[cls.column_commission])),
+            commission=abs(D(commission)),
         )
@@ -1,13 +1,12 @@
 import datetime
+import re
 
 from decimal import Decimal as D
 import xml.etree.ElementTree as ET
 
-from dateutil.parser import parse
-
 from reports.base_report import BaseReport
 from tradelog import TradeRecord, InstrumentType
-from utils import logger, support_stock_split
+from utils import TimestampParser, logger
 
 
 class IBFlexQueryReport(BaseReport):
@@ -18,6 +17,10 @@ class IBFlexQueryReport(BaseReport):
     - "Interest Accruals" - all fields
     - TODO: ? "Commission Details" - all fields
     - TODO - detect splits?
+
+    By default the file is streamed with `iterparse` in a single pass and every
+    element is dropped as soon as it's handled, so memory usage doesn't depend
+    on report size. Set `streaming = False` to build the whole tree instead.
     """
 
     instrument_type_map = {
@@ -27,85 +30,146 @@ class IBFlexQueryReport(BaseReport):
         "CASH": InstrumentType.CASH,
     }
 
-    @classmethod
-    def sniff(cls, filename):
-        try:
-            with open(filename) as file:
-                return "FlexQueryResponse" in file.read(50)
-        except UnicodeDecodeError:
-            return False
+    sniff_marker = "FlexQueryResponse"
+    streaming = True
+    parser_version = 3
+    split_types = {"FS", "RS"}
+    split_re = re.compile(r"SPLIT (\d+(?:\.\d+)?) FOR (\d+(?:\.\d+)?)")
+
+    def __init__(self, *args, **kwargs):
+        super(IBFlexQueryReport, self).__init__(*args, **kwargs)
+        # Separate parser per column, each column has its own format
+        self.parse_trade_timestamp = TimestampParser()
+        self.parse_fee_timestamp = TimestampParser()
+        self.parse_accruals_date = TimestampParser()
+        self.parse_pay_date = TimestampParser()
+        self.parse_action_timestamp = TimestampParser()
 
     def process(self, taxation, filename):
+        if self.streaming:
+            self.process_stream(taxation, filename)
+        else:
+            self.process_tree(taxation, filename)
+
+    def process_tree(self, taxation, filename):
         tree = ET.parse(filename)
         self.calculate_transactions_and_commissions(tree, taxation)
         self.calculate_comissions_and_borrowing_fees(tree, taxation)
         self.calculate_dividends(tree, taxation)
+        self.calculate_corporate_actions(tree)
+
+    def process_stream(self, taxation, filename):
+        recorded_dividends = {}
+        interests_accurals_found = False
+        handlers = {
+            "Trade": lambda attrs: self.add_trade(attrs),
+            "UnbundledCommissionDetail": lambda attrs: self.add_commission_detail(
+                attrs, taxation
+            ),
+            "ChangeInDividendAccrual": lambda attrs: self.add_dividend_accrual(
+                attrs, taxation, recorded_dividends
+            ),
+            "CorporateAction": lambda attrs: self.add_corporate_action(attrs),
+        }
+
+        # Parents are kept on a stack only to detach handled children,
+        # so the partially built tree never grows past the current path
+        parents = []
+        for event, element in ET.iterparse(filename, events=("start", "end")):
+            if event == "start":
+                parents.append(element)
+                continue
+
+            parents.pop()
+            handler = handlers.get(element.tag)
+            if handler:
+                handler(element.attrib)
+            elif (
+                element.tag == "InterestAccrualsCurrency"
+                and element.attrib.get("currency") == "BASE_SUMMARY"
+                and not interests_accurals_found
+            ):
+                interests_accurals_found = True
+                self.add_interest_accruals(element.attrib, taxation)
+
+            if parents:
+                parents[-1].remove(element)
+
+        assert interests_accurals_found, "No BASE_SUMMARY interest accruals found"
 
     def calculate_transactions_and_commissions(self, tree, taxation):
         for trade in tree.findall(".//Trade"):
-            attrs = trade.attrib
-            instrument = self.instrument_type_map.get(
-                attrs["assetCategory"], attrs["assetCategory"]
-            )
-            if instrument not in {
-                InstrumentType.OPTION,
-                InstrumentType.STOCK,
-                InstrumentType.FOREX,
-            }:
-                logger.warning(f"Unsupported instument type: {instrument}, skipping.")
-                continue
+            self.add_trade(trade.attrib)
 
-            side_modifier = (
-                TradeRecord.BUY if attrs["buySell"] == "BUY" else TradeRecord.SELL
-            )
-            symbol = attrs["symbol"]
-            quantity = abs(D(attrs["quantity"]))
-            price = D(attrs["tradePrice"])
-            timestamp = parse(attrs["dateTime"])
-
-            quantity, price = support_stock_split(symbol, quantity, price, timestamp)
-
-            assert attrs["ibCommissionCurrency"] == attrs["currency"]
-
-            exchange = attrs["listingExchange"] or attrs["underlyingListingExchange"]
-            exchange = exchange.split(".")[0]
-            account_id = (
-                "IB" + attrs["accountId"][-5:]
-            )  # only last 5 bcs of Lynx accounts migration
-            self.trade_log.add_record(
-                TradeRecord(
-                    symbol=symbol,
-                    exchange=exchange,
-                    account=account_id,
-                    quantity=quantity,
-                    price=price,
-                    currency=attrs["currency"],
-                    timestamp=timestamp,
-                    side=side_modifier,
-                    instrument=instrument,
-                    commission=abs(D(attrs["ibCommission"])),
-                )
-            )
+    def add_trade(self, attrs):
+        self.rows += 1
+        instrument = self.instrument_type_map.get(
+            attrs["assetCategory"], attrs["assetCategory"]
+        )
+        if instrument not in {
+            InstrumentType.OPTION,
+            InstrumentType.STOCK,
+            InstrumentType.FOREX,
+        }:
+            logger.warning(f"Unsupported instument type: {instrument}, skipping.")
+            return
+
+        side_modifier = (
+            TradeRecord.BUY if attrs["buySell"] == "BUY" else TradeRecord.SELL
+        )
+        symbol = attrs["symbol"]
+        quantity = abs(D(attrs["quantity"]))
+        price = D(attrs["tradePrice"])
+        timestamp = self.parse_trade_timestamp(attrs["dateTime"])
+
+        assert attrs["ibCommissionCurrency"] == attrs["currency"]
+
+        exchange = attrs["listingExchange"] or attrs["underlyingListingExchange"]
+        exchange = exchange.split(".")[0]
+        account_id = (
+            "IB" + attrs["accountId"][-5:]
+        )  # only last 5 bcs of Lynx accounts migration
+        self.trade_log.add_trade(
+            symbol=symbol,
+            exchange=exchange,
+            account=account_id,
+            quantity=quantity,
+            price=price,
+            currency=attrs["currency"],
+            timestamp=timestamp,
+            side=side_modifier,
+            instrument=instrument,
+            commission=abs(D(attrs["ibCommission"])),
+        )
 
     def calculate_comissions_and_borrowing_fees(self, tree, taxation):
         for fee in tree.findall(".//UnbundledCommissionDetail"):
-            attrs = fee.attrib
-            fee_date = parse(attrs["dateTime"]).date()
-            if fee_date.year == self.tax_year:
-                taxation.add_cost(
-                    value=D(attrs["totalCommission"]),
-                    currency=attrs["currency"],
-                    date=fee_date,
-                )
+            self.add_commission_detail(fee.attrib, taxation)
 
         # TODO - assuming base currency is PLN
         interests_accurals_base = tree.find(
             './/InterestAccrualsCurrency[@currency="BASE_SUMMARY"]'
         )
-        fee_date = parse(interests_accurals_base.attrib["toDate"]).date()
-        if fee_date.year == self.tax_year:
+        self.add_interest_accruals(interests_accurals_base.attrib, taxation)
+
+    def add_commission_detail(self, attrs, taxation):
+        self.rows += 1
+        if self.outside_tax_years(attrs["dateTime"]):
+            return
+        fee_date = self.parse_fee_timestamp(attrs["dateTime"]).date()
+        if self.is_tax_year(fee_date.year):
             taxation.add_cost(
-                value=D(interests_accurals_base.attrib["accrualReversal"]),
+                value=D(attrs["totalCommission"]),
+                currency=attrs["currency"],
+                date=fee_date,
+            )
+
+    def add_interest_accruals(self, attrs, taxation):
+        self.rows += 1
+        fee_date = self.parse_accruals_date(attrs["toDate"]).date()
+        if self.is_tax_year(fee_date.year):
+            taxation.add_cost(
+                value=D(attrs["accrualReversal"]),
                 currency="PLN",
                 date=fee_date,
             )
@@ -113,40 +177,69 @@ class IBFlexQueryReport(BaseReport):
     def calculate_dividends(self, tree, taxation):
         recorded_dividends = {}
         for dividend in tree.findall(".//ChangeInDividendAccrual"):
-            attrs = dividend.attrib
-            pay_date = parse(attrs["payDate"]).date()
-            value = D(attrs["grossAmount"])
-            tax = D(attrs["tax"])
-
-            # Only current tax rate
-            if pay_date.year != self.tax_year:
-                continue
-
-            # Exclude reversals
-            if attrs["code"] != "Po":
-                continue
+            self.add_dividend_accrual(dividend.attrib, taxation, recorded_dividends)
+
+    def add_dividend_accrual(self, attrs, taxation, recorded_dividends):
+        self.rows += 1
+        if self.outside_tax_years(attrs["payDate"]):
+            return
+        pay_date = self.parse_pay_date(attrs["payDate"]).date()
+        value = D(attrs["grossAmount"])
+        tax = D(attrs["tax"])
+
+        # Only current tax rate
+        if not self.is_tax_year(pay_date.year):
+            return
+
+        # Exclude reversals
+        if attrs["code"] != "Po":
+            return
+
+        # IB reports have nasty duplicates
+        dividend_key = (attrs["symbol"], abs(value), pay_date)
+        if dividend_key in recorded_dividends:
+            logger.debug(f"Dividend {dividend_key} already recorded - skipping")
+            return
+        else:
+            recorded_dividends[dividend_key] = True
+
+        # Real dividend
+        if value > 0:
+            taxation.add_dividend(
+                symbol=attrs["symbol"],
+                value=value,
+                currency=attrs["currency"],
+                date=pay_date,
+                withholding_tax_value=tax,
+            )
+        else:
+            # dividend on short position paid to lender, count as cost
+            taxation.add_cost(
+                value=abs(value),
+                currency=attrs["currency"],
+                date=pay_date,
+            )
 
-            # IB reports have nasty duplicates
-            dividend_key = (attrs["symbol"], abs(value), pay_date)
-            if dividend_key in recorded_dividends:
-                logger.debug(f"Dividend {dividend_key} already recorded - skipping")
-                continue
-            else:
-                recorded_dividends[dividend_key] = True
-
-            # Real dividend
-            if value > 0:
-                taxation.add_dividend(
-                    symbol=attrs["symbol"],
-                    value=value,
-                    currency=attrs["currency"],
-                    date=pay_date,
-                    withholding_tax_value=tax,
-                )
-            else:
-                # dividend on short position paid to lender, count as cost
-                taxation.add_cost(
-                    value=abs(value),
-                    currency=attrs["currency"],
-                    date=pay_date,
-                )
+    def calculate_corporate_actions(self, tree):
+        for action in tree.findall(".//CorporateAction"):
+            self.add_corporate_action(action.attrib)
+
+    def add_corporate_action(self, attrs):
+        """Splits, e.g. `AAPL(US0378331005) SPLIT 4 FOR 1 (AAPL, APPLE INC, ...)`."""
+        self.rows += 1
+        if attrs["type"] not in self.split_types:
+            return
+        match = self.split_re.search(attrs["description"])
+        if not match:
+            logger.warning(f"Unsupported split: {attrs['description']}, skipping.")
+            return
+
+        # Ratios can be fractional, e.g. 3 FOR 2 as 1.5 FOR 1
+        new_numerator, new_denominator = D(match.group(1)).as_integer_ratio()
+        old_numerator, old_denominator = D(match.group(2)).as_integer_ratio()
+        self.trade_log.add_split(
+            symbol=attrs["symbol"],
+            date=self.parse_action_timestamp(attrs["dateTime"]).date(),
+            old=old_numerator * new_denominator,
+            new=new_numerator * old_denominator,
+        )
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Local calculation service, HTTP/JSON over TCP or Unix socket.
+
+    ./service.py [--port 8038 | --socket /run/pit-tool.sock] [--workers 2]
+
+Calculations run in worker processes, off the event loop. Each worker keeps
+its `Calculator` between requests: taxations with exchange rates loaded,
+corporate actions data, sniffed file probes and, with `--parse-cache`,
+parse cache (shared by all workers on disk). Every request gets its own TradeLog and taxations.
+
+    GET  /health     -> {"status": "ok", "workers": 2}
+    POST /calculate  <- {"files": ["/path/ib.xml"],
+                         "reports": [{"name": "trades.csv", "content": "<base64>"}],
+                         "year": 2023 | "years": "2021-2023" | "all",
+                         "tax": "PL_NBP_FIFO", "fifo_engine": "lots",
+                         "storage": "objects", "snapshot_in": "/path/snapshot.json"}
+                     -> `Calculator.results`, {"error": "..."} on failure
+
+Reports are processed in `files` order, then uploaded `reports`.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from pathlib import Path
+from typing import Optional, Tuple
+
+from calc_trades import parse_years
+from calculation import Calculator
+from corporate_actions import DEFAULT_FILE
+from ingest import ParseCache
+from taxations import SUPPORTED_TAXATIONS
+from tradelog import TradeLog
+from utils import logger
+
+# Worker process calculator, created by `init_worker`
+calculator: Optional[Calculator] = None
+
+
+class RequestError(ValueError):
+    """Invalid request, reported with 400 status."""
+
+
+def init_worker(config: dict) -> None:
+    global calculator
+    logging.basicConfig(level=getattr(logging, config["log"]))
+    calculator = Calculator(
+        config["corporate_actions"],
+        ParseCache() if config["parse_cache"] else None,
+    )
+    # Rates of the most common request loaded before any of them comes
+    calculator.taxation_template(config["tax"], config["warm_year"])
+
+
+def validate_request(request: dict) -> None:
+    """Check shape of `/calculate` request, before it's sent to a worker."""
+    if "years" in request:
+        try:
+            parse_years(str(request["years"]))
+        except ValueError as e:
+            raise RequestError(str(e))
+    files = request.get("files", [])
+    if not isinstance(files, list) or not all(isinstance(f, str) for f in files):
+        raise RequestError("files must be a list of paths")
+    reports = request.get("reports", [])
+    if not isinstance(reports, list):
+        raise RequestError("reports must be a list of objects")
+    for number, report in enumerate(reports):
+        if not isinstance(report, dict):
+            raise RequestError(f"Report {number} must be an object")
+        if not isinstance(report.get("name"), str):
+            raise RequestError(f"Report {number} has no name")
+        if not isinstance(report.get("content"), str):
+            raise RequestError(f"Report {number} has no base64 content")
+        try:
+            base64.b64decode(report.get("content"), validate=True)
+        except binascii.Error as e:
+            raise RequestError(f"Invalid base64 content of report {number}: {e}")
+
+
+def calculate(request: dict) -> dict:
+    """Worker process job, `/calculate` request to results."""
+    tax = request.get("tax", "PL_NBP_FIFO")
+    if tax not in SUPPORTED_TAXATIONS:
+        raise RequestError(f"Unknown taxation {tax}")
+    fifo_engine = request.get("fifo_engine", "lots")
+    if fifo_engine not in TradeLog.FIFO_ENGINES:
+        raise RequestError(f"Unknown FIFO engine {fifo_engine}")
+    storage = request.get("storage", "objects")
+    if storage not in TradeLog.STORAGES:
+        raise RequestError(f"Unknown storage {storage}")
+    if "years" in request:
+        tax_years = parse_years(str(request["years"]))
+    else:
+        tax_years = [int(request.get("year", datetime.now().year - 1))]
+
+    filenames = list(request.get("files", []))
+    reports = request.get("reports", [])
+    if not filenames and not reports:
+        raise RequestError("No files or reports to calculate")
+    with tempfile.TemporaryDirectory(prefix="pit_tool_service_") as directory:
+        for number, report in enumerate(reports):
+            # Number keeps names unique, suffix helps telling reports apart in logs
+            path = Path(directory) / f"{number}_{Path(report['name']).name}"
+            path.write_bytes(base64.b64decode(report["content"]))
+            filenames.append(str(path))
+
+        return calculator.calculate(
+            filenames,
+            tax,
+            tax_years,
+            fifo_engine,
+            storage,
+            request.get("snapshot_in"),
+        )
+
+
+class Service:
+    MAX_HEADER_LINES = 100
+
+    def __init__(self, pool: ProcessPoolExecutor, workers: int, max_body: int):
+        self.pool = pool
+        self.workers = workers
+        self.max_body = max_body
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            status, payload = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        body = json.dumps(payload, default=str).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def respond(self, reader: asyncio.StreamReader) -> Tuple[HTTPStatus, dict]:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return HTTPStatus.BAD_REQUEST, {"error": "Invalid request line"}
+        method, path, _ = request_line
+
+        headers = {}
+        for _ in range(self.MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return HTTPStatus.BAD_REQUEST, {"error": "Too many headers"}
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return HTTPStatus.BAD_REQUEST, {"error": "Invalid Content-Length"}
+        if length > self.max_body:
+            return HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {
+                "error": f"Request body over {self.max_body} bytes"
+            }
+        body = await reader.readexactly(length)
+
+        if path == "/health" and method == "GET":
+            return HTTPStatus.OK, {"status": "ok", "workers": self.workers}
+        if path != "/calculate":
+            return HTTPStatus.NOT_FOUND, {"error": f"Unknown path {path}"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Use POST"}
+
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": f"Invalid JSON: {e}"}
+        if not isinstance(request, dict):
+            return HTTPStatus.BAD_REQUEST, {"error": "Request must be JSON object"}
+        try:
+            validate_request(request)
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.pool, calculate, request
+            )
+        # Reports and taxations validate input with assertions
+        except (
+            RequestError,
+            AssertionError,
+            KeyError,
+            ValueError,
+            FileNotFoundError,
+        ) as e:
+            return HTTPStatus.BAD_REQUEST, {"error": f"{type(e).__name__}: {e}"}
+        except Exception as e:
+            logger.exception("Calculation failed")
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {
+                "error": f"{type(e).__name__}: {e}"
+            }
+        return HTTPStatus.OK, results
+
+
+async def serve(args) -> None:
+    config = {
+        "log": args.log,
+        "corporate_actions": args.corporate_actions,
+        "parse_cache": args.parse_cache,
+        "tax": args.tax,
+        "warm_year": args.warm_year,
+    }
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker, initargs=(config,)
+    ) as pool:
+        # Workers forked before the server socket and connections are open,
+        # otherwise they would keep them open in every worker
+        await asyncio.get_running_loop().run_in_executor(pool, os.getpid)
+        service = Service(pool, args.workers, args.max_body << 20)
+        if args.socket:
+            server = await asyncio.start_unix_server(service.handle, path=args.socket)
+        else:
+            server = await asyncio.start_server(service.handle, args.host, args.port)
+        addresses = ", ".join(str(s.getsockname()) for s in server.sockets)
+        logger.info(f"Serving on {addresses}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve tax calculations over HTTP/JSON, with warm caches."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8038)
+    parser.add_argument("--socket", help="listen on Unix socket instead of TCP")
+    parser.add_argument(
+        "--workers",
+        help="number of processes running calculations, each one at a time",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--tax",
+        help="taxation prepared on start",
+        choices=list(SUPPORTED_TAXATIONS.keys()),
+        default="PL_NBP_FIFO",
+    )
+    parser.add_argument(
+        "--warm-year",
+        help="last tax year of rates loaded on start",
+        type=int,
+        default=datetime.now().year - 1,
+    )
+    parser.add_argument(
+        "--corporate-actions",
+        help="CSV file with splits not included in reports, see the default one",
+        default=DEFAULT_FILE,
+    )
+    parser.add_argument(
+        "--parse-cache",
+        help="reuse events of reports parsed before, see README",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--max-body",
+        help="request size limit in MB, including uploaded reports",
+        type=int,
+        default=64,
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        help="log level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log))
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
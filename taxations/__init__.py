@@ -1,8 +1,14 @@
-from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from plugins import PluginRegistry
 
-SUPPORTED_TAXATIONS = {
-    "PL_NBP_FIFO": PolishNbpRatesFIFO,
-}
+# Imported when `--tax` names them, e.g. NumPy only for the vectorized one
+SUPPORTED_TAXATIONS = PluginRegistry(
+    "pit_tool.taxations",
+    {
+        "PL_NBP_FIFO": "taxations.polish_nbp_rates_fifo:PolishNbpRatesFIFO",
+        "PL_NBP_FIFO_FIXED_POINT": "taxations.polish_nbp_rates_fixed_point_fifo:PolishNbpRatesFixedPointFIFO",
+        "PL_NBP_FIFO_VECTORIZED": "taxations.polish_nbp_rates_vectorized_fifo:PolishNbpRatesVectorizedFIFO",
+    },
+)
 
 __all__ = [
     SUPPORTED_TAXATIONS,
@@ -1,10 +1,30 @@
 import datetime
 from decimal import Decimal as D
+from typing import List, Optional, TYPE_CHECKING
 
-from tradelog import TradeRecord, STOCK_EXCHANGE_COUNTRIES
+from tradelog import MatchTable, TradeBatch, TradeRecord, STOCK_EXCHANGE_COUNTRIES
+
+if TYPE_CHECKING:
+    from metrics import Metrics
 
 
 class BaseTaxation:
+    # Running totals summed up by `merge`
+    TOTALS = (
+        "total_dividend_value",
+        "total_dividend_owed_tax",
+        "total_dividend_withholding_tax",
+        "total_transaction_income",
+        "total_transaction_cost",
+        "total_costs",
+    )
+    # Valuation of FIFO matches, measured as its own stage of run metrics
+    VALUATION_METHODS = (
+        "add_closed_transaction",
+        "add_closed_rows",
+        "add_closed_matches",
+    )
+
     def __init__(self, tax_year: int) -> None:
         self.tax_year = tax_year
         self.total_dividend_value = 0
@@ -22,21 +42,106 @@ class BaseTaxation:
             for k in STOCK_EXCHANGE_COUNTRIES.values()
         }
 
+    def for_year(self, tax_year: int) -> "BaseTaxation":
+        """Empty taxation of the same kind for another tax year."""
+        return type(self)(tax_year)
+
+    def spawn(self) -> "BaseTaxation":
+        """Empty accumulator of the same configuration, e.g. for worker process."""
+        return self.for_year(self.tax_year)
+
+    def merge(self, other: "BaseTaxation", sign: int = 1) -> None:
+        """
+        Add up state of another accumulator spawned from this one, or with
+        `sign=-1` take back state merged before, e.g. to merge it recalculated.
+        """
+        for total in self.TOTALS:
+            setattr(self, total, getattr(self, total) + sign * getattr(other, total))
+        for key, profit in other.per_position_profit.items():
+            self.per_position_profit[key] = (
+                self.per_position_profit.get(key, 0) + sign * profit
+            )
+        for country, breakdown in other.per_country_trades_breakdown.items():
+            for field, value in breakdown.items():
+                self.per_country_trades_breakdown[country][field] += sign * value
+
+    def prepare(self) -> None:
+        """Load data needed for valuation upfront, instead of on first use."""
+
+    def prepare_shared(self) -> None:
+        """
+        `prepare` all data valuation could need, so it's only read from then
+        on, e.g. by forked worker processes.
+        """
+        self.prepare()
+
+    def register_metrics(self, metrics: "Metrics") -> None:
+        """
+        Instrument this instance for run metrics. Wrapped methods can't be
+        pickled, so not for taxations sent to worker processes.
+        """
+        metrics.time_methods(self, "valuation", self.VALUATION_METHODS)
+
     @property
     def summary(self) -> str:
         """Returns formatted summary."""
         raise NotImplementedError()
 
+    @property
+    def summary_values(self) -> dict:
+        """Values of `summary`, e.g. for JSON."""
+        raise NotImplementedError()
+
     def exchange(self, currency: str, value: D, date: datetime.date) -> D:
         """Convert to taxation base currency for given event date."""
         raise NotImplementedError()
 
+    def exchange_many(
+        self, currency: str, dates: List[datetime.date], values: List[D]
+    ) -> List[D]:
+        """Bulk version of `exchange` for batch callers."""
+        return [
+            self.exchange(currency, value, date) for date, value in zip(dates, values)
+        ]
+
     def add_closed_transaction(
-        self, open_trade: TradeRecord, close_trade: TradeRecord
+        self,
+        open_trade: TradeRecord,
+        close_trade: TradeRecord,
+        quantity: Optional[D] = None,
     ) -> D:
-        """Calculate profit/lose between open and close trades."""
+        """
+        Calculate profit/lose between open and close trades.
+        Closed quantity defaults to the smaller of trades quantities.
+        """
         raise NotImplementedError()
 
+    def add_closed_rows(
+        self,
+        batch: TradeBatch,
+        open_row: int,
+        close_row: int,
+        quantity: int,
+        quantity_exponent: int,
+    ) -> None:
+        """
+        `add_closed_transaction` for TradeBatch rows and scaled quantity,
+        as matched by `match_fifo_rows`.
+        """
+        self.add_closed_transaction(
+            batch.record(open_row),
+            batch.record(close_row),
+            batch.quantities.unscale(quantity, quantity_exponent),
+        )
+
+    def add_closed_matches(self, table: MatchTable) -> None:
+        """
+        Valuation stage for all matches of FIFO at once, by default
+        `add_closed_rows` for each of them.
+        """
+        for open_row, close_row, quantity, exponent in table:
+            self.add_closed_rows(table.batch, open_row, close_row, quantity, exponent)
+
     def add_dividend(
         self,
         symbol: str,
@@ -0,0 +1,58 @@
+"""
+Exact fixed-point arithmetic for taxation amounts.
+
+Values are kept as `(integer, decimals)` pairs meaning integer / 10**decimals,
+money as integer grosze (hundredths of base currency). Rounding to grosze is
+done with round half even, the same as `round(Decimal, 2)` in default context,
+so results are identical to the Decimal path as long as it doesn't round any
+intermediate product - see `DECIMAL_LIMIT`.
+"""
+
+from decimal import Decimal as D, DefaultContext
+from typing import Dict, Tuple, Union
+
+MONEY_DECIMALS = 2
+# Products below it have no more significant digits than Decimal context keeps
+DECIMAL_LIMIT = 10**DefaultContext.prec
+POWERS_OF_TEN = [10**n for n in range(64)]
+
+# Decimal ratio denominator -> (decimals, multiplier to 10**decimals)
+_denominators: Dict[int, Tuple[int, int]] = {1: (0, 1)}
+
+
+def to_scaled(value: Union[int, D]) -> Tuple[int, int]:
+    """Exact value as (integer, decimals), e.g. Decimal("1.5") -> (15, 1)."""
+    if isinstance(value, int):
+        return value, 0
+    numerator, denominator = value.as_integer_ratio()
+    try:
+        decimals, multiplier = _denominators[denominator]
+    except KeyError:
+        # Decimal denominators are 2**a * 5**b, so it always divides power of 10
+        decimals = 0
+        while POWERS_OF_TEN[decimals] % denominator:
+            decimals += 1
+        multiplier = POWERS_OF_TEN[decimals] // denominator
+        _denominators[denominator] = decimals, multiplier
+    return numerator * multiplier, decimals
+
+
+def round_half_even(numerator: int, denominator: int) -> int:
+    """numerator / denominator rounded to integer, ties to even."""
+    quotient, remainder = divmod(numerator, denominator)
+    twice = 2 * remainder
+    if twice > denominator or (twice == denominator and quotient % 2):
+        quotient += 1
+    return quotient
+
+
+def to_grosze(scaled: int, decimals: int) -> int:
+    """Scaled value rounded to grosze, same as `round(value, 2)`."""
+    if decimals <= MONEY_DECIMALS:
+        return scaled * POWERS_OF_TEN[MONEY_DECIMALS - decimals]
+    return round_half_even(scaled, POWERS_OF_TEN[decimals - MONEY_DECIMALS])
+
+
+def from_grosze(grosze: int) -> D:
+    """Decimal with 2 decimal places, as returned by `round(value, 2)`."""
+    return D(grosze).scaleb(-MONEY_DECIMALS)
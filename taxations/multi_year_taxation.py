@@ -0,0 +1,156 @@
+import datetime
+from decimal import Decimal as D
+from typing import Collection, Dict, Optional, TYPE_CHECKING
+
+from taxations.base_taxation import BaseTaxation
+from tradelog import MatchTable, TradeBatch, TradeRecord
+
+if TYPE_CHECKING:
+    from metrics import Metrics
+
+
+class MultiYearTaxation(BaseTaxation):
+    """
+    Routes taxable events to separate per-year taxations by event date,
+    so several tax years are computed in a single pass over reports and FIFO.
+
+    Per-year taxations are created with `template.for_year`, so they can share
+    data like exchange rates. With `tax_years=None` every year events happen
+    in gets its own taxation.
+    """
+
+    def __init__(
+        self,
+        template: BaseTaxation,
+        tax_years: Optional[Collection[int]] = None,
+    ) -> None:
+        self.template = template
+        self.tax_year = template.tax_year
+        self.tax_years = sorted(tax_years) if tax_years is not None else None
+        self.taxations: Dict[int, BaseTaxation] = {}
+        self.per_position_profit = {}
+        for year in self.tax_years or ():
+            self.taxation_for(year)
+
+    def taxation_for(self, year: int) -> Optional[BaseTaxation]:
+        if self.tax_years is not None and year not in self.tax_years:
+            return None
+        if year not in self.taxations:
+            self.taxations[year] = self.template.for_year(year)
+        return self.taxations[year]
+
+    def spawn(self) -> "MultiYearTaxation":
+        return MultiYearTaxation(self.template, self.tax_years)
+
+    def merge(self, other: "MultiYearTaxation", sign: int = 1) -> None:
+        for year, taxation in other.taxations.items():
+            self.taxation_for(year).merge(taxation, sign)
+        for key, profit in other.per_position_profit.items():
+            self.per_position_profit[key] = (
+                self.per_position_profit.get(key, 0) + sign * profit
+            )
+
+    def prepare(self) -> None:
+        self.template.prepare()
+
+    def prepare_shared(self) -> None:
+        self.template.prepare_shared()
+
+    def register_metrics(self, metrics: "Metrics") -> None:
+        # Per-year taxations are called only through this one
+        super(MultiYearTaxation, self).register_metrics(metrics)
+        self.template.register_metrics(metrics)
+
+    @property
+    def summary(self) -> str:
+        return "".join(
+            f"\n========  TAX YEAR {year}  ======================{self.taxations[year].summary}"
+            for year in sorted(self.taxations)
+        )
+
+    @property
+    def summary_values(self) -> dict:
+        return {
+            year: self.taxations[year].summary_values for year in sorted(self.taxations)
+        }
+
+    def exchange(self, currency: str, value: D, date: datetime.date) -> D:
+        return self.taxation_for(date.year).exchange(currency, value, date)
+
+    def add_closed_transaction(
+        self,
+        open_trade: TradeRecord,
+        close_trade: TradeRecord,
+        quantity: Optional[D] = None,
+    ) -> None:
+        taxation = self.taxation_for(close_trade.timestamp.year)
+        if taxation is None:
+            return
+
+        key = open_trade.key
+        profit_before = taxation.per_position_profit.get(key, 0)
+        taxation.add_closed_transaction(open_trade, close_trade, quantity)
+        self.per_position_profit[key] = (
+            self.per_position_profit.get(key, 0)
+            + taxation.per_position_profit.get(key, 0)
+            - profit_before
+        )
+
+    def add_closed_rows(
+        self,
+        batch: TradeBatch,
+        open_row: int,
+        close_row: int,
+        quantity: int,
+        quantity_exponent: int,
+    ) -> None:
+        close_year = batch.from_timestamp(batch.timestamps[close_row]).year
+        taxation = self.taxation_for(close_year)
+        if taxation is None:
+            return
+
+        key = batch.key(open_row)
+        profit_before = taxation.per_position_profit.get(key, 0)
+        taxation.add_closed_rows(
+            batch, open_row, close_row, quantity, quantity_exponent
+        )
+        self.per_position_profit[key] = (
+            self.per_position_profit.get(key, 0)
+            + taxation.per_position_profit.get(key, 0)
+            - profit_before
+        )
+
+    def add_closed_matches(self, table: MatchTable) -> None:
+        for year, year_table in table.split_by_close_year().items():
+            taxation = self.taxation_for(year)
+            if taxation is None:
+                continue
+
+            keys = dict.fromkeys(map(table.batch.key, year_table.open_rows))
+            profits_before = {
+                key: taxation.per_position_profit.get(key, 0) for key in keys
+            }
+            taxation.add_closed_matches(year_table)
+            for key, profit_before in profits_before.items():
+                self.per_position_profit[key] = (
+                    self.per_position_profit.get(key, 0)
+                    + taxation.per_position_profit.get(key, 0)
+                    - profit_before
+                )
+
+    def add_dividend(
+        self,
+        symbol: str,
+        currency: str,
+        value: D,
+        date: datetime.date,
+        withholding_tax_value: D,
+    ) -> None:
+        taxation = self.taxation_for(date.year)
+        if taxation is not None:
+            taxation.add_dividend(symbol, currency, value, date, withholding_tax_value)
+
+    def add_cost(self, currency: str, value: D, date: datetime.date) -> None:
+        taxation = self.taxation_for(date.year)
+        if taxation is not None:
+            taxation.add_cost(currency, value, date)
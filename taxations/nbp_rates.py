@@ -0,0 +1,459 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal as D
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from taxations.fixed_point import to_scaled
+from utils import logger, open_csv_table
+
+
+class NbpRatesFetcher:
+    """
+    Downloads yearly NBP archive CSVs into local directory.
+
+    Years are fetched concurrently over a shared connection pool, with timeouts
+    and retries. Every response is validated before it's atomically written,
+    so a failed download never leaves a broken file behind. A file is reused
+    without any request only once it holds the whole year, files of a still
+    growing year are revalidated with conditional requests (ETag/Last-Modified).
+    """
+
+    URL_TEMPLATE = "https://www.nbp.pl/kursy/Archiwum/archiwum_tab_a_{}.csv"
+    ENCODING = "cp1250"
+    # NBP publishes a table between Christmas and New Year, in any calendar
+    LAST_TABLE_MIN_DAY = (12, 27)
+
+    def __init__(
+        self,
+        directory=None,
+        url_template: Optional[str] = None,
+        max_workers: int = 4,
+        timeout: float = 30,
+        retries: int = 3,
+    ) -> None:
+        self.directory = Path(directory or tempfile.gettempdir())
+        self.url_template = url_template or self.URL_TEMPLATE
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+
+    @cached_property
+    def session(self):
+        """
+        Session created for the first download, requests isn't even imported
+        while all files are complete.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.max_workers,
+            max_retries=Retry(
+                total=self.retries,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+            ),
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def file_path(self, year: int) -> Path:
+        return self.directory / f"nbp_rates_{year}.csv"
+
+    def fetch(self, years: Iterable[int]) -> Dict[int, Optional[Path]]:
+        """Fetch given years, failed ones are logged and mapped to None."""
+        years = list(years)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return dict(zip(years, pool.map(self.fetch_year_or_none, years)))
+
+    def fetch_year_or_none(self, year: int) -> Optional[Path]:
+        try:
+            return self.fetch_year(year)
+        except (OSError, ValueError) as e:
+            # RequestException is OSError, requests is imported by `session`
+            requests = sys.modules.get("requests")
+            if isinstance(e, OSError) and not (
+                requests and isinstance(e, requests.RequestException)
+            ):
+                raise
+            logger.warning(f"Couldn't fetch NBP rates for {year}: {e}")
+            return None
+
+    def fetch_year(self, year: int) -> Path:
+        path = self.file_path(year)
+        meta_path = path.with_suffix(".json")
+
+        last_table_date = None
+        if path.exists():
+            try:
+                last_table_date = self.validate(path.read_bytes(), year)
+            except ValueError as e:
+                logger.warning(f"Dropping invalid NBP rates file {path}: {e}")
+
+        if last_table_date and last_table_date >= datetime.date(
+            year, *self.LAST_TABLE_MIN_DAY
+        ):
+            return path
+
+        headers = {}
+        if last_table_date and meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        url = self.url_template.format(year)
+        logger.info(f"Fetching NBP rates {url} into {path}")
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and last_table_date:
+            return path
+        response.raise_for_status()
+
+        self.validate(response.content, year)
+        self.write_atomic(path, response.content)
+        self.write_atomic(
+            meta_path,
+            json.dumps(
+                {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+            ).encode(),
+        )
+        return path
+
+    def validate(self, content: bytes, year: int) -> datetime.date:
+        """Check content is NBP table A for year, returns last table date."""
+        lines = content.decode(self.ENCODING).splitlines()
+        if not lines or not lines[0].startswith("data;"):
+            raise ValueError("Missing NBP table header")
+        dates = [line[:8] for line in lines if re.match(rf"{year}\d{{4}};", line)]
+        if not dates:
+            raise ValueError(f"No {year} exchange rates found")
+        last = max(dates)
+        return datetime.date(int(last[:4]), int(last[4:6]), int(last[6:8]))
+
+    def write_atomic(self, path: Path, content: bytes) -> None:
+        with tempfile.NamedTemporaryFile(
+            dir=path.parent, prefix=f".{path.name}.", delete=False
+        ) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+
+class NbpRatesStore:
+    """
+    Persistent store of NBP table A exchange rates.
+
+    Rates are imported once from NBP archive CSVs (`archiwum_tab_a_{year}.csv`)
+    into SQLite, keyed by currency and date ordinal and normalized to a single
+    currency unit (`100JPY` column is stored as JPY rate / 100). Source files
+    are re-imported only when their size or modification time changes, and
+    lookups are indexed queries, so a run doesn't pay for loading all years.
+    """
+
+    DEFAULT_PATH = Path(tempfile.gettempdir()) / "nbp_rates.sqlite3"
+    SCHEMA_VERSION = 1
+    RATE_COLUMN_RE = re.compile(r"^(\d+)([A-Z]{3})$")
+    DATE_RE = re.compile(r"^\d{8}$")
+    YEAR_RE = re.compile(r"(\d{4})\D*$")
+
+    def __init__(self, path=None) -> None:
+        self.path = Path(path or os.environ.get("NBP_RATES_DB", self.DEFAULT_PATH))
+        self.connection = sqlite3.connect(self.path)
+        self.create_schema()
+        self.max_day = self.query_max_day()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def create_schema(self) -> None:
+        (version,) = self.connection.execute("PRAGMA user_version").fetchone()
+        if version == self.SCHEMA_VERSION:
+            return
+
+        with self.connection:
+            self.connection.executescript(f"""
+                DROP TABLE IF EXISTS tables;
+                DROP TABLE IF EXISTS rates;
+                DROP TABLE IF EXISTS sources;
+                CREATE TABLE tables (day INTEGER PRIMARY KEY, year INTEGER);
+                CREATE TABLE rates (
+                    currency TEXT, day INTEGER, rate TEXT,
+                    PRIMARY KEY (currency, day)
+                ) WITHOUT ROWID;
+                CREATE TABLE sources (
+                    year INTEGER PRIMARY KEY, size INTEGER, mtime_ns INTEGER
+                );
+                PRAGMA user_version = {self.SCHEMA_VERSION};
+                """)
+
+    def has_year(self, year: int) -> bool:
+        return (
+            self.connection.execute(
+                "SELECT 1 FROM sources WHERE year = ?", (year,)
+            ).fetchone()
+            is not None
+        )
+
+    def has_complete_year(self, year: int) -> bool:
+        """Whether year is imported up to its last table, past Christmas."""
+        (day,) = self.connection.execute(
+            "SELECT MAX(day) FROM tables WHERE year = ?", (year,)
+        ).fetchone()
+        last_table_min = datetime.date(year, *NbpRatesFetcher.LAST_TABLE_MIN_DAY)
+        return day is not None and day >= last_table_min.toordinal()
+
+    def query_max_day(self) -> int:
+        (day,) = self.connection.execute("SELECT MAX(day) FROM tables").fetchone()
+        return day or 0
+
+    def import_file(self, filename, year: Optional[int] = None) -> bool:
+        """Import yearly NBP archive CSV, returns False if already up to date."""
+        if year is None:
+            year = int(self.YEAR_RE.search(Path(filename).stem).group(1))
+        stat = os.stat(filename)
+        source = self.connection.execute(
+            "SELECT size, mtime_ns FROM sources WHERE year = ?", (year,)
+        ).fetchone()
+        if source == (stat.st_size, stat.st_mtime_ns):
+            return False
+
+        logger.info(f"Importing NBP rates for {year} from {filename}")
+        tables = []
+        rates = []
+        with open_csv_table(filename, delimiter=";", cols_to_lower=False) as (
+            header,
+            reader,
+        ):
+            date_index = header.index("data")
+            rate_columns = [
+                (index, int(match.group(1)), match.group(2))
+                for index, match in enumerate(map(self.RATE_COLUMN_RE.match, header))
+                if match
+            ]
+            for row in reader:
+                date = row[date_index] if date_index < len(row) else ""
+                if not self.DATE_RE.match(date):
+                    continue
+                day = datetime.date(int(date[:4]), int(date[4:6]), int(date[6:8]))
+                tables.append((day.toordinal(), year))
+
+                for index, multiplier, currency in rate_columns:
+                    rate = row[index] if index < len(row) else None
+                    if not rate:
+                        continue
+                    rate = D(rate.replace(",", ".")) / multiplier
+                    rates.append((currency, day.toordinal(), str(rate)))
+
+        assert tables, f"No exchange rates found in {filename}"
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM rates WHERE day IN (SELECT day FROM tables WHERE year = ?)",
+                (year,),
+            )
+            self.connection.execute("DELETE FROM tables WHERE year = ?", (year,))
+            self.connection.executemany("INSERT INTO tables VALUES (?, ?)", tables)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO rates VALUES (?, ?, ?)", rates
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                (year, stat.st_size, stat.st_mtime_ns),
+            )
+        self.max_day = self.query_max_day()
+        return True
+
+    def import_directory(self, directory) -> int:
+        """Offline import of all NBP archive CSVs found in directory."""
+        imported = 0
+        for pattern in ("archiwum_tab_a_*.csv", "nbp_rates_*.csv"):
+            for filename in sorted(Path(directory).glob(pattern)):
+                imported += self.import_file(filename)
+        return imported
+
+    def rate(self, currency: str, date: datetime.date) -> D:
+        """
+        Rate for currency unit from the last table published on or before date.
+        Raises KeyError if there's no such table or currency isn't listed in it.
+        """
+        day = date.toordinal()
+        row = self.connection.execute(
+            """
+            SELECT t.day, r.rate FROM (
+                SELECT day FROM tables WHERE day <= ? ORDER BY day DESC LIMIT 1
+            ) t LEFT JOIN rates r ON r.day = t.day AND r.currency = ?
+            """,
+            (day, currency),
+        ).fetchone()
+        if row is None or row[1] is None or day > self.max_day:
+            raise KeyError(f"No {currency} rate for {date.isoformat()}")
+        return D(row[1])
+
+    def table(self) -> "NbpRatesTable":
+        return NbpRatesTable(self)
+
+
+class NbpRatesTable:
+    """
+    Dense in-memory view of the store for fast lookups.
+
+    `table_index` maps every calendar day (as offset from the first table day)
+    to the number of the last table published on or before that day, so
+    weekends and holidays resolve with a single array access. Rates of each
+    currency are kept in a list indexed by table number and loaded from the
+    store only when the currency is first used.
+
+    Rates resolved by `rate` are memoized per (currency, date, days_before),
+    valuation asks for rates of the same days over and over, e.g. for values
+    and commissions of trades. The memo is emptied once it's full.
+    """
+
+    MEMO_SIZE = 1 << 16
+
+    def __init__(self, store: NbpRatesStore) -> None:
+        self.store = store
+        days = [
+            day
+            for (day,) in store.connection.execute(
+                "SELECT day FROM tables ORDER BY day"
+            )
+        ]
+        assert days, "NBP rates store is empty"
+        self.table_days = {day: number for number, day in enumerate(days)}
+        self.first_day = days[0]
+        self.table_index = array("l")
+        for day in range(days[0], days[-1] + 1):
+            number = self.table_days.get(day)
+            self.table_index.append(self.table_index[-1] if number is None else number)
+        self.columns: Dict[str, List[Optional[D]]] = {}
+        self.memo: Dict[Tuple[str, datetime.date, int], D] = {}
+        self.memo_hits = self.memo_misses = 0
+        self.scaled_columns: Dict[str, List[Optional[Tuple[int, int]]]] = {}
+
+    def column(self, currency: str) -> List[Optional[D]]:
+        try:
+            return self.columns[currency]
+        except KeyError:
+            pass
+
+        column = [None] * len(self.table_days)
+        for day, rate in self.store.connection.execute(
+            "SELECT day, rate FROM rates WHERE currency = ?", (currency,)
+        ):
+            column[self.table_days[day]] = D(rate)
+        if all(rate is None for rate in column):
+            raise KeyError(f"Currency {currency} not found in NBP tables")
+        self.columns[currency] = column
+        return column
+
+    def load_all(self) -> None:
+        """
+        Load rates of every currency, so the store isn't queried anymore,
+        e.g. before the table is shared with forked worker processes.
+        """
+        for (currency,) in self.store.connection.execute(
+            "SELECT DISTINCT currency FROM rates"
+        ).fetchall():
+            self.column(currency)
+
+    def rate(self, currency: str, date: datetime.date, days_before: int = 0) -> D:
+        """
+        Rate for currency unit from the last table published on or before
+        `days_before` days prior to date.
+        """
+        key = (currency, date, days_before)
+        rate = self.memo.get(key)
+        if rate is not None:
+            self.memo_hits += 1
+            return rate
+
+        self.memo_misses += 1
+        offset = date.toordinal() - days_before - self.first_day
+        if 0 <= offset < len(self.table_index):
+            rate = self.column(currency)[self.table_index[offset]]
+        if rate is None:
+            raise KeyError(f"No {currency} rate for {date.isoformat()}")
+        if len(self.memo) >= self.MEMO_SIZE:
+            self.memo.clear()
+        self.memo[key] = rate
+        return rate
+
+    def scaled_rate(
+        self, currency: str, date: datetime.date, days_before: int = 0
+    ) -> Tuple[int, int]:
+        """`rate` as (integer, decimals) pair for fixed-point arithmetic."""
+        return self.scaled_rate_on_day(currency, date.toordinal() - days_before)
+
+    def scaled_column(self, currency: str) -> List[Optional[Tuple[int, int]]]:
+        """`column` of rates as (integer, decimals) pairs."""
+        column = self.scaled_columns.get(currency)
+        if column is None:
+            column = self.scaled_columns[currency] = [
+                None if rate is None else to_scaled(rate)
+                for rate in self.column(currency)
+            ]
+        return column
+
+    def scaled_rate_on_day(self, currency: str, day: int) -> Tuple[int, int]:
+        """`scaled_rate` for date ordinal."""
+        column = self.scaled_column(currency)
+        offset = day - self.first_day
+        rate = None
+        if 0 <= offset < len(self.table_index):
+            rate = column[self.table_index[offset]]
+        if rate is None:
+            date = datetime.date.fromordinal(day)
+            raise KeyError(f"No {currency} rate for {date.isoformat()}")
+        return rate
+
+    def rates(
+        self, currency: str, dates: Iterable[datetime.date], days_before: int = 0
+    ) -> List[D]:
+        """Bulk version of `rate`."""
+        column = self.column(currency)
+        table_index = self.table_index
+        first_day = self.first_day + days_before
+        rates = []
+        for date in dates:
+            offset = date.toordinal() - first_day
+            if (
+                not 0 <= offset < len(table_index)
+                or column[table_index[offset]] is None
+            ):
+                raise KeyError(f"No {currency} rate for {date.isoformat()}")
+            rates.append(column[table_index[offset]])
+        return rates
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage local NBP rates store.")
+    parser.add_argument("command", choices=["import"])
+    parser.add_argument("directory", help="directory with NBP archive CSV files")
+    parser.add_argument("--db", help="store path", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = NbpRatesStore(args.db)
+    logger.info(f"Imported {store.import_directory(args.directory)} files")
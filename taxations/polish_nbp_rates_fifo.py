@@ -1,16 +1,15 @@
 import datetime
-import os
-import re
-import tempfile
 from decimal import Decimal as D
 from functools import cached_property
-from pathlib import Path
-
-import requests
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
 
 from taxations.base_taxation import BaseTaxation
+from taxations.nbp_rates import NbpRatesFetcher, NbpRatesStore, NbpRatesTable
 from tradelog import TradeRecord, STOCK_EXCHANGE_COUNTRIES
-from utils import read_csv_file, logger
+from utils import logger
+
+if TYPE_CHECKING:
+    from metrics import Metrics
 
 
 class PolishNbpRatesFIFO(BaseTaxation):
@@ -35,19 +34,58 @@ class PolishNbpRatesFIFO(BaseTaxation):
 
     RATES_URL_TEMPLATE = "https://www.nbp.pl/kursy/Archiwum/archiwum_tab_a_{}.csv"
     BASE_CURRENCY = "PLN"
-    SUPPORTED_CURRENCIES = {
-        "EUR": 1,
-        "USD": 1,
-        "RUB": 1,
-        "CHF": 1,
-    }
     TAX_RATE = D("0.19")
+    # Rate lookups of NbpRatesTable, counted by run metrics
+    RATES_METHODS = ("rate", "rates", "scaled_rate_on_day", "scaled_column", "column")
 
     def __init__(self, *args, **kwargs):
         super(PolishNbpRatesFIFO, self).__init__(*args, **kwargs)
+        self.rates_until_year = self.tax_year
+        # (currency, date) -> costs not in `total_costs` yet
+        self.pending_costs: Dict[Tuple[str, datetime.date], List[D]] = {}
+
+    def for_year(self, tax_year: int) -> "PolishNbpRatesFIFO":
+        taxation = super(PolishNbpRatesFIFO, self).for_year(tax_year)
+        # Share rates, open trade can be valued at rates from later year
+        if tax_year <= self.rates_until_year:
+            taxation.rates_until_year = self.rates_until_year
+            taxation.rates_store = self.rates_store
+            taxation.rates = self.rates
+        return taxation
+
+    def __getstate__(self):
+        # Load rates before pickling, so worker processes don't fetch them again
+        self.rates
+        self.flush_costs()
+        return self.__dict__
+
+    def merge(self, other: "PolishNbpRatesFIFO", sign: int = 1) -> None:
+        self.flush_costs()
+        other.flush_costs()
+        super(PolishNbpRatesFIFO, self).merge(other, sign)
+
+    def prepare(self) -> None:
+        self.rates
+
+    def prepare_shared(self) -> None:
+        self.rates.load_all()
+
+    def register_metrics(self, metrics: "Metrics") -> None:
+        super(PolishNbpRatesFIFO, self).register_metrics(metrics)
+        rates = self.rates
+        metrics.count_methods(rates, "rates", self.RATES_METHODS)
+        # Every other `column` call is served from memory
+        metrics.collectors.append(
+            lambda: {
+                "rates.columns_loaded": len(rates.columns),
+                "rates.memo_hits": rates.memo_hits,
+                "rates.memo_misses": rates.memo_misses,
+            }
+        )
 
     @property
     def summary(self) -> str:
+        self.flush_costs()
         total_transaction_costs_and_fees = (
             self.total_transaction_cost + self.total_costs
         )
@@ -69,6 +107,29 @@ class PolishNbpRatesFIFO(BaseTaxation):
             f"\n !!!!!!!!!! COUNT BOSSA DIVIDENDS"
         )
 
+    @property
+    def summary_values(self) -> dict:
+        self.flush_costs()
+        total_transaction_costs_and_fees = (
+            self.total_transaction_cost + self.total_costs
+        )
+        return {
+            "currency": self.BASE_CURRENCY,
+            "transactions_income": self.total_transaction_income,
+            "transactions_costs_and_fees": total_transaction_costs_and_fees,
+            "transactions_cost": self.total_transaction_cost,
+            "costs": self.total_costs,
+            "profit": self.total_transaction_income - total_transaction_costs_and_fees,
+            "transactions_owed_tax": self.total_transaction_owed_tax,
+            "dividend_value": self.total_dividend_value,
+            "dividend_withholding_tax": round(self.total_dividend_withholding_tax, 2),
+            "dividend_owed_tax": round(self.total_dividend_owed_tax, 2),
+            "countries": {
+                country: dict(details, profit=details["income"] - details["cost"])
+                for country, details in self.per_country_trades_breakdown.items()
+            },
+        }
+
     @property
     def summary_pit_zg(self) -> str:
         zgs = []
@@ -82,6 +143,7 @@ class PolishNbpRatesFIFO(BaseTaxation):
 
     @property
     def total_transaction_owed_tax(self):
+        self.flush_costs()
         profit = (
             self.total_transaction_income
             - self.total_transaction_cost
@@ -90,64 +152,61 @@ class PolishNbpRatesFIFO(BaseTaxation):
         return round(self.TAX_RATE * max(profit, 0))
 
     @cached_property
-    def rates(self):
-        rates_by_date = {}
-
-        # For early January transactions rates from previous tax year needed
-        for tax_year in range(2020, self.tax_year + 1):
-            url = self.RATES_URL_TEMPLATE.format(tax_year)
-            saved_file = tempfile.gettempdir() / Path(f"nbp_rates_{tax_year}.csv")
+    def rates_store(self) -> NbpRatesStore:
+        store = NbpRatesStore()
+        fetcher = NbpRatesFetcher(url_template=self.RATES_URL_TEMPLATE)
+
+        # For early January transactions rates from previous tax year needed,
+        # only years still growing or missing in the store are fetched
+        years = [
+            year
+            for year in range(2020, self.rates_until_year + 1)
+            if not store.has_complete_year(year)
+        ]
+        for year, saved_file in fetcher.fetch(years).items():
+            if saved_file:
+                store.import_file(saved_file, year)
+            else:
+                assert store.has_year(year), f"NBP rates for {year} not available"
+
+        return store
 
-            if not os.path.exists(saved_file):
-                logger.info(
-                    f"NBP Rates file not found, fetching {url} into {saved_file}"
-                )
-                r = requests.get(url)
-                with open(saved_file, "wb") as f:
-                    f.write(r.content)
-
-            for row in read_csv_file(saved_file, delimiter=";", cols_to_lower=False):
-                date = row["data"]
-                if not re.match(r"^\d{8}$", date):
-                    continue
-                date = datetime.date(int(date[:4]), int(date[4:6]), int(date[6:8]))
-                rates_by_date[date] = {}
-                for currency_code, multiplier in self.SUPPORTED_CURRENCIES.items():
-                    try:
-                        rate = row[f"{multiplier}{currency_code}"].replace(",", ".")
-                    except KeyError:
-                        rate = None
-
-                    if not rate:
-                        logger.debug(
-                            f"No rate found for {currency_code} on {date.isoformat()})"
-                        )
-                        continue
-                    rates_by_date[date][currency_code] = D(rate)
-
-        # Fill missing dates for faster processing
-        min_date = min(rates_by_date.keys())
-        max_date = max(rates_by_date.keys())
-        cur_date = min_date
-        while cur_date < max_date:
-            cur_date += datetime.timedelta(days=1)
-            if cur_date not in rates_by_date:
-                rates_by_date[cur_date] = rates_by_date[
-                    cur_date - datetime.timedelta(days=1)
-                ]
-
-        return rates_by_date
+    @cached_property
+    def rates(self) -> NbpRatesTable:
+        """All NBP table A currencies, including non-unit ones like 100JPY."""
+        return self.rates_store.table()
 
     def exchange(self, currency: str, value: D, date: datetime.date) -> D:
-        if currency == "PLN":
+        if currency == self.BASE_CURRENCY:
             return value
-        exchange_rate = self.rates[date - datetime.timedelta(days=1)][currency]
+        # Rate from the last table published before the event date
+        exchange_rate = self.rates.rate(currency, date, days_before=1)
         return round(exchange_rate * value, 2)
 
-    def add_closed_transaction(self, open_trade: TradeRecord, close_trade: TradeRecord):
+    def exchange_many(
+        self, currency: str, dates: List[datetime.date], values: List[D]
+    ) -> List[D]:
+        if currency == self.BASE_CURRENCY:
+            return list(values)
+        return [
+            round(exchange_rate * value, 2)
+            for exchange_rate, value in zip(
+                self.rates.rates(currency, dates, days_before=1), values
+            )
+        ]
+
+    def add_closed_transaction(
+        self,
+        open_trade: TradeRecord,
+        close_trade: TradeRecord,
+        quantity: Optional[D] = None,
+    ):
         assert close_trade.timestamp.year == self.tax_year
 
-        closed_quantity = min(close_trade.quantity, open_trade.quantity)
+        if quantity is None:
+            closed_quantity = min(close_trade.quantity, open_trade.quantity)
+        else:
+            closed_quantity = quantity
 
         value_open = self.exchange(
             open_trade.currency,
@@ -179,7 +238,12 @@ class PolishNbpRatesFIFO(BaseTaxation):
             ),
             2,
         )
+        self.add_closed_values(open_trade, value_open, value_close, commissions)
 
+    def add_closed_values(
+        self, open_trade: TradeRecord, value_open: D, value_close: D, commissions: D
+    ) -> None:
+        """Account closed transaction values, already in base currency."""
         self.per_position_profit[open_trade.key] = (
             self.per_position_profit.get(open_trade.key, 0) + value_close - value_open
         )
@@ -216,5 +280,22 @@ class PolishNbpRatesFIFO(BaseTaxation):
     def add_cost(self, currency: str, value: D, date: datetime.date) -> None:
         assert date.year == self.tax_year
 
-        cost_value = round(self.exchange(currency, abs(value), date), 2)
-        self.total_costs += cost_value
+        costs = self.pending_costs.get((currency, date))
+        if costs is None:
+            costs = self.pending_costs[currency, date] = []
+        costs.append(value)
+
+    def flush_costs(self) -> None:
+        """
+        Add pending costs to `total_costs`, exchanged with one rate lookup for
+        all costs of a day in a currency, each of them rounded as before.
+        """
+        for (currency, date), costs in self.pending_costs.items():
+            if currency == self.BASE_CURRENCY:
+                self.total_costs += sum(round(abs(value), 2) for value in costs)
+            else:
+                exchange_rate = self.rates.rate(currency, date, days_before=1)
+                self.total_costs += sum(
+                    round(exchange_rate * abs(value), 2) for value in costs
+                )
+        self.pending_costs.clear()
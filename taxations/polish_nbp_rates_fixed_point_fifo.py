@@ -0,0 +1,226 @@
+from decimal import Decimal as D
+from typing import Dict, List, Optional, Tuple, Union
+
+from taxations.fixed_point import (
+    DECIMAL_LIMIT,
+    POWERS_OF_TEN,
+    from_grosze,
+    to_grosze,
+    to_scaled,
+)
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from tradelog import (
+    InstrumentType,
+    ScaledColumn,
+    STOCK_EXCHANGE_COUNTRIES,
+    TradeBatch,
+    TradeRecord,
+)
+
+
+class PolishNbpRatesFixedPointFIFO(PolishNbpRatesFIFO):
+    """
+    PolishNbpRatesFIFO valuing closed transactions with integer arithmetic.
+
+    Prices, quantities and rates are scaled integers and values are rounded to
+    integer grosze with round half even at the same points as the Decimal
+    path, then added up as integers, so totals are identical. Transactions
+    which Decimal context would have to round before that are valued the
+    Decimal way.
+
+    It pays off only with columnar trades storage, where FIFO passes matched
+    rows with prices and quantities already scaled. TradeRecords have to be
+    scaled first, which makes it slower than the Decimal path.
+    """
+
+    DAY = 86_400_000_000
+    EPOCH_DAY = TradeBatch.EPOCH.toordinal()
+
+    def __init__(self, *args, **kwargs):
+        super(PolishNbpRatesFixedPointFIFO, self).__init__(*args, **kwargs)
+        # Country -> grosze of [income, cost, commissions] not in totals yet
+        self.pending_grosze: Dict[str, List[int]] = {}
+
+    def flush_grosze(self) -> None:
+        """Add pending grosze to Decimal totals, same as adding one by one."""
+        for country, (income, cost, commissions) in self.pending_grosze.items():
+            breakdown = self.per_country_trades_breakdown[country]
+            breakdown["cost"] += from_grosze(cost + commissions)
+            breakdown["income"] += from_grosze(income)
+            self.total_transaction_cost += from_grosze(cost)
+            self.total_transaction_income += from_grosze(income)
+        self.pending_grosze.clear()
+
+    def __getstate__(self):
+        self.flush_grosze()
+        return super(PolishNbpRatesFixedPointFIFO, self).__getstate__()
+
+    @property
+    def summary(self) -> str:
+        self.flush_grosze()
+        return super(PolishNbpRatesFixedPointFIFO, self).summary
+
+    @property
+    def summary_values(self) -> dict:
+        self.flush_grosze()
+        return super(PolishNbpRatesFixedPointFIFO, self).summary_values
+
+    def merge(self, other: "PolishNbpRatesFixedPointFIFO", sign: int = 1) -> None:
+        self.flush_grosze()
+        other.flush_grosze()
+        super(PolishNbpRatesFixedPointFIFO, self).merge(other, sign)
+
+    def values_grosze(
+        self,
+        currency: str,
+        day: int,
+        value: int,
+        decimals: int,
+        commission: int,
+        commission_decimals: int,
+    ) -> Optional[Tuple[int, int]]:
+        """
+        Scaled trade value and commission in grosze on date ordinal, the same
+        as `round(exchange(...), 2)` of them. None if Decimal product would
+        exceed context precision.
+        """
+        # Both are exchanged with rate from the last table before the day
+        if currency != self.BASE_CURRENCY:
+            rate, rate_decimals = self.rates.scaled_rate_on_day(currency, day - 1)
+            value *= rate
+            decimals += rate_decimals
+            commission *= rate
+            commission_decimals += rate_decimals
+
+        if not (
+            -DECIMAL_LIMIT < value < DECIMAL_LIMIT
+            and -DECIMAL_LIMIT < commission < DECIMAL_LIMIT
+        ):
+            return None
+        return to_grosze(value, decimals), to_grosze(commission, commission_decimals)
+
+    def add_closed_grosze(
+        self,
+        key: Tuple[str, str],
+        exchange: str,
+        value_open: int,
+        value_close: int,
+        commissions: int,
+    ) -> None:
+        """`add_closed_values` for grosze, totals are kept pending."""
+        self.per_position_profit[key] = self.per_position_profit.get(
+            key, 0
+        ) + from_grosze(value_close - value_open)
+
+        country = STOCK_EXCHANGE_COUNTRIES[exchange]
+        pending = self.pending_grosze.get(country)
+        if pending is None:
+            pending = self.pending_grosze[country] = [0, 0, 0]
+        pending[0] += value_close
+        pending[1] += value_open
+        pending[2] += commissions
+
+    def add_closed_transaction(
+        self,
+        open_trade: TradeRecord,
+        close_trade: TradeRecord,
+        quantity: Optional[Union[int, D]] = None,
+    ):
+        assert close_trade.timestamp.year == self.tax_year
+
+        if quantity is None:
+            quantity = min(close_trade.quantity, open_trade.quantity)
+        scaled_quantity, quantity_decimals = to_scaled(quantity)
+
+        values = []
+        for trade in (open_trade, close_trade):
+            price, price_decimals = to_scaled(trade.price)
+            values.append(
+                self.values_grosze(
+                    trade.currency,
+                    trade.timestamp.toordinal(),
+                    price * scaled_quantity * trade.multiplier,
+                    price_decimals + quantity_decimals,
+                    *to_scaled(trade.commission),
+                )
+            )
+        if None in values:
+            return super(PolishNbpRatesFixedPointFIFO, self).add_closed_transaction(
+                open_trade, close_trade, quantity
+            )
+
+        (value_open, open_commission), (value_close, close_commission) = values
+        # Support shorts
+        if open_trade.side == TradeRecord.SELL:
+            value_open, value_close = value_close, value_open
+        self.add_closed_grosze(
+            open_trade.key,
+            open_trade.exchange,
+            value_open,
+            value_close,
+            close_commission + open_commission,
+        )
+
+    def add_closed_rows(
+        self,
+        batch: TradeBatch,
+        open_row: int,
+        close_row: int,
+        quantity: int,
+        quantity_exponent: int,
+    ) -> None:
+        scaled_quantity, quantity_decimals = self.unscaled(
+            quantity, quantity_exponent, batch.quantities.decimals
+        )
+
+        values = []
+        for row in (open_row, close_row):
+            price_exponent = batch.prices.exponents[row]
+            commission_exponent = batch.commissions.exponents[row]
+            if ScaledColumn.OVERFLOW_EXPONENT in (price_exponent, commission_exponent):
+                values.append(None)
+                break
+            price, price_decimals = self.unscaled(
+                batch.prices.values[row], price_exponent, batch.prices.decimals
+            )
+            if batch.INSTRUMENTS[batch.instrument_codes[row]] == InstrumentType.OPTION:
+                price *= 100
+            values.append(
+                self.values_grosze(
+                    batch.currencies.values[batch.currency_codes[row]],
+                    batch.timestamps[row] // self.DAY + self.EPOCH_DAY,
+                    price * scaled_quantity,
+                    price_decimals + quantity_decimals,
+                    *self.unscaled(
+                        batch.commissions.values[row],
+                        commission_exponent,
+                        batch.commissions.decimals,
+                    ),
+                )
+            )
+        if None in values:
+            return super(PolishNbpRatesFixedPointFIFO, self).add_closed_rows(
+                batch, open_row, close_row, quantity, quantity_exponent
+            )
+
+        (value_open, open_commission), (value_close, close_commission) = values
+        # Support shorts
+        if batch.sides[open_row] == TradeRecord.SELL:
+            value_open, value_close = value_close, value_open
+        self.add_closed_grosze(
+            batch.key(open_row),
+            batch.exchanges.values[batch.exchange_codes[open_row]],
+            value_open,
+            value_close,
+            close_commission + open_commission,
+        )
+
+    @staticmethod
+    def unscaled(scaled: int, exponent: int, decimals: int) -> Tuple[int, int]:
+        """
+        ScaledColumn value as (integer, decimals) with as few decimals as its
+        exponent allows, keeping products small.
+        """
+        if exponent == ScaledColumn.INT_EXPONENT or exponent > 0:
+            return scaled // POWERS_OF_TEN[decimals], 0
+        return scaled // POWERS_OF_TEN[decimals + exponent], -exponent
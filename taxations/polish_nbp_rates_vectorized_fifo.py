@@ -0,0 +1,236 @@
+from typing import Dict, Tuple
+
+from taxations.fixed_point import MONEY_DECIMALS, from_grosze
+from taxations.polish_nbp_rates_fixed_point_fifo import PolishNbpRatesFixedPointFIFO
+from tradelog import (
+    InstrumentType,
+    MatchTable,
+    ScaledColumn,
+    STOCK_EXCHANGE_COUNTRIES,
+    TradeRecord,
+)
+from utils import logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def as_numpy(column) -> "np.ndarray":
+    """Read-only view of array.array column, don't keep it after column grows."""
+    return np.frombuffer(column, dtype=column.typecode)
+
+
+class PolishNbpRatesVectorizedFIFO(PolishNbpRatesFixedPointFIFO):
+    """
+    PolishNbpRatesFixedPointFIFO valuing the whole FIFO match table at once
+    with NumPy, with a single rate lookup per currency.
+
+    Values are exact int64 fixed-point products rounded to grosze with round
+    half even, so results are identical to valuing matches one by one in the
+    same order. Matches which could overflow int64 are valued one by one, as
+    are all of them if NumPy isn't installed.
+
+    It needs columnar trades storage, with objects storage matches are valued
+    as they're matched.
+    """
+
+    # Limit for float estimates of int64 results, leaves a margin for their error
+    INT64_LIMIT = 2.0**62
+    POWERS_OF_TEN_LIMIT = 18
+
+    def __init__(self, *args, **kwargs):
+        super(PolishNbpRatesVectorizedFIFO, self).__init__(*args, **kwargs)
+        # Currency -> rates by table number as (coefficients, decimals) arrays
+        self.rate_arrays: Dict[str, Tuple["np.ndarray", "np.ndarray"]] = {}
+
+    def __getstate__(self):
+        state = dict(super(PolishNbpRatesVectorizedFIFO, self).__getstate__())
+        # Cheap to rebuild, no need to send them to worker processes
+        state["rate_arrays"] = {}
+        return state
+
+    def scaled_rates_on_days(
+        self, currency: str, days: "np.ndarray"
+    ) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Bulk `NbpRatesTable.scaled_rate_on_day`, as coefficients and decimals."""
+        if currency not in self.rate_arrays:
+            column = self.rates.scaled_column(currency)
+            self.rate_arrays[currency] = (
+                np.array([0 if r is None else r[0] for r in column], dtype=np.int64),
+                # -1 for days without table
+                np.array([-1 if r is None else r[1] for r in column], dtype=np.int64),
+            )
+        coefficients, decimals = self.rate_arrays[currency]
+
+        table_index = np.asarray(self.rates.table_index)
+        offsets = days - self.rates.first_day
+        valid = (offsets >= 0) & (offsets < len(table_index))
+        tables = table_index[np.where(valid, offsets, 0)]
+        rate_decimals = np.where(valid, decimals[tables], -1)
+        missing = np.flatnonzero(rate_decimals < 0)
+        if len(missing):
+            # Raises the same KeyError as lookup for single day
+            self.rates.scaled_rate_on_day(currency, int(days[missing[0]]))
+        return coefficients[tables], rate_decimals
+
+    @staticmethod
+    def coefficients(
+        values: "np.ndarray", exponents: "np.ndarray", decimals: int
+    ) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        ScaledColumn values as integers with as few decimals as their exponents
+        allow, keeping products small. Same as `unscaled` of each of them.
+        """
+        exponents = exponents.astype(np.int64)
+        # Overflow ones are valued one by one anyway
+        exponents[(exponents > 0) | (exponents == ScaledColumn.OVERFLOW_EXPONENT)] = 0
+        powers = 10 ** np.arange(decimals + 1, dtype=np.int64)
+        return values // powers[decimals + exponents], -exponents
+
+    def to_grosze(
+        self, values: "np.ndarray", decimals: "np.ndarray"
+    ) -> Tuple["np.ndarray", "np.ndarray"]:
+        """
+        `fixed_point.to_grosze` of each value and mask of values which could
+        overflow int64 on the way, their results are undefined.
+        """
+        powers = 10 ** np.arange(self.POWERS_OF_TEN_LIMIT + 1, dtype=np.int64)
+        shift = decimals - MONEY_DECIMALS
+        overflow = shift > self.POWERS_OF_TEN_LIMIT
+        up = powers[np.clip(-shift, 0, self.POWERS_OF_TEN_LIMIT)]
+        down = powers[np.clip(shift, 0, self.POWERS_OF_TEN_LIMIT)]
+        overflow |= np.abs(values.astype(np.float64)) * up >= self.INT64_LIMIT
+
+        quotient, remainder = np.divmod(values * up, down)
+        twice = 2 * remainder
+        quotient += (twice > down) | ((twice == down) & (quotient % 2 == 1))
+        return quotient, overflow
+
+    def rows_values_grosze(
+        self,
+        table: MatchTable,
+        rows: "np.ndarray",
+        quantity: "np.ndarray",
+        quantity_decimals: "np.ndarray",
+    ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """
+        Bulk `values_grosze` for one trade of every match, with mask of matches
+        which have to be valued one by one.
+        """
+        batch = table.batch
+        price_exponents = as_numpy(batch.prices.exponents)[rows]
+        commission_exponents = as_numpy(batch.commissions.exponents)[rows]
+        failed = (price_exponents == ScaledColumn.OVERFLOW_EXPONENT) | (
+            commission_exponents == ScaledColumn.OVERFLOW_EXPONENT
+        )
+        price, price_decimals = self.coefficients(
+            as_numpy(batch.prices.values)[rows], price_exponents, batch.prices.decimals
+        )
+        commission, commission_decimals = self.coefficients(
+            as_numpy(batch.commissions.values)[rows],
+            commission_exponents,
+            batch.commissions.decimals,
+        )
+        options = as_numpy(batch.instrument_codes)[rows] == batch.INSTRUMENTS.index(
+            InstrumentType.OPTION
+        )
+        multiplier = np.where(options, 100, 1)
+
+        # Rate from the last table before trade day, 1 for base currency
+        rate = np.ones(len(rows), dtype=np.int64)
+        rate_decimals = np.zeros(len(rows), dtype=np.int64)
+        currency_codes = as_numpy(batch.currency_codes)[rows]
+        days = as_numpy(batch.timestamps)[rows] // self.DAY + self.EPOCH_DAY - 1
+        for code in np.unique(currency_codes):
+            currency = batch.currencies.values[code]
+            if currency != self.BASE_CURRENCY:
+                currency_rows = currency_codes == code
+                rate[currency_rows], rate_decimals[currency_rows] = (
+                    self.scaled_rates_on_days(currency, days[currency_rows])
+                )
+
+        failed |= (
+            np.abs(price.astype(np.float64) * multiplier * quantity * rate)
+            >= self.INT64_LIMIT
+        )
+        failed |= np.abs(commission.astype(np.float64)) * rate >= self.INT64_LIMIT
+        value, value_overflow = self.to_grosze(
+            price * multiplier * quantity * rate,
+            price_decimals + quantity_decimals + rate_decimals,
+        )
+        commission, commission_overflow = self.to_grosze(
+            commission * rate, commission_decimals + rate_decimals
+        )
+        return value, commission, failed | value_overflow | commission_overflow
+
+    def add_closed_matches(self, table: MatchTable) -> None:
+        if np is None:
+            logger.warning("NumPy isn't installed, valuing matches one by one")
+        if np is None or not len(table):
+            return super(PolishNbpRatesVectorizedFIFO, self).add_closed_matches(table)
+
+        batch = table.batch
+        open_rows = as_numpy(table.open_rows)
+        close_rows = as_numpy(table.close_rows)
+        quantity, quantity_decimals = self.coefficients(
+            as_numpy(table.quantities),
+            as_numpy(table.exponents),
+            batch.quantities.decimals,
+        )
+        value_open, open_commission, open_failed = self.rows_values_grosze(
+            table, open_rows, quantity, quantity_decimals
+        )
+        value_close, close_commission, close_failed = self.rows_values_grosze(
+            table, close_rows, quantity, quantity_decimals
+        )
+        commissions = open_commission + close_commission
+        # Support shorts
+        shorts = as_numpy(batch.sides)[open_rows] == TradeRecord.SELL
+        value_open, value_close = (
+            np.where(shorts, value_close, value_open),
+            np.where(shorts, value_open, value_close),
+        )
+
+        fallback = open_failed | close_failed
+        valued = ~fallback
+        # Sums of any values subset have to fit int64 too
+        magnitude = sum(
+            np.abs(values[valued].astype(np.float64)).sum()
+            for values in (value_open, value_close, commissions)
+        )
+        if magnitude >= self.INT64_LIMIT:
+            return super(PolishNbpRatesVectorizedFIFO, self).add_closed_matches(table)
+
+        # Profits of positions in order of their first match, as if added one by one
+        keys = (
+            as_numpy(batch.account_codes)[open_rows].astype(np.int64)
+            * len(batch.symbols.values)
+            + as_numpy(batch.symbol_codes)[open_rows]
+        )
+        _, first_matches, key_groups = np.unique(
+            keys, return_index=True, return_inverse=True
+        )
+        profits = np.zeros(len(first_matches), dtype=np.int64)
+        np.add.at(profits, key_groups[valued], (value_close - value_open)[valued])
+        for group in np.argsort(first_matches, kind="stable"):
+            key = batch.key(int(open_rows[first_matches[group]]))
+            self.per_position_profit[key] = self.per_position_profit.get(
+                key, 0
+            ) + from_grosze(int(profits[group]))
+
+        countries = np.array(
+            [STOCK_EXCHANGE_COUNTRIES[exchange] for exchange in batch.exchanges.values]
+        )[as_numpy(batch.exchange_codes)[open_rows]]
+        for country in np.unique(countries[valued]):
+            country_matches = valued & (countries == country)
+            pending = self.pending_grosze.setdefault(str(country), [0, 0, 0])
+            pending[0] += int(value_close[country_matches].sum())
+            pending[1] += int(value_open[country_matches].sum())
+            pending[2] += int(commissions[country_matches].sum())
+
+        if fallback.any():
+            super(PolishNbpRatesVectorizedFIFO, self).add_closed_matches(
+                table.take(np.flatnonzero(fallback).tolist())
+            )
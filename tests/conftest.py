@@ -0,0 +1,26 @@
+import pytest
+
+from benchmarks.generators import write_dataset
+from taxations.nbp_rates import NbpRatesStore
+
+
+@pytest.fixture(scope="session")
+def dataset(tmp_path_factory):
+    """Generated IB and Exante reports of 2020-2023, with NBP rates files."""
+    directory = tmp_path_factory.mktemp("dataset")
+    return write_dataset(directory, 2000, symbols=30, ib_files=2)
+
+
+@pytest.fixture(scope="session")
+def rates_db(dataset):
+    """NBP rates store with complete years of `dataset`."""
+    directory = dataset[0].parent
+    store = NbpRatesStore(directory / "rates.sqlite3")
+    store.import_directory(directory)
+    return store.path
+
+
+@pytest.fixture
+def nbp_rates(rates_db, monkeypatch):
+    """Taxations use `rates_db`, with nothing to fetch for 2020-2023."""
+    monkeypatch.setenv("NBP_RATES_DB", str(rates_db))
@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+from batch import load_manifest, run_batch
+from calculation import Calculator
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_invalid_portfolio_doesnt_stop_batch(dataset, nbp_rates, tmp_path, workers):
+    files = [str(f) for f in dataset]
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(
+        json.dumps(
+            [
+                {"name": "reversed", "files": files, "years": "2023-2021"},
+                {"name": "valid", "files": files, "years": "2021-2023"},
+            ]
+        )
+    )
+    output_dir = tmp_path / "results"
+
+    statuses = run_batch(load_manifest(manifest), output_dir, workers)
+
+    assert [s["status"] for s in statuses] == ["error", "ok"]
+    assert "Reversed years range" in statuses[0]["error"]
+    assert json.loads((output_dir / "batch.json").read_text()) == statuses
+    assert not (output_dir / "reversed.json").exists()
+    expected = Calculator().calculate(files, "PL_NBP_FIFO", [2021, 2022, 2023])
+    assert json.loads((output_dir / "valid.json").read_text()) == json.loads(
+        json.dumps(expected, default=str)
+    )
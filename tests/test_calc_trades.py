@@ -0,0 +1,15 @@
+import pytest
+
+from calc_trades import parse_years
+
+
+def test_parse_years():
+    assert parse_years("2021-2023") == [2021, 2022, 2023]
+    assert parse_years("2023,2020-2021, 2020") == [2020, 2021, 2023]
+    assert parse_years("all") is None
+
+
+@pytest.mark.parametrize("value", ["2023-2021", "x", "", "2021-", "2020,,2021"])
+def test_parse_years_invalid(value):
+    with pytest.raises(ValueError):
+        parse_years(value)
@@ -0,0 +1,135 @@
+import datetime
+from decimal import Decimal as D
+
+import pytest
+
+from corporate_actions import CorporateActions
+from reports.ib_flex_query_report import IBFlexQueryReport
+from taxations.nbp_rates import NbpRatesStore
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from tradelog import TradeLog
+
+TRADE = (
+    '<Trade accountId="U1234567" currency="USD" assetCategory="STK" symbol="ACME" '
+    'listingExchange="NYSE" underlyingListingExchange="" dateTime="{date};150000" '
+    'quantity="{quantity}" tradePrice="{price}" ibCommission="-1" '
+    'ibCommissionCurrency="USD" buySell="{side}" />'
+)
+SPLIT = (
+    '<CorporateAction type="FS" symbol="ACME" dateTime="{date};202500" '
+    'description="ACME(US0000000000) SPLIT 3 FOR 1 (ACME, ACME CORP, US0000000001)" />'
+)
+# Bought before the split in lots not divisible by 3, sold after it
+TRADES = [
+    ("20230301", "101", "30", "BUY"),
+    ("20230302", "7", "33", "BUY"),
+    ("20230801", "-100", "12", "SELL"),
+    ("20230802", "-100", "12", "SELL"),
+    ("20230803", "-100", "12", "SELL"),
+]
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("rates")
+    store = NbpRatesStore(directory / "rates.sqlite3")
+    for year in (2022, 2023, 2024):
+        rates_file = directory / f"nbp_rates_{year}.csv"
+        lines = ["data;1USD"]
+        day = datetime.date(year, 1, 1)
+        while day.year == year:
+            if day.weekday() < 5:
+                lines.append(day.strftime("%Y%m%d;4,0000"))
+            day += datetime.timedelta(days=1)
+        rates_file.write_text("\n".join(lines), encoding="cp1250")
+        store.import_file(rates_file)
+    return store
+
+
+def write_report(filename, trades, split_date="20230601"):
+    elements = [
+        TRADE.format(date=d, quantity=q, price=p, side=s) for d, q, p, s in trades
+    ]
+    if split_date:
+        elements.append(SPLIT.format(date=split_date))
+    filename.write_text(
+        '<FlexQueryResponse queryName="test" type="AF"><FlexStatements count="1">'
+        "<FlexStatement><Trades>" + "".join(elements) + "</Trades>"
+        '<InterestAccruals><InterestAccrualsCurrency currency="BASE_SUMMARY" '
+        'toDate="20231231" accrualReversal="0" /></InterestAccruals>'
+        "</FlexStatement></FlexStatements></FlexQueryResponse>"
+    )
+    return filename
+
+
+def calculate(store, filename, tax_year, storage="objects", snapshot_in=None):
+    taxation = PolishNbpRatesFIFO(tax_year)
+    taxation.rates_store = store
+    taxation.rates = store.table()
+    trade_log = TradeLog(taxation, storage=storage)
+    if snapshot_in:
+        trade_log.load_snapshot(snapshot_in)
+    IBFlexQueryReport(trade_log, tax_year).process(taxation, filename)
+    trade_log.calculate_closed_positions(tax_year)
+    return trade_log
+
+
+def test_ratio_to_period_with_most_shares():
+    actions = CorporateActions()
+    # Forward split, trades converted to shares from after it
+    actions.add_split("FWD", datetime.date(2023, 6, 1), 1, 3)
+    assert actions.ratio("FWD", datetime.date(2023, 6, 1)) == (1, 3)
+    assert actions.ratio("FWD", datetime.date(2023, 6, 2)) == (1, 1)
+    # Reverse split, trades converted to shares from before it
+    actions.add_split("REV", datetime.date(2023, 6, 1), 3, 1)
+    assert actions.ratio("REV", datetime.date(2023, 5, 1)) == (1, 1)
+    assert actions.ratio("REV", datetime.date(2023, 7, 1)) == (1, 3)
+    # 3-for-1 followed by 1-for-2, most shares between them
+    actions.add_split("MIX", datetime.date(2023, 6, 1), 1, 3)
+    actions.add_split("MIX", datetime.date(2023, 9, 1), 2, 1)
+    assert actions.ratio("MIX", datetime.date(2023, 5, 1)) == (1, 3)
+    assert actions.ratio("MIX", datetime.date(2023, 7, 1)) == (1, 1)
+    assert actions.ratio("MIX", datetime.date(2023, 10, 1)) == (1, 2)
+    assert actions.ratio("OTHER", datetime.date(2023, 7, 1)) == (1, 1)
+
+    assert CorporateActions.adjust(101, D("30"), 1, 3) == (303, D("10"))
+    assert CorporateActions.adjust(D("101"), D("30"), 1, 3) == (D("303"), D("10"))
+
+
+@pytest.mark.parametrize("storage", TradeLog.STORAGES)
+def test_split_with_odd_lots(store, tmp_path, storage):
+    filename = write_report(tmp_path / "ib.xml", TRADES)
+    trade_log = calculate(store, filename, 2023, storage)
+
+    # 108 shares before the split are 324 after it, 300 of them sold,
+    # with no fractions left in lots
+    assert sorted((t.quantity, t.price) for t in trade_log.outstanding_positions) == [
+        (D("3"), D("10")),
+        (D("21"), D("11")),
+    ]
+    assert trade_log.match_count == 3
+
+
+@pytest.mark.parametrize("storage", TradeLog.STORAGES)
+def test_snapshot_before_split(store, tmp_path, storage):
+    # Bought in 2023, split and sold in 2024
+    trades = [(f"2024{date[4:]}", *trade) for date, *trade in TRADES]
+    trades[:2] = TRADES[:2]
+    filename = write_report(tmp_path / "ib.xml", trades, split_date="20240601")
+    trade_log = calculate(store, filename, 2023, storage)
+    snapshot = tmp_path / "snapshot.json"
+    trade_log.save_snapshot(snapshot, 2023)
+
+    # Shares held at the end of the year, not converted with the later split
+    loaded = TradeLog(None)
+    loaded.load_snapshot(snapshot)
+    assert [(t.quantity, t.price) for t in loaded.records[("IB34567", "ACME")]] == [
+        (D("101"), D("30")),
+        (D("7"), D("33")),
+    ]
+
+    trade_log = calculate(store, filename, 2024, storage, snapshot_in=snapshot)
+    assert sorted((t.quantity, t.price) for t in trade_log.outstanding_positions) == [
+        (D("3"), D("10")),
+        (D("21"), D("11")),
+    ]
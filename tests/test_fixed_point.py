@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from benchmarks.fixed_point import (
+    YEAR,
+    add_rows,
+    add_trades,
+    batch_matches,
+    generate_matches,
+    state,
+    write_rates_file,
+)
+from taxations.nbp_rates import NbpRatesStore
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from taxations.polish_nbp_rates_fixed_point_fifo import PolishNbpRatesFixedPointFIFO
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    random.seed(0)
+    directory = tmp_path_factory.mktemp("rates")
+    rates_file = directory / f"nbp_rates_{YEAR}.csv"
+    write_rates_file(rates_file)
+    store = NbpRatesStore(directory / "rates.sqlite3")
+    store.import_file(rates_file)
+    return store
+
+
+def taxations(store):
+    for taxation_class in (PolishNbpRatesFIFO, PolishNbpRatesFixedPointFIFO):
+        taxation = taxation_class(YEAR)
+        taxation.rates_store = store
+        taxation.rates = store.table()
+        yield taxation
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+@pytest.mark.parametrize("storage", ["objects", "columnar"])
+def test_fixed_point_matches_decimal(store, seed, storage):
+    random.seed(seed)
+    matches = generate_matches(500)
+    if storage == "columnar":
+        batch, rows_matches = batch_matches(matches)
+        add, matches = add_rows, [(batch, *match) for match in rows_matches]
+    else:
+        add = add_trades
+
+    decimal_taxation, fixed_point_taxation = taxations(store)
+    for match in matches:
+        add(decimal_taxation, match)
+        add(fixed_point_taxation, match)
+        fixed_point_taxation.flush_grosze()
+        assert state(decimal_taxation) == state(fixed_point_taxation)
+    # Same Decimal exponents, not just equal values
+    assert str(state(decimal_taxation)) == str(state(fixed_point_taxation))
@@ -0,0 +1,120 @@
+import os
+import shutil
+import stat
+from decimal import Decimal as D
+
+import pytest
+
+from calculation import Calculator
+from ingest import EventRecorder, ParseCache, ingest_file, ingest_files
+from reports import SUPPORTED_REPORTS, sniff_report_type
+from taxations.multi_year_taxation import MultiYearTaxation
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from tradelog import TradeLog
+
+TAX_YEARS = [2021, 2022, 2023]
+
+
+def calculate(filenames, workers=None):
+    """Results of ingest_files, or of reports processed one by one if no workers."""
+    taxation = MultiYearTaxation(PolishNbpRatesFIFO(max(TAX_YEARS)), TAX_YEARS)
+    trade_log = TradeLog(taxation)
+    if workers is None:
+        for filename in filenames:
+            report_type = sniff_report_type(filename)
+            report = SUPPORTED_REPORTS[report_type](trade_log, TAX_YEARS)
+            report.process(taxation, filename)
+    else:
+        ingest_files(trade_log, taxation, filenames, TAX_YEARS, workers)
+    trade_log.calculate_closed_positions(TAX_YEARS)
+    return Calculator.results(trade_log, taxation, TAX_YEARS)["years"]
+
+
+@pytest.fixture(scope="module")
+def filenames(dataset, tmp_path_factory):
+    # Same dividends in two IB reports, e.g. overlapping statements
+    copy = tmp_path_factory.mktemp("ingest") / "ib_copy.xml"
+    shutil.copy(dataset[0], copy)
+    ib, other_ib, *exante = (str(f) for f in dataset)
+    # Large report first, the ones after it are done before it with 2 workers
+    return [ib, *exante, str(copy), other_ib]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_same_as_reports_one_by_one(nbp_rates, filenames, workers):
+    assert calculate(filenames, workers) == calculate(filenames)
+
+
+def test_dividends_deduplicated_per_file(nbp_rates, dataset, filenames):
+    with_copy = calculate(filenames, workers=2)
+    base = calculate([f for f in filenames if not f.endswith("ib_copy.xml")], 2)
+    alone = calculate([str(dataset[0])], 1)
+
+    # Duplicates within a file are skipped, the copy counts its own dividends
+    for year in TAX_YEARS:
+        dividends = [
+            D(results[year]["summary"]["dividend_value"])
+            for results in (with_copy, base, alone)
+        ]
+        assert dividends[0] - dividends[1] == dividends[2]
+    assert any(alone[year]["summary"]["dividend_value"] for year in TAX_YEARS)
+
+
+def test_parse_cache_round_trip(dataset, tmp_path):
+    cache = ParseCache(tmp_path / "cache")
+    filename = str(dataset[0])
+    report_type, rows, recorder, cached = ingest_file((filename, TAX_YEARS, cache))
+    assert not cached
+
+    path = cache.path(filename, report_type, TAX_YEARS)
+    assert path.exists()
+    assert cache.load(path)[0] == rows
+    _, cached_rows, cached_recorder, cached = ingest_file((filename, TAX_YEARS, cache))
+    assert cached and cached_rows == rows
+    assert cached_recorder.events == recorder.events
+    # Entries are specific to tax years reports filter events by
+    assert cache.path(filename, report_type, [2023]) != path
+
+
+@pytest.mark.parametrize("content", [b"", b"garbage", b"x\x9c\x00"])
+def test_parse_cache_corrupted_entry(dataset, tmp_path, content):
+    cache = ParseCache(tmp_path / "cache")
+    filename = str(dataset[2])
+    report_type, rows, recorder, _ = ingest_file((filename, TAX_YEARS, cache))
+    path = cache.path(filename, report_type, TAX_YEARS)
+    path.write_bytes(content)
+
+    assert cache.load(path) is None
+    # Parsed again and stored in place of the corrupted entry
+    assert ingest_file((filename, TAX_YEARS, cache))[3] is False
+    assert cache.load(path)[1].events == recorder.events
+
+
+def test_parse_cache_evict(tmp_path):
+    cache = ParseCache(tmp_path / "cache")
+    recorder = EventRecorder()
+    recorder.add_cost("fee", 1)
+    paths = [cache.directory / f"{number}.bin" for number in range(4)]
+    for number, path in enumerate(paths):
+        cache.store(path, number, recorder)
+        os.utime(path, ns=(number * 10**9, number * 10**9))
+    # Oldest entry used again, the others were used after the first one
+    cache.load(paths[0])
+    cache.max_size = sum(path.stat().st_size for path in paths[2:])
+
+    cache.evict()
+
+    assert sorted(cache.directory.glob("*.bin")) == [paths[0], paths[3]]
+
+
+def test_parse_cache_directory_owner(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    directory.mkdir(mode=0o755)
+    directory.chmod(0o755)
+    ParseCache(directory)
+    # Narrowed to the user
+    assert stat.S_IMODE(directory.stat().st_mode) == 0o700
+
+    monkeypatch.setattr(os, "getuid", lambda: directory.stat().st_uid + 1)
+    with pytest.raises(PermissionError):
+        ParseCache(directory)
@@ -0,0 +1,111 @@
+import datetime
+import hashlib
+import shutil
+import threading
+from decimal import Decimal as D
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from taxations.nbp_rates import NbpRatesFetcher, NbpRatesStore
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+
+
+def rates_csv(year: int, last_day: str) -> bytes:
+    lines = ["data;1USD;1EUR", f"{year}0102;4,0000;4,5000"]
+    lines.append(f"{year}{last_day};4,1000;4,6000")
+    return "\n".join(lines).encode("cp1250")
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    # Path -> body, served with ETag of its hash
+    files = {}
+    requests = []
+
+    def do_GET(self):
+        self.requests.append((self.path, self.headers.get("If-None-Match")))
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def archive():
+    ArchiveHandler.files = {}
+    ArchiveHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ArchiveHandler, f"http://127.0.0.1:{server.server_port}/archiwum_{{}}.csv"
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_complete_year_once(archive, tmp_path):
+    handler, url_template = archive
+    handler.files["/archiwum_2022.csv"] = rates_csv(2022, "1230")
+    fetcher = NbpRatesFetcher(tmp_path, url_template)
+
+    path = fetcher.fetch_year(2022)
+    assert path.read_bytes() == rates_csv(2022, "1230")
+    assert fetcher.fetch_year(2022) == path
+    assert handler.requests == [("/archiwum_2022.csv", None)]
+
+
+def test_revalidate_growing_year(archive, tmp_path):
+    handler, url_template = archive
+    handler.files["/archiwum_2024.csv"] = rates_csv(2024, "0614")
+    fetcher = NbpRatesFetcher(tmp_path, url_template)
+
+    path = fetcher.fetch_year(2024)
+    # Unchanged, answered with 304
+    assert fetcher.fetch_year(2024) == path
+    etag = f'"{hashlib.sha256(path.read_bytes()).hexdigest()}"'
+    assert handler.requests[1] == ("/archiwum_2024.csv", etag)
+
+    handler.files["/archiwum_2024.csv"] = rates_csv(2024, "0621")
+    assert fetcher.fetch_year(2024).read_bytes() == rates_csv(2024, "0621")
+    assert len(handler.requests) == 3
+
+
+def test_invalid_body_not_saved(archive, tmp_path):
+    handler, url_template = archive
+    handler.files["/archiwum_2023.csv"] = b"<html>Maintenance</html>"
+    fetcher = NbpRatesFetcher(tmp_path, url_template)
+
+    assert fetcher.fetch([2023, 2021]) == {2023: None, 2021: None}
+    assert not list(tmp_path.iterdir())
+
+
+def test_store_years_not_fetched(archive, rates_db, tmp_path, monkeypatch):
+    handler, url_template = archive
+    handler.files["/archiwum_2024.csv"] = rates_csv(2024, "0614")
+    # Store of the whole 2019-2023, with no files downloaded before
+    shutil.copy(rates_db, tmp_path / "rates.sqlite3")
+    monkeypatch.setenv("NBP_RATES_DB", str(tmp_path / "rates.sqlite3"))
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    monkeypatch.setattr(PolishNbpRatesFIFO, "RATES_URL_TEMPLATE", url_template)
+
+    taxation = PolishNbpRatesFIFO(2023)
+    assert taxation.rates_store.has_complete_year(2023)
+    assert handler.requests == []
+
+    # Years missing in the store, or still growing, are fetched
+    taxation = PolishNbpRatesFIFO(2024)
+    assert not taxation.rates_store.has_complete_year(2024)
+    assert handler.requests == [("/archiwum_2024.csv", None)]
+    assert NbpRatesStore().rate("USD", datetime.date(2024, 6, 14)) == D("4.1")
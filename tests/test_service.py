@@ -0,0 +1,125 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+
+import pytest
+
+from calculation import Calculator
+from corporate_actions import DEFAULT_FILE
+from service import serve
+
+
+async def request(path, head: str, body: bytes = b""):
+    reader, writer = await asyncio.open_unix_connection(str(path))
+    writer.write(head.encode() + b"\r\n\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    _, _, payload = rest.partition(b"\r\n\r\n")
+    return int(status_line.split()[1]), json.loads(payload)
+
+
+async def post(path, payload: dict):
+    body = json.dumps(payload).encode()
+    return await request(
+        path, f"POST /calculate HTTP/1.1\r\nContent-Length: {len(body)}", body
+    )
+
+
+async def serve_requests(socket_path, requests):
+    """Responses of requests made one by one to `serve` on socket_path."""
+    args = argparse.Namespace(
+        log="WARNING",
+        corporate_actions=DEFAULT_FILE,
+        parse_cache=False,
+        tax="PL_NBP_FIFO",
+        warm_year=2023,
+        workers=2,
+        max_body=1,
+        socket=socket_path,
+    )
+    server = asyncio.create_task(serve(args))
+    try:
+        while not os.path.exists(socket_path):
+            assert not server.done(), server.exception()
+            await asyncio.sleep(0.05)
+        return [
+            await asyncio.wait_for(make(socket_path), timeout=30) for make in requests
+        ]
+    finally:
+        server.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await server
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    return str(tmp_path / "service.sock")
+
+
+def test_calculate(dataset, nbp_rates, socket_path):
+    files = [str(f) for f in dataset]
+    *paths, uploaded = files
+    with open(uploaded, "rb") as f:
+        content = base64.b64encode(f.read()).decode()
+    payload = {
+        "files": paths,
+        "reports": [{"name": "exante_transactions.csv", "content": content}],
+        "years": "2021-2023",
+    }
+
+    health, (status, results) = asyncio.run(
+        serve_requests(
+            socket_path,
+            [
+                lambda path: request(path, "GET /health HTTP/1.1"),
+                lambda path: post(path, payload),
+            ],
+        )
+    )
+
+    assert health == (200, {"status": "ok", "workers": 2})
+    assert status == 200
+    expected = Calculator().calculate(files, "PL_NBP_FIFO", [2021, 2022, 2023])
+    assert results["years"] == json.loads(json.dumps(expected, default=str))["years"]
+
+
+@pytest.mark.parametrize(
+    "head, body, error",
+    [
+        ("POST /calculate HTTP/1.1\r\nContent-Length: x", b"", "Content-Length"),
+        ("POST /calculate HTTP/1.1\r\nContent-Length: -1", b"", "Content-Length"),
+        ("POST /calculate HTTP/1.1\r\nContent-Length: 2", b"[]", "JSON object"),
+        (None, {"files": "ib.xml", "year": 2023}, "list of paths"),
+        (
+            None,
+            {"reports": [{"name": "ib.xml", "content": "not base64!"}]},
+            "base64",
+        ),
+        (None, {"files": ["ib.xml"], "years": "2023-2021"}, "Reversed"),
+        (None, {"files": ["missing.xml"], "year": 2023}, "missing.xml"),
+    ],
+    ids=[
+        "content_length",
+        "negative_content_length",
+        "not_object",
+        "files_not_list",
+        "bad_base64",
+        "reversed_years",
+        "missing_file",
+    ],
+)
+def test_bad_request(nbp_rates, socket_path, head, body, error):
+    if head is None:
+        make = lambda path: post(path, body)
+    else:
+        make = lambda path: request(path, head, body)
+
+    ((status, response),) = asyncio.run(serve_requests(socket_path, [make]))
+
+    assert status == 400
+    assert error in response["error"]
@@ -0,0 +1,132 @@
+import datetime
+from decimal import Decimal as D
+
+import pytest
+
+from calculation import Calculator
+from tradelog import (
+    InstrumentType,
+    TradeBatch,
+    TradeRecord,
+    match_fifo_legacy,
+    match_fifo_lots,
+    match_fifo_rows,
+)
+
+# Trades of one instrument as (date, signed quantity)
+SCENARIOS = {
+    "short": [
+        ("2022-03-01", -10),
+        ("2022-03-02", 4),
+        ("2022-03-03", 6),
+        # Flips to long and back
+        ("2022-03-04", -3),
+        ("2022-03-05", 5),
+        ("2022-03-06", -2),
+    ],
+    "partial_fills_across_years": [
+        ("2021-05-01", 100),
+        ("2021-06-01", -30),
+        ("2022-02-01", -30),
+        ("2022-03-01", 50),
+        ("2023-01-10", -90),
+        ("2023-01-11", -5),
+    ],
+    "multi_lot_close": [
+        ("2023-01-02", 10),
+        ("2023-01-03", 20),
+        ("2023-01-04", 30),
+        ("2023-02-01", -55),
+        ("2023-02-02", -5),
+    ],
+    "fractional": [
+        ("2023-01-02", D("0.5")),
+        ("2023-01-03", D("1.25")),
+        ("2023-02-01", D("-1.5")),
+        ("2023-02-02", D("-0.250")),
+    ],
+    # Sell side opens on a tie
+    "same_time": [
+        ("2023-01-02", -3),
+        ("2023-01-02", 5),
+    ],
+}
+
+
+def trades_of(scenario):
+    trades = []
+    for date, quantity in scenario:
+        trades.append(
+            TradeRecord(
+                symbol="ACME",
+                exchange="NYSE",
+                account="U1",
+                quantity=abs(quantity),
+                price=D("10"),
+                currency="USD",
+                timestamp=datetime.datetime.fromisoformat(date),
+                side=TradeRecord.BUY if quantity > 0 else TradeRecord.SELL,
+                instrument=InstrumentType.STOCK,
+                commission=D("-1"),
+            )
+        )
+    return trades
+
+
+def records_result(trades, matcher):
+    """Matches and position left as trade indexes and exact quantities."""
+    matches, pos_left = matcher(trades)
+    index = {id(t): i for i, t in enumerate(trades)}
+    position = {(t.timestamp, t.side): i for i, t in enumerate(trades)}
+    return (
+        [(index[id(o)], index[id(c)], str(q)) for o, c, q in matches],
+        [(position[t.timestamp, t.side], str(t.quantity)) for t in pos_left],
+    )
+
+
+def rows_result(trades):
+    batch = TradeBatch()
+    rows = [batch.append_record(t) for t in trades]
+    unscale = batch.quantities.unscale
+    matches, pos_left = match_fifo_rows(batch, rows)
+    return (
+        [(o, c, str(unscale(q, e))) for o, c, q, e in matches],
+        [(row, str(unscale(q, e))) for row, q, e in pos_left],
+    )
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_fifo_engines_match_legacy(scenario):
+    trades = trades_of(SCENARIOS[scenario])
+    expected = records_result(trades, match_fifo_legacy)
+
+    assert records_result(trades, match_fifo_lots) == expected
+    assert rows_result(trades) == expected
+
+
+def test_fifo_engines_same_totals(dataset, nbp_rates):
+    files = [str(f) for f in dataset]
+    tax_years = [2021, 2022, 2023]
+    calculator = Calculator()
+    results = [
+        calculator.calculate(files, "PL_NBP_FIFO", tax_years, fifo_engine, storage)
+        for fifo_engine, storage in [
+            ("legacy", "objects"),
+            ("lots", "objects"),
+            ("lots", "columnar"),
+        ]
+    ]
+
+    legacy = results[0]["years"]
+    assert any(year["per_position_profit"] for year in legacy.values())
+    for result in results[1:]:
+        for year in tax_years:
+            assert (
+                result["years"][year]["per_position_profit"]
+                == legacy[year]["per_position_profit"]
+            )
+            assert result["years"][year]["summary"] == legacy[year]["summary"]
+            assert (
+                result["years"][year]["open_positions"]
+                == legacy[year]["open_positions"]
+            )
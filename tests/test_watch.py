@@ -0,0 +1,68 @@
+import shutil
+from decimal import Decimal as D
+
+from calculation import Calculator
+from taxations.multi_year_taxation import MultiYearTaxation
+from taxations.polish_nbp_rates_fifo import PolishNbpRatesFIFO
+from watch import IncrementalCalculation, ingest_changes
+
+TAX_YEARS = [2021, 2022, 2023]
+
+
+def numbers(value):
+    """Amounts as Decimals, amounts taken back to zero are Decimal('0')."""
+    if isinstance(value, dict):
+        return {key: numbers(item) for key, item in value.items()}
+    return value if isinstance(value, str) else D(value)
+
+
+def assert_same_as_full_run(calculation, filenames):
+    # Incremental calculation takes files in name order
+    expected = Calculator().calculate(sorted(filenames), "PL_NBP_FIFO", TAX_YEARS)
+    summary = calculation.taxation.summary_values
+    for year in TAX_YEARS:
+        assert numbers(summary[year]) == numbers(expected["years"][year]["summary"])
+        profit = {
+            f"{account}/{symbol}": profit
+            for (account, symbol), profit in calculation.taxation.taxations[
+                year
+            ].per_position_profit.items()
+            if profit
+        }
+        assert numbers(profit) == numbers(
+            {
+                f"{p['account']}/{p['symbol']}": p["profit"]
+                for p in expected["years"][year]["per_position_profit"]
+                if p["profit"]
+            }
+        )
+
+
+def test_update_same_as_full_run(dataset, nbp_rates, tmp_path):
+    filenames = []
+    for path in dataset:
+        shutil.copy(path, tmp_path / path.name)
+        filenames.append(str(tmp_path / path.name))
+    taxation = MultiYearTaxation(PolishNbpRatesFIFO(max(TAX_YEARS)), TAX_YEARS)
+    calculation = IncrementalCalculation(taxation, TAX_YEARS)
+
+    calculation.update(ingest_changes(filenames, [], TAX_YEARS, None))
+    assert_same_as_full_run(calculation, filenames)
+
+    # Removed IB report, its trades, costs and dividends taken back
+    removed = filenames[0]
+    calculation.update(ingest_changes([], [removed], TAX_YEARS, None))
+    assert_same_as_full_run(calculation, filenames[1:])
+
+    # Changed Exante trades, the later half of them gone
+    trades_file = tmp_path / "exante_trades.csv"
+    original = trades_file.read_text()
+    lines = original.splitlines(keepends=True)
+    trades_file.write_text("".join(lines[: len(lines) // 2]))
+    calculation.update(ingest_changes([str(trades_file)], [], TAX_YEARS, None))
+    assert_same_as_full_run(calculation, filenames[1:])
+
+    # Back to the starting point
+    trades_file.write_text(original)
+    calculation.update(ingest_changes([removed, str(trades_file)], [], TAX_YEARS, None))
+    assert_same_as_full_run(calculation, filenames)
@@ -1,8 +1,26 @@
 import datetime
+import json
+import logging
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from decimal import Decimal as D
 from enum import Enum
-from typing import List, TYPE_CHECKING
+from typing import (
+    Collection,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+    Union,
+)
 
+from corporate_actions import CorporateActions
 from utils import logger
 
 if TYPE_CHECKING:
@@ -41,6 +59,20 @@ class TradeRecord:
     BUY = 1
     SELL = -BUY
 
+    __slots__ = (
+        "symbol",
+        "exchange",
+        "account",
+        "quantity",
+        "price",
+        "currency",
+        "timestamp",
+        "side",
+        "instrument",
+        "multiplier",
+        "commission",
+    )
+
     def __init__(
         self,
         symbol: str,
@@ -54,12 +86,15 @@ class TradeRecord:
         instrument: InstrumentType,
         commission: D,
     ):
-        self.symbol = symbol
-        self.exchange = exchange if instrument != InstrumentType.FOREX else "FOREX"
-        self.account = account
+        # Interned, there are few distinct values repeated over all trades
+        self.symbol = sys.intern(symbol)
+        self.exchange = sys.intern(
+            exchange if instrument != InstrumentType.FOREX else "FOREX"
+        )
+        self.account = sys.intern(account)
         self.quantity = quantity
         self.price = price
-        self.currency = currency
+        self.currency = sys.intern(currency)
         self.timestamp = timestamp
         self.side = side
         self.instrument = instrument
@@ -100,13 +135,587 @@ class TradeRecord:
         params.update(**updates)
         return TradeRecord(**params)
 
+    def to_dict(self) -> dict:
+        """JSON serializable representation, Decimals are kept as strings."""
+        return dict(
+            symbol=self.symbol,
+            exchange=self.exchange,
+            account=self.account,
+            # IB sends fractional quantities, Exante integers
+            quantity=(
+                self.quantity if isinstance(self.quantity, int) else str(self.quantity)
+            ),
+            price=str(self.price),
+            currency=self.currency,
+            timestamp=self.timestamp.isoformat(),
+            side=self.side,
+            instrument=self.instrument.value,
+            commission=str(self.commission),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TradeRecord":
+        return cls(
+            symbol=data["symbol"],
+            exchange=data["exchange"],
+            account=data["account"],
+            quantity=(
+                data["quantity"]
+                if isinstance(data["quantity"], int)
+                else D(data["quantity"])
+            ),
+            price=D(data["price"]),
+            currency=data["currency"],
+            timestamp=datetime.datetime.fromisoformat(data["timestamp"]),
+            side=data["side"],
+            instrument=InstrumentType(data["instrument"]),
+            commission=D(data["commission"]),
+        )
+
+
+# Matches as (open trade, close trade, closed quantity) and position left
+FifoResult = Tuple[List[Tuple[TradeRecord, TradeRecord, D]], List[TradeRecord]]
+
+
+def match_fifo_legacy(trades: List[TradeRecord]) -> FifoResult:
+    """
+    Original FIFO matching, pops trades from per-side lists and copies
+    partially filled ones. Kept as reference for `match_fifo_lots`.
+    """
+    trades_by_side = {
+        TradeRecord.BUY: [t for t in trades if t.side == TradeRecord.BUY][::-1],
+        TradeRecord.SELL: [t for t in trades if t.side == TradeRecord.SELL][::-1],
+    }
+
+    def get_next_trade(cur_trade=None):
+        if not (trades_by_side[TradeRecord.BUY] or trades_by_side[TradeRecord.SELL]):
+            return None
+
+        if cur_trade is None:
+            if not trades_by_side[TradeRecord.BUY]:
+                return trades_by_side[TradeRecord.SELL].pop()
+            elif not trades_by_side[TradeRecord.SELL]:
+                return trades_by_side[TradeRecord.BUY].pop()
+            elif (
+                trades_by_side[TradeRecord.SELL][0].timestamp
+                > trades_by_side[TradeRecord.BUY][0].timestamp
+            ):
+                return trades_by_side[TradeRecord.BUY].pop()
+            else:
+                return trades_by_side[TradeRecord.SELL].pop()
+        else:
+            # Get from other side
+            try:
+                return trades_by_side[-cur_trade.side].pop()
+            except IndexError:
+                return None
+
+    # Remainders are copies, matches refer to original trades
+    origins = {}
+    matches = []
+
+    while open_trade := get_next_trade():
+        logger.debug(open_trade)
+        close_trade = get_next_trade(open_trade)
+        # Meaning position stayed
+        if not close_trade:
+            trades_by_side[open_trade.side].append(open_trade)
+            break
+
+        closed_quantity = min(close_trade.quantity, open_trade.quantity)
+
+        # Both sides closed
+        if close_trade.quantity == open_trade.quantity:
+            pass
+        # Sell less than bought, update position
+        elif close_trade.quantity < open_trade.quantity:
+            remainder = open_trade.copy(quantity=open_trade.quantity - closed_quantity)
+            origins[remainder] = origins.get(open_trade, open_trade)
+            trades_by_side[open_trade.side].append(remainder)
+        # Sell more than bought, went short
+        elif close_trade.quantity > open_trade.quantity:
+            remainder = close_trade.copy(
+                quantity=close_trade.quantity - closed_quantity
+            )
+            origins[remainder] = origins.get(close_trade, close_trade)
+            trades_by_side[close_trade.side].append(remainder)
+
+        logger.debug(f"{open_trade} x {close_trade}")
+        matches.append(
+            (
+                origins.get(open_trade, open_trade),
+                origins.get(close_trade, close_trade),
+                closed_quantity,
+            )
+        )
+
+    pos_left = trades_by_side[TradeRecord.BUY] + trades_by_side[TradeRecord.SELL]
+    assert not trades_by_side[TradeRecord.BUY] or not trades_by_side[TradeRecord.SELL]
+    return matches, pos_left
+
+
+def match_fifo_lots(trades: List[TradeRecord]) -> FifoResult:
+    """
+    FIFO matching on per-side queues of lots, lot tracks quantity left
+    instead of being copied on every partial fill, so it runs in linear time.
+
+    Produces the same matches as `match_fifo_legacy`: position is opened from
+    the side which latest trade is older (sell side on a tie), and closed
+    with the oldest lot of the other side.
+    """
+    lots = {TradeRecord.BUY: deque(), TradeRecord.SELL: deque()}
+    for trade in trades:
+        lots[trade.side].append([trade, trade.quantity])
+    buy_lots = lots[TradeRecord.BUY]
+    sell_lots = lots[TradeRecord.SELL]
+
+    matches = []
+    while buy_lots and sell_lots:
+        if sell_lots[-1][0].timestamp > buy_lots[-1][0].timestamp:
+            open_lots, close_lots = buy_lots, sell_lots
+        else:
+            open_lots, close_lots = sell_lots, buy_lots
+
+        open_lot = open_lots[0]
+        close_lot = close_lots[0]
+        # Close one on a tie, as in legacy
+        closed_quantity = min(close_lot[1], open_lot[1])
+        matches.append((open_lot[0], close_lot[0], closed_quantity))
+        logger.debug(f"{open_lot[0]} x {close_lot[0]} ({closed_quantity})")
+
+        open_lot[1] -= closed_quantity
+        close_lot[1] -= closed_quantity
+        if not open_lot[1]:
+            open_lots.popleft()
+        if not close_lot[1]:
+            close_lots.popleft()
+
+    # Same order as legacy lists - newest first
+    pos_left = [
+        trade if quantity == trade.quantity else trade.copy(quantity=quantity)
+        for trade, quantity in list(reversed(buy_lots)) + list(reversed(sell_lots))
+    ]
+    return matches, pos_left
+
+
+class ScaledColumn:
+    """
+    Decimal column stored as integers scaled by 10**decimals, together with
+    each value exponent so it's restored exactly as parsed. Python ints are
+    marked with INT_EXPONENT. Values which don't fit the scale are kept aside
+    as Decimals, unless column is strict - then ValueError is raised.
+    """
+
+    INT_EXPONENT = 127
+    OVERFLOW_EXPONENT = -128
+    INT64_RANGE = range(-(2**63), 2**63)
+
+    __slots__ = ("decimals", "scale", "strict", "values", "exponents", "overflow")
+
+    def __init__(self, decimals: int, strict: bool = False) -> None:
+        self.decimals = decimals
+        self.scale = 10**decimals
+        self.strict = strict
+        self.values = array("q")
+        self.exponents = array("b")
+        self.overflow: Dict[int, D] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def scale_value(self, value: Union[int, D], row: int) -> Tuple[int, int]:
+        """Scaled value and exponent for row, kept aside if it doesn't fit."""
+        if isinstance(value, int):
+            scaled, exponent = value * self.scale, self.INT_EXPONENT
+        else:
+            exponent = value.as_tuple().exponent
+            if isinstance(exponent, int) and -self.decimals <= exponent < 64:
+                scaled = int(value.scaleb(self.decimals))
+            else:
+                scaled = None
+
+        if scaled is None or scaled not in self.INT64_RANGE:
+            if self.strict:
+                raise ValueError(
+                    f"{value} can't be stored with {self.decimals} decimal places"
+                )
+            self.overflow[row] = value
+            scaled, exponent = 0, self.OVERFLOW_EXPONENT
+        return scaled, exponent
+
+    def append(self, value: Union[int, D]) -> None:
+        scaled, exponent = self.scale_value(value, len(self.values))
+        self.values.append(scaled)
+        self.exponents.append(exponent)
+
+    def __setitem__(self, row: int, value: Union[int, D]) -> None:
+        scaled, exponent = self.scale_value(value, row)
+        if exponent != self.OVERFLOW_EXPONENT:
+            self.overflow.pop(row, None)
+        self.values[row] = scaled
+        self.exponents[row] = exponent
+
+    def __getitem__(self, row: int) -> Union[int, D]:
+        exponent = self.exponents[row]
+        if exponent == self.OVERFLOW_EXPONENT:
+            return self.overflow[row]
+        return self.unscale(self.values[row], exponent)
+
+    def unscale(self, scaled: int, exponent: int) -> Union[int, D]:
+        """Value of scaled integer with given exponent, int for INT_EXPONENT."""
+        if exponent == self.INT_EXPONENT:
+            return scaled // self.scale
+        return D(scaled // 10 ** (self.decimals + exponent)).scaleb(exponent)
+
+    @classmethod
+    def sum_exponent(cls, a: int, b: int) -> int:
+        """Exponent of sum or difference of values with given exponents."""
+        if a == b:
+            return a
+        if a == cls.INT_EXPONENT:
+            a, b = b, a
+        # Python int is converted to Decimal with exponent 0
+        return min(a, 0) if b == cls.INT_EXPONENT else min(a, b)
+
+    def take(self, rows: List[int]) -> "ScaledColumn":
+        column = ScaledColumn(self.decimals, self.strict)
+        column.values = array("q", (self.values[row] for row in rows))
+        column.exponents = array("b", (self.exponents[row] for row in rows))
+        column.overflow = {
+            i: self.overflow[row] for i, row in enumerate(rows) if row in self.overflow
+        }
+        return column
+
+
+class Categories:
+    """Interned categorical values, each stored once and referred to by code."""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self) -> None:
+        self.values: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def code(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class TradeBatch:
+    """
+    Columnar storage of trades for very large histories. Symbol, exchange,
+    account and currency are stored as interned categorical codes, timestamps
+    as microseconds since epoch, quantities, prices and commissions as scaled
+    integers - a few dozens of bytes per trade instead of a full TradeRecord.
+
+    Reports append trades directly with `append`, FIFO matching works on rows
+    with `match_fifo_rows`, records are built only for trades it reports.
+    """
+
+    PRICE_DECIMALS = 8
+    QUANTITY_DECIMALS = 8
+    EPOCH = datetime.datetime(1970, 1, 1)
+    MICROSECOND = datetime.timedelta(microseconds=1)
+    INSTRUMENTS = list(InstrumentType)
+
+    def __init__(self) -> None:
+        self.symbols = Categories()
+        self.exchanges = Categories()
+        self.accounts = Categories()
+        self.currencies = Categories()
+        self.symbol_codes = array("i")
+        self.exchange_codes = array("i")
+        self.account_codes = array("i")
+        self.currency_codes = array("i")
+        self.instrument_codes = array("b")
+        self.sides = array("b")
+        self.timestamps = array("q")
+        # Matched by FIFO, has to be exact
+        self.quantities = ScaledColumn(self.QUANTITY_DECIMALS, strict=True)
+        self.prices = ScaledColumn(self.PRICE_DECIMALS)
+        self.commissions = ScaledColumn(self.PRICE_DECIMALS)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def __iter__(self) -> Iterator[TradeRecord]:
+        return map(self.record, range(len(self)))
+
+    @classmethod
+    def to_timestamp(cls, value: datetime.datetime) -> int:
+        if value.tzinfo is not None:
+            raise ValueError(f"Timezone aware timestamp {value} isn't supported")
+        return (value - cls.EPOCH) // cls.MICROSECOND
+
+    @classmethod
+    def from_timestamp(cls, value: int) -> datetime.datetime:
+        return cls.EPOCH + datetime.timedelta(microseconds=value)
+
+    def append(
+        self,
+        symbol: str,
+        exchange: str,
+        account: str,
+        quantity: Union[int, D],
+        price: D,
+        currency: str,
+        timestamp: datetime.datetime,
+        side: int,
+        instrument: InstrumentType,
+        commission: D,
+    ) -> int:
+        """Append trade with the same fields as TradeRecord, returns its row."""
+        if instrument == InstrumentType.FOREX:
+            exchange = "FOREX"
+        assert (
+            exchange in STOCK_EXCHANGE_COUNTRIES
+        ), f"Unknown exchange {exchange} for {symbol}"
+        timestamp = self.to_timestamp(timestamp)
+        # First, so nothing is appended if quantity doesn't fit
+        self.quantities.append(quantity)
+
+        self.symbol_codes.append(self.symbols.code(symbol))
+        self.exchange_codes.append(self.exchanges.code(exchange))
+        self.account_codes.append(self.accounts.code(account))
+        self.currency_codes.append(self.currencies.code(currency))
+        self.instrument_codes.append(self.INSTRUMENTS.index(instrument))
+        self.sides.append(side)
+        self.timestamps.append(timestamp)
+        self.prices.append(price)
+        self.commissions.append(commission)
+        return len(self.timestamps) - 1
+
+    def append_record(self, record: TradeRecord) -> int:
+        return self.append(
+            symbol=record.symbol,
+            exchange=record.exchange,
+            account=record.account,
+            quantity=record.quantity,
+            price=record.price,
+            currency=record.currency,
+            timestamp=record.timestamp,
+            side=record.side,
+            instrument=record.instrument,
+            commission=record.commission,
+        )
+
+    def record(self, row: int, quantity: Optional[Union[int, D]] = None) -> TradeRecord:
+        """Build TradeRecord of row, optionally with quantity left in it."""
+        return TradeRecord(
+            symbol=self.symbols.values[self.symbol_codes[row]],
+            exchange=self.exchanges.values[self.exchange_codes[row]],
+            account=self.accounts.values[self.account_codes[row]],
+            quantity=self.quantities[row] if quantity is None else quantity,
+            price=self.prices[row],
+            currency=self.currencies.values[self.currency_codes[row]],
+            timestamp=self.from_timestamp(self.timestamps[row]),
+            side=self.sides[row],
+            instrument=self.INSTRUMENTS[self.instrument_codes[row]],
+            commission=self.commissions[row],
+        )
+
+    def key(self, row: int) -> Tuple[str, str]:
+        """Same as TradeRecord.key."""
+        return (
+            self.accounts.values[self.account_codes[row]],
+            self.symbols.values[self.symbol_codes[row]],
+        )
+
+    def group_rows(self) -> Dict[Tuple[int, int], List[int]]:
+        """
+        Rows of every instrument sorted by timestamp, in order of first trade
+        appended - the same as TradeLog.records.
+        """
+        groups = {}
+        for row, key in enumerate(zip(self.account_codes, self.symbol_codes)):
+            rows = groups.get(key)
+            if rows is None:
+                groups[key] = [row]
+            else:
+                rows.append(row)
+        for rows in groups.values():
+            rows.sort(key=self.timestamps.__getitem__)
+        return groups
+
+    def take(self, rows: List[int]) -> "TradeBatch":
+        """New batch with given rows only, categories are shared."""
+        batch = TradeBatch()
+        batch.symbols = self.symbols
+        batch.exchanges = self.exchanges
+        batch.accounts = self.accounts
+        batch.currencies = self.currencies
+        for name in (
+            "symbol_codes",
+            "exchange_codes",
+            "account_codes",
+            "currency_codes",
+            "instrument_codes",
+            "sides",
+            "timestamps",
+        ):
+            column = getattr(self, name)
+            setattr(batch, name, array(column.typecode, (column[r] for r in rows)))
+        batch.quantities = self.quantities.take(rows)
+        batch.prices = self.prices.take(rows)
+        batch.commissions = self.commissions.take(rows)
+        return batch
+
+    @classmethod
+    def year_start(cls, year: int) -> int:
+        return cls.to_timestamp(datetime.datetime(year, 1, 1))
+
+    def years(self) -> Set[int]:
+        days = {timestamp // 86_400_000_000 for timestamp in self.timestamps}
+        return {(self.EPOCH + datetime.timedelta(days=day)).year for day in days}
+
+
+# Matches as (open row, close row, closed scaled quantity, its exponent)
+# and rows left with their scaled quantity and its exponent
+FifoRowsResult = Tuple[List[Tuple[int, int, int, int]], List[Tuple[int, int, int]]]
+
+
+def match_fifo_rows(batch: TradeBatch, rows: List[int]) -> FifoRowsResult:
+    """
+    `match_fifo_lots` over TradeBatch rows sorted by timestamp, compares plain
+    integers and doesn't build any TradeRecord. Quantities exponents follow
+    Decimal arithmetic, so they're restored exactly as `match_fifo_lots` ones.
+    """
+    quantities = batch.quantities.values
+    exponents = batch.quantities.exponents
+    sum_exponent = batch.quantities.sum_exponent
+    timestamps = batch.timestamps
+    sides = batch.sides
+
+    buy_lots = deque()
+    sell_lots = deque()
+    for row in rows:
+        lots = buy_lots if sides[row] == TradeRecord.BUY else sell_lots
+        lots.append([row, quantities[row], exponents[row]])
+
+    matches = []
+    while buy_lots and sell_lots:
+        if timestamps[sell_lots[-1][0]] > timestamps[buy_lots[-1][0]]:
+            open_lots, close_lots = buy_lots, sell_lots
+        else:
+            open_lots, close_lots = sell_lots, buy_lots
+
+        open_lot = open_lots[0]
+        close_lot = close_lots[0]
+        # Same as min() in match_fifo_lots, close one on a tie
+        closed_lot = open_lot if open_lot[1] < close_lot[1] else close_lot
+        closed_quantity, exponent = closed_lot[1], closed_lot[2]
+        matches.append((open_lot[0], close_lot[0], closed_quantity, exponent))
+
+        open_lot[1] -= closed_quantity
+        open_lot[2] = sum_exponent(open_lot[2], exponent)
+        close_lot[1] -= closed_quantity
+        close_lot[2] = sum_exponent(close_lot[2], exponent)
+        if not open_lot[1]:
+            open_lots.popleft()
+        if not close_lot[1]:
+            close_lots.popleft()
+
+    pos_left = [
+        tuple(lot) for lot in list(reversed(buy_lots)) + list(reversed(sell_lots))
+    ]
+    return matches, pos_left
+
+
+class MatchTable:
+    """
+    Closed transactions matched by FIFO, as TradeBatch rows with closed scaled
+    quantity and its exponent. Dates, currencies, multipliers and commissions
+    are columns of the batch, so valuation can gather them for all matches at
+    once instead of valuing each one as it's matched.
+    """
+
+    __slots__ = ("batch", "open_rows", "close_rows", "quantities", "exponents")
+
+    def __init__(self, batch: TradeBatch) -> None:
+        self.batch = batch
+        self.open_rows = array("q")
+        self.close_rows = array("q")
+        self.quantities = array("q")
+        self.exponents = array("b")
+
+    def __len__(self) -> int:
+        return len(self.open_rows)
+
+    def __iter__(self) -> Iterator[Tuple[int, int, int, int]]:
+        return zip(self.open_rows, self.close_rows, self.quantities, self.exponents)
+
+    def append(
+        self, open_row: int, close_row: int, quantity: int, exponent: int
+    ) -> None:
+        self.open_rows.append(open_row)
+        self.close_rows.append(close_row)
+        self.quantities.append(quantity)
+        self.exponents.append(exponent)
+
+    def take(self, matches: Iterable[int]) -> "MatchTable":
+        table = MatchTable(self.batch)
+        for match in matches:
+            table.append(
+                self.open_rows[match],
+                self.close_rows[match],
+                self.quantities[match],
+                self.exponents[match],
+            )
+        return table
+
+    def split_by_close_year(self) -> Dict[int, "MatchTable"]:
+        """Matches grouped by year of close trade, keeping their order."""
+        timestamps = self.batch.timestamps
+        years = {}
+        for match, close_row in enumerate(self.close_rows):
+            year = self.batch.from_timestamp(timestamps[close_row]).year
+            years.setdefault(year, []).append(match)
+        return {year: self.take(matches) for year, matches in years.items()}
+
 
 class TradeLog:
-    def __init__(self, taxation: "BaseTaxation") -> None:
+    FIFO_ENGINES = ("lots", "legacy")
+    STORAGES = ("objects", "columnar")
+    # 2: positions in shares held at the end of year, not converted for splits
+    SNAPSHOT_VERSION = 2
+    # More chunks than workers to even out differences in instruments history size
+    CHUNKS_PER_WORKER = 4
+
+    def __init__(
+        self,
+        taxation: "BaseTaxation",
+        fifo_engine: str = "lots",
+        storage: str = "objects",
+        corporate_actions: Optional[CorporateActions] = None,
+    ) -> None:
+        assert fifo_engine in self.FIFO_ENGINES, f"Unknown FIFO engine {fifo_engine}"
+        assert storage in self.STORAGES, f"Unknown storage {storage}"
+        assert (
+            storage == "objects" or fifo_engine == "lots"
+        ), f"{fifo_engine} FIFO engine requires objects storage"
         self.taxation = taxation
+        self.fifo_engine = fifo_engine
+        self.corporate_actions = (
+            corporate_actions if corporate_actions is not None else CorporateActions()
+        )
+        # Trades are converted once, before FIFO
+        self.corporate_actions_applied = False
         self.records = {}
+        # Columnar storage, used instead of records
+        self.batch = TradeBatch() if storage == "columnar" else None
+        # Matches of columnar storage FIFO and instruments reports, waiting
+        # for valuation
+        self.matches = MatchTable(self.batch) if self.batch is not None else None
+        self.instrument_reports: List[Tuple[Tuple[str, str], D, list]] = []
         self.outstanding_positions = []
+        self.year_end_positions: Dict[int, List[TradeRecord]] = {}
+        self.snapshot_year = None
         self.total_cost = self.total_income = 0
+        # FIFO matches of all years, for run metrics
+        self.match_count = 0
 
     def __str__(self) -> str:
         if self.outstanding_positions:
@@ -114,111 +723,428 @@ class TradeLog:
         else:
             return "No position left for next tax year."
 
+    def format_year_end_positions(self, year: int) -> str:
+        positions = self.year_end_positions.get(year)
+        if positions:
+            return f"= Position open at the end of {year}: {TradeRecord.format_trades(positions)}"
+        else:
+            return f"No position open at the end of {year}."
+
+    def stats(self) -> Dict[str, int]:
+        """Sizes of trades history and FIFO results, for run metrics."""
+        if self.batch is not None:
+            trades = len(self.batch)
+            instruments = len(self.batch.group_rows())
+        else:
+            trades = sum(len(trades) for trades in self.records.values())
+            instruments = len(self.records)
+        return {
+            "trades": trades,
+            "instruments": instruments,
+            "matches": self.match_count,
+            "open_positions": len(self.outstanding_positions),
+        }
+
     def reset_stats(self):
         self.outstanding_positions = []
+        self.year_end_positions = {}
         self.total_cost = 0
         self.total_income = 0
 
     def add_record(self, trade_record: TradeRecord) -> None:
+        # Already included in loaded snapshot
+        if self.snapshot_year and trade_record.timestamp.year <= self.snapshot_year:
+            logger.debug(f"Skipping {trade_record}, covered by snapshot")
+            return
+        if self.batch is not None:
+            self.batch.append_record(trade_record)
+            return
         self.records[trade_record.key] = self.records.get(trade_record.key, [])
         self.records[trade_record.key].append(trade_record)
 
-    def calc_profit_fifo(self, trades: List[TradeRecord], tax_year: int):
+    def add_trade(self, **fields) -> None:
+        """
+        Add trade from TradeRecord fields, appended to columnar storage directly
+        without building the record.
+        """
+        if self.batch is None:
+            self.add_record(TradeRecord(**fields))
+        elif not (
+            self.snapshot_year and fields["timestamp"].year <= self.snapshot_year
+        ):
+            self.batch.append(**fields)
+
+    def add_split(self, symbol: str, date: datetime.date, old: int, new: int) -> None:
+        """Split reported along with trades, applied to them before FIFO."""
+        self.corporate_actions.add_split(symbol, date, old, new)
+
+    def apply_corporate_actions(self) -> None:
+        """
+        Convert trades of symbols with splits to shares of one period between
+        splits, see `corporate_actions`, in bulk. Positions loaded from snapshot
+        are in shares held at the end of its year, converted as trades done
+        right after it.
+        """
+        if self.corporate_actions_applied:
+            return
+        self.corporate_actions_applied = True
+        actions = self.corporate_actions
+        snapshot_end = (
+            datetime.date(self.snapshot_year + 1, 1, 1) if self.snapshot_year else None
+        )
+        adjusted = {}
+        if self.batch is not None:
+            batch = self.batch
+            symbols = {
+                code: symbol
+                for code, symbol in enumerate(batch.symbols.values)
+                if symbol in actions.splits
+            }
+            for row, code in enumerate(batch.symbol_codes):
+                symbol = symbols.get(code)
+                if symbol is None:
+                    continue
+                date = batch.from_timestamp(batch.timestamps[row]).date()
+                if snapshot_end and date < snapshot_end:
+                    date = snapshot_end
+                old, new = actions.ratio(symbol, date)
+                if old != 1 or new != 1:
+                    batch.quantities[row], batch.prices[row] = actions.adjust(
+                        batch.quantities[row], batch.prices[row], old, new
+                    )
+                    adjusted[symbol] = adjusted.get(symbol, 0) + 1
+        else:
+            for (account, symbol), trades in self.records.items():
+                if symbol not in actions.splits:
+                    continue
+                for trade in trades:
+                    date = trade.timestamp.date()
+                    if snapshot_end and date < snapshot_end:
+                        date = snapshot_end
+                    old, new = actions.ratio(symbol, date)
+                    if old != 1 or new != 1:
+                        trade.quantity, trade.price = actions.adjust(
+                            trade.quantity, trade.price, old, new
+                        )
+                        adjusted[symbol] = adjusted.get(symbol, 0) + 1
+
+        for symbol, trades in adjusted.items():
+            logger.info(f"Converted {trades} {symbol} trades for splits")
+
+    def trade_years(self) -> Set[int]:
+        if self.batch is not None:
+            return self.batch.years()
+        return {t.timestamp.year for trades in self.records.values() for t in trades}
+
+    def save_snapshot(self, filename: str, year: int) -> None:
+        """
+        Export position open at the end of year, to be loaded by next year run
+        instead of parsing the whole account history. Positions are in shares
+        held then, not converted with splits done later.
+        """
+        assert year in self.year_end_positions, f"No positions calculated for {year}"
+        year_end = datetime.date(year + 1, 1, 1)
+        positions = []
+        for position in self.year_end_positions[year]:
+            old, new = self.corporate_actions.ratio(position.symbol, year_end)
+            if old != 1 or new != 1:
+                # Reverse of `apply_corporate_actions` conversion
+                quantity, price = self.corporate_actions.adjust(
+                    position.quantity, position.price, new, old
+                )
+                position = position.copy(quantity=quantity, price=price)
+            positions.append(position.to_dict())
+        snapshot = {
+            "version": self.SNAPSHOT_VERSION,
+            "year": year,
+            "positions": positions,
+        }
+        with open(filename, "w") as f:
+            json.dump(snapshot, f, indent=1)
+        logger.info(
+            f"Saved {len(snapshot['positions'])} positions open at the end of {year} to {filename}"
+        )
+
+    def load_snapshot(self, filename: str) -> int:
+        """
+        Load positions open at the end of snapshot year as trades, trades done
+        until then are skipped from now on. Returns snapshot year.
+        """
+        with open(filename) as f:
+            snapshot = json.load(f)
+        assert (
+            snapshot.get("version") == self.SNAPSHOT_VERSION
+        ), f"Unsupported snapshot version {snapshot.get('version')} in {filename}"
+
+        for position in snapshot["positions"]:
+            self.add_record(TradeRecord.from_dict(position))
+        self.snapshot_year = snapshot["year"]
+        logger.info(
+            f"Loaded {len(snapshot['positions'])} positions open at the end of {self.snapshot_year} from {filename}"
+        )
+        return self.snapshot_year
+
+    def calc_profit_fifo(
+        self, trades: List[TradeRecord], tax_year: Union[int, Collection[int]]
+    ):
         """
         Calculates closed transactions profits for given instrument trades history.
         :param trades:
-        :param tax_year:
+        :param tax_year: single tax year or collection of years to compute in one pass
         :return:
         """
-        # Don't calculate for past years if all trades closed
-        if not any(t.timestamp.year == tax_year for t in trades):
-            return
+        if isinstance(tax_year, int):
+            tax_years = {tax_year}
+            # Don't calculate for past years if all trades closed
+            if not any(t.timestamp.year == tax_year for t in trades):
+                return
+        else:
+            tax_years = set(tax_year)
+            last_year = max(tax_years)
+            # Positions opened before and still open are part of year end positions
+            if all(t.timestamp.year > last_year for t in trades):
+                return
 
         logger.debug(
             f"Calculating profit for following trades: {TradeRecord.format_trades(trades)}"
         )
 
-        trades_by_side = {
-            TradeRecord.BUY: [t for t in trades if t.side == TradeRecord.BUY][::-1],
-            TradeRecord.SELL: [t for t in trades if t.side == TradeRecord.SELL][::-1],
-        }
-
-        def get_next_trade(cur_trade=None):
-            if not (
-                trades_by_side[TradeRecord.BUY] or trades_by_side[TradeRecord.SELL]
-            ):
-                return None
-
-            if cur_trade is None:
-                if not trades_by_side[TradeRecord.BUY]:
-                    return trades_by_side[TradeRecord.SELL].pop()
-                elif not trades_by_side[TradeRecord.SELL]:
-                    return trades_by_side[TradeRecord.BUY].pop()
-                elif (
-                    trades_by_side[TradeRecord.SELL][0].timestamp
-                    > trades_by_side[TradeRecord.BUY][0].timestamp
-                ):
-                    return trades_by_side[TradeRecord.BUY].pop()
-                else:
-                    return trades_by_side[TradeRecord.SELL].pop()
-            else:
-                # Get from other side
-                try:
-                    return trades_by_side[-cur_trade.side].pop()
-                except IndexError:
-                    return None
-
-        cur_position = 0
-
-        while open_trade := get_next_trade():
-            logger.debug(open_trade)
-            close_trade = get_next_trade(open_trade)
-            # Meaning position stayed
-            if not close_trade:
-                trades_by_side[open_trade.side].append(open_trade)
-                break
-
-            closed_quantity = min(close_trade.quantity, open_trade.quantity)
-
-            # Both sides closed
-            if close_trade.quantity == open_trade.quantity:
-                pass
-            # Sell less than bought, update position
-            elif close_trade.quantity < open_trade.quantity:
-                trades_by_side[open_trade.side].append(
-                    open_trade.copy(quantity=open_trade.quantity - closed_quantity)
-                )
-            # Sell more than bought, went short
-            elif close_trade.quantity > open_trade.quantity:
-                trades_by_side[close_trade.side].append(
-                    close_trade.copy(quantity=close_trade.quantity - closed_quantity)
-                )
-
-            logger.debug(f"{open_trade} x {close_trade}")
+        if self.fifo_engine == "legacy":
+            matches, pos_left = match_fifo_legacy(trades)
+        else:
+            matches, pos_left = match_fifo_lots(trades)
+        self.match_count += len(matches)
 
-            if close_trade.timestamp.year == tax_year:
-                self.taxation.add_closed_transaction(open_trade, close_trade)
+        for open_trade, close_trade, quantity in matches:
+            if close_trade.timestamp.year in tax_years:
+                self.taxation.add_closed_transaction(open_trade, close_trade, quantity)
 
         # Update stats
-        pos_left = trades_by_side[TradeRecord.BUY] + trades_by_side[TradeRecord.SELL]
         pos_left_size_from_trades = sum(t.quantity for t in trades)
         self.outstanding_positions.extend(pos_left)
+        for year in sorted(tax_years):
+            self.year_end_positions.setdefault(year, []).extend(
+                self.calc_year_end_positions(trades, matches, year)
+            )
 
-        assert (
-            not trades_by_side[TradeRecord.BUY] or not trades_by_side[TradeRecord.SELL]
-        )
         assert not pos_left or pos_left_size_from_trades != 0
 
         logger.info(
             f"{trades[0].symbol} profit: {self.taxation.per_position_profit.get(trades[0].key, 0)} pos: {pos_left_size_from_trades} {pos_left}"
         )
 
-    def calculate_closed_positions(self, tax_year):
+    def calc_profit_fifo_rows(
+        self, rows: List[int], tax_year: Union[int, Collection[int]]
+    ):
+        """
+        `calc_profit_fifo` for instrument rows of columnar storage, sorted by
+        timestamp. Matches are collected for `value_matches`, records are built
+        only for positions reported.
+        """
+        batch = self.batch
+        timestamps = batch.timestamps
+        tax_years = {tax_year} if isinstance(tax_year, int) else set(tax_year)
+        year_ranges = [
+            (batch.year_start(year), batch.year_start(year + 1))
+            for year in sorted(tax_years)
+        ]
+        if isinstance(tax_year, int):
+            # Don't calculate for past years if all trades closed
+            start, end = year_ranges[0]
+            if not any(start <= timestamps[row] < end for row in rows):
+                return
+        elif all(timestamps[row] >= year_ranges[-1][1] for row in rows):
+            return
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"Calculating profit for following trades: {TradeRecord.format_trades(map(batch.record, rows))}"
+            )
+
+        matches, pos_left = match_fifo_rows(batch, rows)
+        self.match_count += len(matches)
+
+        quantities = batch.quantities
+        for open_row, close_row, quantity, exponent in matches:
+            close_timestamp = timestamps[close_row]
+            if any(start <= close_timestamp < end for start, end in year_ranges):
+                self.matches.append(open_row, close_row, quantity, exponent)
+
+        # Update stats
+        size_exponent = quantities.INT_EXPONENT
+        for row in rows:
+            size_exponent = quantities.sum_exponent(
+                size_exponent, quantities.exponents[row]
+            )
+        pos_left_size_from_trades = quantities.unscale(
+            sum(quantities.values[row] for row in rows), size_exponent
+        )
+        pos_left = [
+            batch.record(row, quantities.unscale(quantity, exponent))
+            for row, quantity, exponent in pos_left
+        ]
+        self.outstanding_positions.extend(pos_left)
+        for year in sorted(tax_years):
+            self.year_end_positions.setdefault(year, []).extend(
+                batch.record(row, quantities.unscale(quantity, exponent))
+                for row, quantity, exponent in self.calc_year_end_rows(
+                    batch, rows, matches, year
+                )
+            )
+
+        assert not pos_left or pos_left_size_from_trades != 0
+
+        self.instrument_reports.append(
+            (batch.key(rows[0]), pos_left_size_from_trades, pos_left)
+        )
+
+    def value_matches(self) -> None:
+        """
+        Pass matches collected by `calc_profit_fifo_rows` to taxation as one
+        table, then report instruments profits.
+        """
+        self.taxation.add_closed_matches(self.matches)
+        self.matches = MatchTable(self.batch)
+        for key, pos_left_size_from_trades, pos_left in self.instrument_reports:
+            logger.info(
+                f"{key[1]} profit: {self.taxation.per_position_profit.get(key, 0)} pos: {pos_left_size_from_trades} {pos_left}"
+            )
+        self.instrument_reports = []
+
+    @staticmethod
+    def calc_year_end_rows(
+        batch: TradeBatch, rows: List[int], matches: List[tuple], year: int
+    ) -> List[Tuple[int, int, int]]:
+        """
+        `calc_year_end_positions` for rows, with scaled quantities left and
+        their exponents.
+        """
+        quantities = batch.quantities
+        timestamps = batch.timestamps
+        year_end = batch.year_start(year + 1)
+        remaining = {
+            row: [quantities.values[row], quantities.exponents[row]]
+            for row in rows
+            if timestamps[row] < year_end
+        }
+        for open_row, close_row, quantity, exponent in matches:
+            if max(timestamps[open_row], timestamps[close_row]) < year_end:
+                for lot in (remaining[open_row], remaining[close_row]):
+                    lot[0] -= quantity
+                    lot[1] = quantities.sum_exponent(lot[1], exponent)
+        return [(row, *lot) for row, lot in remaining.items() if lot[0]]
+
+    @staticmethod
+    def calc_year_end_positions(
+        trades: List[TradeRecord], matches: List[tuple], year: int
+    ) -> List[TradeRecord]:
+        """
+        Position open at the end of year - part of each trade done until then
+        which wasn't matched with another trade done until then.
+        """
+        remaining = {t: t.quantity for t in trades if t.timestamp.year <= year}
+        for open_trade, close_trade, quantity in matches:
+            if max(open_trade.timestamp, close_trade.timestamp).year <= year:
+                remaining[open_trade] -= quantity
+                remaining[close_trade] -= quantity
+        return [
+            t if quantity == t.quantity else t.copy(quantity=quantity)
+            for t, quantity in remaining.items()
+            if quantity
+        ]
+
+    def calculate_closed_positions(
+        self, tax_year: Union[int, Collection[int]], workers: int = 1
+    ):
+        """
+        Run FIFO over every instrument and report closed transactions to taxation.
+        Passing collection of years computes all of them in a single FIFO pass,
+        e.g. with `MultiYearTaxation`.
+
+        With `workers > 1` instruments are split into contiguous chunks processed
+        in a process pool, each into its own spawned taxation accumulator. Results
+        are merged in chunk order, so they're identical to the serial run.
+        """
         logger.info(f"Calculating closed positions for tax_year {tax_year}")
+        self.apply_corporate_actions()
         # Only closed in current tax year should be calculated for tax!
 
-        for trades in self.records.values():
-            trades = sorted(trades, key=lambda t: t.timestamp)
-            self.calc_profit_fifo(trades, tax_year)
+        if workers > 1:
+            self.calculate_closed_positions_parallel(tax_year, workers)
+        elif self.batch is not None:
+            for rows in self.batch.group_rows().values():
+                self.calc_profit_fifo_rows(rows, tax_year)
+            self.value_matches()
+        else:
+            for trades in self.records.values():
+                trades = sorted(trades, key=lambda t: t.timestamp)
+                self.calc_profit_fifo(trades, tax_year)
 
         logger.info(f"TOTAL TRADES for {tax_year}:\n{self}")
+
+    def calculate_closed_positions_parallel(
+        self, tax_year: Union[int, Collection[int]], workers: int
+    ):
+        if self.batch is not None:
+            records = list(self.batch.group_rows().values())
+        else:
+            records = list(self.records.items())
+        chunk_size = max(1, -(-len(records) // (workers * self.CHUNKS_PER_WORKER)))
+        chunks = [
+            records[i : i + chunk_size] for i in range(0, len(records), chunk_size)
+        ]
+        if self.batch is not None:
+            # Workers get only rows of their instruments
+            chunks = [
+                self.batch.take([row for rows in chunk for row in rows])
+                for chunk in chunks
+            ]
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                calc_chunk_closed_positions,
+                [
+                    (self.taxation.spawn(), self.fifo_engine, chunk, tax_year)
+                    for chunk in chunks
+                ],
+            )
+            for (
+                taxation,
+                outstanding_positions,
+                year_end_positions,
+                match_count,
+            ) in results:
+                self.taxation.merge(taxation)
+                self.match_count += match_count
+                self.outstanding_positions.extend(outstanding_positions)
+                for year, positions in year_end_positions.items():
+                    self.year_end_positions.setdefault(year, []).extend(positions)
+
+
+def calc_chunk_closed_positions(args):
+    """Process pool worker, runs FIFO for chunk of TradeLog records."""
+    taxation, fifo_engine, records, tax_year = args
+    if isinstance(records, TradeBatch):
+        trade_log = TradeLog(taxation, fifo_engine, storage="columnar")
+        trade_log.batch = records
+        trade_log.matches = MatchTable(records)
+        for rows in records.group_rows().values():
+            trade_log.calc_profit_fifo_rows(rows, tax_year)
+        trade_log.value_matches()
+        return (
+            taxation,
+            trade_log.outstanding_positions,
+            trade_log.year_end_positions,
+            trade_log.match_count,
+        )
+
+    trade_log = TradeLog(taxation, fifo_engine)
+    for key, trades in records:
+        trades = sorted(trades, key=lambda t: t.timestamp)
+        trade_log.calc_profit_fifo(trades, tax_year)
+    return (
+        taxation,
+        trade_log.outstanding_positions,
+        trade_log.year_end_positions,
+        trade_log.match_count,
+    )
@@ -1,28 +1,107 @@
+import codecs
 import csv
 import datetime
+import io
 import logging
-import chardet
-
+import os
+import re
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from operator import itemgetter
+from typing import Iterator, List, Sequence, Tuple
 
 logger = logging.getLogger()
 
 
 CSV_SAMPLE_SIZE = 5000
+# Read buffer of whole file CSV readers, larger than default to cut syscalls
+CSV_BUFFER_SIZE = 1 << 20
+
+BOM_ENCODINGS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+class FileProbe:
+    """
+    Reads the head of a file once and caches everything sniffing needs:
+    encoding, decoded sample text, CSV dialect and normalized header.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.head = f.read(CSV_SAMPLE_SIZE)
+
+    @cached_property
+    def encoding(self) -> str:
+        for bom, encoding in BOM_ENCODINGS:
+            if self.head.startswith(bom):
+                return encoding
+
+        # Most reports are plain UTF-8/ASCII, chardet is slow so run it only
+        # if sample doesn't decode (ignoring char cut at the end of sample)
+        try:
+            codecs.getincrementaldecoder("utf-8")().decode(self.head)
+            return "utf-8"
+        except UnicodeDecodeError:
+            import chardet
+
+            return chardet.detect(self.head)["encoding"]
+
+    @cached_property
+    def text(self) -> str:
+        try:
+            return codecs.getincrementaldecoder(self.encoding)().decode(self.head)
+        except (UnicodeDecodeError, LookupError, TypeError):
+            return ""
+
+    @cached_property
+    def dialect(self):
+        """Sniffed CSV dialect or None if sample doesn't look like CSV."""
+        try:
+            return csv.Sniffer().sniff(self.text)
+        except csv.Error:
+            return None
+
+    @cached_property
+    def header(self) -> frozenset:
+        """Lowercase CSV header columns, empty if not a CSV file."""
+        if self.dialect is None:
+            return frozenset()
+        reader = csv.reader(io.StringIO(self.text), self.dialect)
+        return frozenset(column.lower() for column in next(reader, []))
+
+
+@lru_cache(maxsize=256)
+def _probe_file(filename, mtime_ns, size):
+    return FileProbe(filename)
+
+
+def probe_file(filename) -> FileProbe:
+    """Cached FileProbe, reused until file is modified."""
+    stat = os.stat(filename)
+    return _probe_file(str(filename), stat.st_mtime_ns, stat.st_size)
+
+
+# Hits and misses, for run metrics
+probe_file.cache_info = _probe_file.cache_info
 
 
 def get_file_encoding(filename):
-    with open(filename, "rb") as f:
-        result = chardet.detect(f.read(CSV_SAMPLE_SIZE))
-        return result["encoding"]
+    return probe_file(filename).encoding
 
 
-def sniff_file_dialect(filename, encoding):
-    with open(filename, encoding=encoding) as csvfile:
-        dialect = csv.Sniffer().sniff(csvfile.read(CSV_SAMPLE_SIZE))
+def sniff_file_dialect(filename, encoding=None):
+    dialect = probe_file(filename).dialect
+    if dialect is None:
+        raise csv.Error("Could not determine delimiter")
     return dialect
 
 
-def read_csv_file(filename, delimiter=None, cols_to_lower=True):
+def csv_reader_kwargs(filename, delimiter=None):
     encoding = get_file_encoding(filename)
     if delimiter:
         reader_kwargs = dict(delimiter=delimiter)
@@ -33,7 +112,11 @@ def read_csv_file(filename, delimiter=None, cols_to_lower=True):
     logger.debug(
         "Recognized reader kwargs: {} encoding: {}".format(reader_kwargs, encoding)
     )
+    return encoding, reader_kwargs
 
+
+def read_csv_file(filename, delimiter=None, cols_to_lower=True):
+    encoding, reader_kwargs = csv_reader_kwargs(filename, delimiter)
     with open(filename, encoding=encoding) as f:
         for row in csv.DictReader(f, **reader_kwargs):
             if cols_to_lower:
@@ -42,24 +125,108 @@ def read_csv_file(filename, delimiter=None, cols_to_lower=True):
                 yield row
 
 
-# TODO - detect automatically:
-SPLITS = {
-    "REMX": [
-        (datetime.date(2020, 4, 15), 3, 1),  # https://stooq.pl/q/m/?s=remx.us
-    ],
-    "URNM": [
-        (datetime.date(2022, 12, 21), 1, 2),  # https://stooq.pl/q/m/?s=urnm.us
-    ],
-}
-
+@contextmanager
+def open_csv_table(
+    filename, delimiter=None, cols_to_lower=True
+) -> Iterator[Tuple[List[str], Iterator[List[str]]]]:
+    """
+    Header and reader of CSV file rows as lists, for callers resolving
+    columns to indexes once instead of reading every row as dict.
+    """
+    encoding, reader_kwargs = csv_reader_kwargs(filename, delimiter)
+    with open(filename, encoding=encoding, buffering=CSV_BUFFER_SIZE) as f:
+        reader = csv.reader(f, **reader_kwargs)
+        header = next(reader, [])
+        if cols_to_lower:
+            header = [column.lower() for column in header]
+        yield header, reader
+
+
+def read_csv_rows(
+    filename, columns: Sequence[str], delimiter=None, cols_to_lower=True
+) -> Iterator[tuple]:
+    """
+    `read_csv_file` yielding tuples of given columns values only. Like with
+    DictReader empty lines are skipped and missing values are None.
+    """
+    with open_csv_table(filename, delimiter, cols_to_lower) as (header, reader):
+        # Last of duplicated columns wins, as in DictReader
+        index = {column: i for i, column in enumerate(header)}
+        missing = [column for column in columns if column not in index]
+        assert not missing, f"Columns {missing} not found in {filename}"
+        indexes = [index[column] for column in columns]
+        width = max(indexes) + 1
+        if len(indexes) == 1:
+            # itemgetter of single index returns value, not tuple
+            get_values = lambda row: (row[indexes[0]],)
+        else:
+            get_values = itemgetter(*indexes)
+        for row in reader:
+            if len(row) < width:
+                if not row:
+                    continue
+                row += [None] * (width - len(row))
+            yield get_values(row)
+
+
+def _parse_compact_date(value):
+    return datetime.datetime(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+def _parse_compact_datetime(value):
+    return datetime.datetime(
+        int(value[:4]),
+        int(value[4:6]),
+        int(value[6:8]),
+        int(value[9:11]),
+        int(value[11:13]),
+        int(value[13:15]),
+    )
 
-def support_stock_split(symbol, quantity, price, timestamp):
 
-    for split_date, rate_from, rate_to in SPLITS.get(symbol, []):
-        if timestamp.date() > split_date:
-            logger.warning(f"SPLIT DETECTED! {rate_from}:{rate_to} {price}, {quantity}")
-            price = price * rate_to / rate_from
-            quantity = int(quantity * rate_from / rate_to)
-            logger.warning(f"SPLIT DONE! {rate_from}:{rate_to} {price}, {quantity}")
+class TimestampParser:
+    """
+    Parse timestamps of a single column, e.g. Exante's `2020-04-06 14:10:00`
+    or IB's `20200406;141000`.
+
+    Format is detected once, on the first value, and every next value goes
+    through the fast path matching that format. Values the fast path can't
+    handle trigger detection again and fall back to dateutil if no known
+    format matches, so results are always the same as with plain `parse`.
+    """
+
+    FORMATS = (
+        # YYYY-MM-DD HH:MM:SS
+        (
+            re.compile(r"\d{4}-\d{2}-\d{2}[ T;]\d{2}:\d{2}:\d{2}"),
+            datetime.datetime.fromisoformat,
+        ),
+        (re.compile(r"\d{4}-\d{2}-\d{2}"), datetime.datetime.fromisoformat),
+        # YYYYMMDD;HHMMSS
+        (re.compile(r"\d{8}[ T;,]\d{6}"), _parse_compact_datetime),
+        (re.compile(r"\d{8}"), _parse_compact_date),
+    )
 
-    return quantity, price
+    def __init__(self):
+        self.pattern = None
+        self.fast_parse = None
+
+    def __call__(self, value: str) -> datetime.datetime:
+        if (self.pattern and self.pattern.fullmatch(value)) or self.detect(value):
+            try:
+                return self.fast_parse(value)
+            except ValueError:
+                pass
+
+        logger.debug(f"Unknown timestamp format: {value}, using dateutil")
+        from dateutil.parser import parse
+
+        return parse(value)
+
+    def detect(self, value: str) -> bool:
+        for pattern, fast_parse in self.FORMATS:
+            if pattern.fullmatch(value):
+                self.pattern = pattern
+                self.fast_parse = fast_parse
+                return True
+        return False
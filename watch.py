@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Watch a directory of reports and keep tax summary up to date.
+
+    ./watch.py statements/ [--year 2023 | --years 2021-2023] [--interval 2]
+
+Every file's trades are kept per (account, symbol) key along with the
+costs and dividends it reported. When files are added, changed or removed,
+FIFO runs again only for keys those files have trades of, or keys of
+symbols whose splits changed. Contributions of keys and files to taxation
+are kept separately, so the summary is patched by taking the old ones back
+and merging the recalculated ones. Recalculation time depends on the
+change, not on the size of the whole portfolio.
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Collection, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+
+from calc_trades import parse_years
+from corporate_actions import DEFAULT_FILE, CorporateActions
+from ingest import EventRecorder, ParseCache, ingest_file
+from taxations import SUPPORTED_TAXATIONS
+from taxations.base_taxation import BaseTaxation
+from taxations.multi_year_taxation import MultiYearTaxation
+from tradelog import TradeLog, TradeRecord
+from utils import logger
+
+Key = Tuple[str, str]
+
+
+class FileContribution(NamedTuple):
+    # Key -> trades as TradeLog (method, args, kwargs) events
+    trades: Dict[Key, List[Tuple[str, tuple, dict]]]
+    splits: CorporateActions
+    # Costs and dividends reported by the file
+    taxation: BaseTaxation
+
+
+class IncrementalCalculation:
+    """
+    Taxation of report files, kept up to date with `update` as files change.
+    Keys are recalculated with the same FIFO and valuation as a full run,
+    their trades in files order, so totals are the same as with calc_trades.py
+    run for all files in that order.
+    """
+
+    def __init__(
+        self,
+        taxation: BaseTaxation,
+        tax_years: Union[int, Collection[int]],
+        fifo_engine: str = "lots",
+        corporate_actions: Optional[CorporateActions] = None,
+    ) -> None:
+        self.taxation = taxation
+        self.tax_years = tax_years
+        self.fifo_engine = fifo_engine
+        self.corporate_actions = (
+            corporate_actions if corporate_actions is not None else CorporateActions()
+        )
+        self.files: Dict[str, FileContribution] = {}
+        # Key -> FIFO valuation of its trades
+        self.keys: Dict[Key, BaseTaxation] = {}
+
+    def file_contribution(self, recorder: EventRecorder) -> FileContribution:
+        trades = {}
+        splits = CorporateActions()
+        taxation = self.taxation.spawn()
+        for method, args, kwargs in recorder.events:
+            if method == "add_trade":
+                key = kwargs["account"], kwargs["symbol"]
+                trades.setdefault(key, []).append((method, args, kwargs))
+            elif method == "add_record":
+                trades.setdefault(args[0].key, []).append((method, args, kwargs))
+            elif method == "add_split":
+                splits.add_split(*args, **kwargs)
+            else:
+                getattr(taxation, method)(*args, **kwargs)
+        return FileContribution(trades, splits, taxation)
+
+    def update(self, changes: Dict[str, Optional[EventRecorder]]) -> Set[Key]:
+        """
+        Apply events of added or changed files and drop removed ones, mapped
+        to None. Returns keys recalculated.
+        """
+        dirty = set()
+        split_symbols = set()
+        for filename, recorder in changes.items():
+            old = self.files.pop(filename, None)
+            if old is not None:
+                self.taxation.merge(old.taxation, sign=-1)
+                dirty.update(old.trades)
+                split_symbols.update(old.splits.splits)
+            if recorder is not None:
+                new = self.files[filename] = self.file_contribution(recorder)
+                self.taxation.merge(new.taxation)
+                dirty.update(new.trades)
+                split_symbols.update(new.splits.splits)
+
+        corporate_actions = self.corporate_actions.copy()
+        for contribution in self.files.values():
+            for symbol, splits in contribution.splits.splits.items():
+                for split in splits:
+                    corporate_actions.add_split(symbol, *split)
+        if split_symbols:
+            dirty.update(key for key in self.keys if key[1] in split_symbols)
+
+        for key in dirty:
+            self.recalculate(key, corporate_actions)
+        return dirty
+
+    def recalculate(self, key: Key, corporate_actions: CorporateActions) -> None:
+        old = self.keys.pop(key, None)
+        if old is not None:
+            self.taxation.merge(old, sign=-1)
+
+        contribution = self.taxation.spawn()
+        trade_log = TradeLog(
+            contribution, self.fifo_engine, "objects", corporate_actions
+        )
+        for filename in sorted(self.files):
+            for method, args, kwargs in self.files[filename].trades.get(key, ()):
+                if method == "add_record":
+                    # Records are converted for splits in place, keep events intact
+                    args = tuple(record.copy() for record in args)
+                getattr(trade_log, method)(*args, **kwargs)
+        if not trade_log.records:
+            return
+
+        trade_log.apply_corporate_actions()
+        trades: List[TradeRecord] = sorted(
+            trade_log.records[key], key=lambda t: t.timestamp
+        )
+        trade_log.calc_profit_fifo(trades, self.tax_years)
+        self.keys[key] = contribution
+        self.taxation.merge(contribution)
+
+
+def scan(directory) -> Dict[str, Tuple[int, int]]:
+    """Report files in directory with their modification time and size."""
+    files = {}
+    for path in Path(directory).iterdir():
+        if path.is_file() and not path.name.startswith("."):
+            stat = path.stat()
+            files[str(path)] = stat.st_mtime_ns, stat.st_size
+    return files
+
+
+def ingest_changes(
+    changed: List[str],
+    removed: List[str],
+    tax_years: Union[int, Collection[int]],
+    cache: Optional[ParseCache],
+) -> Dict[str, Optional[EventRecorder]]:
+    """Events of changed files, None for removed and unreadable ones."""
+    changes = dict.fromkeys(removed)
+    for filename in changed:
+        try:
+            _, _, recorder, _ = ingest_file((filename, tax_years, cache))
+        # File can be unknown, or still being written, retried once it changes
+        except Exception as e:
+            logger.warning(f"Skipping {filename}: {type(e).__name__}: {e}")
+            recorder = None
+        changes[filename] = recorder
+    return changes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recalculate tax summary as reports in a directory change."
+    )
+    parser.add_argument("directory", help="directory with report files")
+    parser.add_argument(
+        "--tax",
+        help="taxation method",
+        choices=list(SUPPORTED_TAXATIONS.keys()),
+        default="PL_NBP_FIFO",
+    )
+    years_group = parser.add_mutually_exclusive_group()
+    years_group.add_argument(
+        "--year", help="tax year", type=int, default=datetime.now().year - 1
+    )
+    years_group.add_argument(
+        "--years", help="compute several tax years in one pass, e.g. 2020-2025"
+    )
+    parser.add_argument(
+        "--fifo-engine",
+        help="FIFO matching implementation, legacy is kept for transition period",
+        choices=TradeLog.FIFO_ENGINES,
+        default="lots",
+    )
+    parser.add_argument(
+        "--corporate-actions",
+        help="CSV file with splits not included in reports, see the default one",
+        default=DEFAULT_FILE,
+    )
+    parser.add_argument(
+        "--parse-cache",
+        help="reuse events of files parsed before, see README",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--interval", help="seconds between directory scans", type=float, default=2
+    )
+    parser.add_argument(
+        "--once", help="calculate current files and exit", action="store_true"
+    )
+    parser.add_argument(
+        "--log",
+        type=str,
+        help="log level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log))
+
+    if args.years:
+        try:
+            tax_years = parse_years(args.years)
+        except ValueError as e:
+            parser.error(f"--years: {e}")
+        if tax_years is None:
+            parser.error("--years all isn't supported, list the years")
+        taxation = MultiYearTaxation(
+            SUPPORTED_TAXATIONS[args.tax](max(tax_years)), tax_years
+        )
+    else:
+        tax_years = args.year
+        taxation = SUPPORTED_TAXATIONS[args.tax](args.year)
+    calculation = IncrementalCalculation(
+        taxation,
+        tax_years,
+        args.fifo_engine,
+        CorporateActions.load(args.corporate_actions),
+    )
+    parse_cache = ParseCache() if args.parse_cache else None
+
+    files = {}
+    while True:
+        current = scan(args.directory)
+        changed = sorted(name for name in current if current[name] != files.get(name))
+        removed = sorted(name for name in files if name not in current)
+        files = current
+        if changed or removed:
+            started = time.perf_counter()
+            changes = ingest_changes(changed, removed, tax_years, parse_cache)
+            dirty = calculation.update(changes)
+            logger.info(
+                f"{len(changed)} files changed, {len(removed)} removed, "
+                f"recalculated {len(dirty)} of {len(calculation.keys)} positions "
+                f"in {time.perf_counter() - started:.3f}s"
+            )
+            logger.info(calculation.taxation.summary)
+        if args.once:
+            break
+        time.sleep(args.interval)